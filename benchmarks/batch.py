@@ -0,0 +1,106 @@
+# batch.py compares a page load of many small API calls sent one by one against the same calls sent as one batch
+# [core/batch.py], over a local socket against core.serve: calls answered right away, and calls that wait
+# a few milliseconds on I/O, which the batch runs in parallel.
+#
+# Run from the project directory: python -m benchmarks.batch [--calls 10 --pages 200]
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.load_runner import free_port, percentile, start_server
+
+ROUTES_YAML = """\
+resources:
+  - page
+tweaks:
+  controller: {}
+  path: {}
+"""
+
+CONTROLLERS = {
+    "fast.py": "def get(request):\n    return {'id': request.query.get('id'), 'name': 'item'}\n",
+    "io.py": (
+        "import time\n\n\n"
+        "def get(request):\n"
+        "    time.sleep(0.005)\n"
+        "    return {'id': request.query.get('id'), 'name': 'item'}\n"
+    ),
+}
+
+
+def make_project(root):
+    directory = os.path.join(root, "controllers", "page")
+    os.makedirs(directory)
+    for name, source in CONTROLLERS.items():
+        with open(os.path.join(directory, name), "w") as file:
+            file.write(source)
+    with open(os.path.join(root, "routes.yaml"), "w") as file:
+        file.write(ROUTES_YAML)
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection("localhost", port, timeout=10)
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"{method} {path} answered {response.status}: {data[:200]!r}")
+    return data
+
+
+def one_by_one(port, paths):
+    for path in paths:
+        request(port, "GET", path)
+
+
+def batched(port, paths):
+    body = json.dumps([{"method": "GET", "path": path} for path in paths])
+    request(port, "POST", "/batch", body)
+
+
+def measure(function, port, paths, pages):
+    for _ in range(min(pages, 20)):
+        function(port, paths)
+    latencies = []
+    for _ in range(pages):
+        started = time.perf_counter()
+        function(port, paths)
+        latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=10, help="API calls per page load")
+    parser.add_argument("--pages", type=int, default=200, help="page loads per scenario")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_project(root)
+        port = free_port()
+        process = start_server([sys.executable, "-m", "core.serve", "--workers", "1"], port, cwd=root)
+        try:
+            print(f"{args.calls} calls per page, {args.pages} pages")
+            print(f"{'controller':<18} {'sent':<12} {'p50 ms':>9} {'p99 ms':>9}")
+            for controller in ("fast", "io"):
+                paths = [f"/page/{controller}?id={i}" for i in range(args.calls)]
+                for name, function in (("one by one", one_by_one), ("as a batch", batched)):
+                    latencies = measure(function, port, paths, args.pages)
+                    print(
+                        f"{controller:<18} {name:<12} "
+                        f"{percentile(latencies, 0.50) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f}"
+                    )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
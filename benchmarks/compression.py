@@ -0,0 +1,44 @@
+# compression.py measures the cost of compressing a typical JSON response per request with every
+# installed encoding and level, against serving the compressed body from the variant cache.
+#
+# Run from the project directory: python -m benchmarks.compression
+
+import timeit
+
+from core.compression import Compressor, load_encodings
+from core.serializers import serializer
+
+NUMBER = 2_000
+
+BODY = serializer.dumps([
+    {"id": i, "name": f"user-{i}", "email": f"user-{i}@example.com", "active": i % 3 == 0}
+    for i in range(500)
+])
+
+
+def response(etag=None):
+    headers = [("Content-Type", "application/json"), ("Content-Length", str(len(BODY)))]
+    if etag:
+        headers.append(("ETag", etag))
+    return "200 OK", headers, BODY
+
+
+def main():
+    print(f"{len(BODY)} bytes of JSON, {NUMBER} responses")
+    print(f"{'encoding':<10} {'level':>5} {'bytes':>8} {'ratio':>7} {'µs/response':>12} {'cached µs':>10}")
+    for encoding in load_encodings(("gzip", "br", "zstd")):
+        for level in sorted({1, encoding.default_level, encoding.max_level}):
+            compressor = Compressor(level=level, encodings=[encoding.name])
+            environ = {"HTTP_ACCEPT_ENCODING": encoding.name}
+            _, _, body = compressor.compress(environ, response())
+            uncached = min(timeit.repeat(lambda: compressor.compress(environ, response()), number=NUMBER, repeat=3))
+            cached_response = response(f'"{encoding.name}-{level}"')
+            cached = min(timeit.repeat(lambda: compressor.compress(environ, cached_response), number=NUMBER, repeat=3))
+            print(
+                f"{encoding.name:<10} {level:>5} {len(body):>8} {len(BODY) / len(body):>7.1f} "
+                f"{uncached / NUMBER * 1e6:>12.1f} {cached / NUMBER * 1e6:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# database_pool.py compares opening a SQLite connection per request against the pooled sessions
+# of core/initializers/database.py, with and without the prepared statement cache.
+#
+# Run from the project directory: python -m benchmarks.database_pool
+
+import logging
+import os
+import sqlite3
+import tempfile
+import timeit
+
+from core.initializers.database import Database
+
+logging.disable(logging.CRITICAL)
+
+NUMBER = 20_000
+QUERY = "SELECT id, name FROM users WHERE id = ?"
+
+
+def setup(filename):
+    connection = sqlite3.connect(filename)
+    connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+    connection.executemany("INSERT INTO users (name) VALUES (?)", [(f"user-{i}",) for i in range(1000)])
+    connection.commit()
+    connection.close()
+
+
+def connection_per_request(filename):
+    def request():
+        connection = sqlite3.connect(filename)
+        connection.execute(QUERY, (42,)).fetchone()
+        connection.commit()
+        connection.close()
+    return request
+
+
+def pooled_session(database):
+    def request():
+        with database.session() as session:
+            session.fetch_one(QUERY, (42,))
+    return request
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "bench.sqlite3")
+        setup(filename)
+        candidates = {
+            "connection per request": connection_per_request(filename),
+            "pooled, statement cache": pooled_session(Database({"filename": filename})),
+            "pooled, no statement cache": pooled_session(Database({"filename": filename, "cached_statements": 0})),
+            "pooled, no pre-ping": pooled_session(Database({"filename": filename, "pre_ping": False})),
+        }
+        print(f"{NUMBER} requests running one indexed SELECT")
+        for name, request in candidates.items():
+            seconds = min(timeit.repeat(request, number=NUMBER, repeat=3))
+            print(f"{name:<28} {seconds / NUMBER * 1e6:>8.2f} µs/request")
+
+
+if __name__ == "__main__":
+    main()
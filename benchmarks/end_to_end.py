@@ -0,0 +1,250 @@
+# end_to_end.py benchmarks the whole WSGI stack on representative routes of a generated project: an exact path,
+# an index fallback, a pattern route, a 404, a 405, and JSON against text responses.
+# Each route is driven in-process through core.server.app with synthetic environ dicts, reporting requests per
+# second, p50/p95/p99 latency and the memory allocated per request, and over a local socket by concurrent
+# clients against core.serve. Results can be saved as a baseline, and later runs are compared against it.
+#
+# Run from the project directory: python -m benchmarks.end_to_end [--save] [--baseline NAME] [--no-socket]
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.load_runner import free_port, load, percentile, start_server
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# (name, method, path)
+SCENARIOS = (
+    ("exact path, JSON", "GET", "/json"),
+    ("exact path, text", "GET", "/bench/text"),
+    ("index fallback", "GET", "/bench"),
+    ("pattern route", "GET", "/users/42"),
+    ("404 not found", "GET", "/missing/path"),
+    ("405 not allowed", "POST", "/json"),
+)
+
+ROUTES_YAML = """\
+resources:
+  - bench
+tweaks:
+  controller:
+    bench.json:
+      path: /json
+      allowed_methods: [ GET ]
+  path:
+    /users/{id:int}:
+      controller: bench.user
+"""
+
+CONTROLLERS = {
+    "index.py": "def get(request):\n    return {'page': 'index'}\n",
+    "json.py": (
+        "def get(request):\n"
+        "    return {'users': [{'id': i, 'name': f'user-{i}', 'active': i % 2 == 0} for i in range(20)]}\n"
+    ),
+    "text.py": "def get(request):\n    return 'plain text response'\n",
+    "user.py": "def get(request):\n    return {'id': request.params['id']}\n",
+}
+
+
+# production mode, without the startup output and caches that don't matter to a single run
+IN_PROCESS_ENVIRONMENT = {"ENV": "production", "PRINT_ROUTES": "0", "ROUTE_MANIFEST": "", "AUTH_SECRET": "benchmark"}
+
+
+def make_project(root):
+    directory = os.path.join(root, "controllers", "bench")
+    os.makedirs(directory)
+    for name, source in CONTROLLERS.items():
+        with open(os.path.join(directory, name), "w") as file:
+            file.write(source)
+    with open(os.path.join(root, "routes.yaml"), "w") as file:
+        file.write(ROUTES_YAML)
+
+
+def make_environ(method, path):
+    return {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "8000",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1",
+        "HTTP_ACCEPT": "*/*",
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(b""),
+    }
+
+
+def run_in_process(number):
+    """
+    Runs in the generated project [the router reads routes.yaml from the working directory]
+    and prints the results as JSON.
+    """
+    import logging
+    import tracemalloc
+
+    from core.server import app
+
+    logging.disable(logging.CRITICAL)
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def call(method, path):
+        body = app(make_environ(method, path), start_response)
+        b"".join(body)
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+    results = {}
+    for name, method, path in SCENARIOS:
+        for _ in range(min(number, 1000)):
+            call(method, path)
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(number):
+            request_started = time.perf_counter_ns()
+            call(method, path)
+            latencies.append(time.perf_counter_ns() - request_started)
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+
+        # allocations are traced apart, as tracing slows every allocation down
+        samples = max(number // 10, 100)
+        tracemalloc.start()
+        allocated = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            call(method, path)
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        blocks = sys.getallocatedblocks()
+        for _ in range(samples):
+            call(method, path)
+        retained = (sys.getallocatedblocks() - blocks) / samples
+        tracemalloc.stop()
+
+        results[name] = {
+            "rps": number / elapsed,
+            "p50": percentile(latencies, 0.50) / 1e9,
+            "p95": percentile(latencies, 0.95) / 1e9,
+            "p99": percentile(latencies, 0.99) / 1e9,
+            "allocated_bytes": allocated / samples,
+            "retained_blocks": retained,
+        }
+    json.dump(results, sys.stdout)
+
+
+def in_process(root, number):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.end_to_end", "--in-process", "--number", str(number)],
+        cwd=root, env=dict(os.environ, PYTHONPATH=os.getcwd(), **IN_PROCESS_ENVIRONMENT),
+        stdout=subprocess.PIPE, check=True, text=True,
+    )
+    return json.loads(result.stdout)
+
+
+def over_socket(root, clients, seconds, workers, threads):
+    command = [sys.executable, "-m", "core.serve", "--workers", str(workers), "--threads", str(threads)]
+    port = free_port()
+    process = start_server(command, port, cwd=root)
+    results = {}
+    try:
+        for name, method, path in SCENARIOS:
+            if method != "GET":
+                # the load generator only sends GET requests
+                continue
+            latencies, errors = load(port, path, clients, seconds)
+            results[name] = {
+                "rps": len(latencies) / seconds,
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "errors": errors,
+            }
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def change(current, baseline, key):
+    if not baseline or key not in baseline or not baseline[key]:
+        return ""
+    return f"{(current[key] - baseline[key]) / baseline[key] * 100:+.0f}%"
+
+
+def report(title, results, baseline, columns):
+    print(title)
+    header = f"{'scenario':<20} {'req/s':>9} {'Δ':>5} {'p50 µs':>9} {'p95 µs':>9} {'p99 µs':>9} {'Δ':>5}"
+    print(header + "".join(f" {label:>{width}}" for label, _, width, _ in columns))
+    for name, current in results.items():
+        previous = (baseline or {}).get(name)
+        line = (
+            f"{name:<20} {current['rps']:>9.0f} {change(current, previous, 'rps'):>5} "
+            f"{current['p50'] * 1e6:>9.1f} {current['p95'] * 1e6:>9.1f} {current['p99'] * 1e6:>9.1f} "
+            f"{change(current, previous, 'p99'):>5}"
+        )
+        print(line + "".join(f" {current[key]:>{width}{spec}}" for _, key, width, spec in columns))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20_000, help="requests per in-process scenario")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of each socket scenario")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--no-socket", action="store_true", help="only run the in-process scenarios")
+    parser.add_argument("--baseline", default="default", help="name of the baseline to compare with and save")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.in_process:
+        run_in_process(args.number)
+        return
+
+    baseline_path = os.path.join(BASELINES_DIR, f"end_to_end.{args.baseline}.json")
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        make_project(root)
+        results["in_process"] = in_process(root, args.number)
+        report(
+            f"in-process, {args.number} requests per scenario", results["in_process"],
+            baseline and baseline.get("in_process"),
+            [("alloc B/req", "allocated_bytes", 12, ".0f"), ("kept/req", "retained_blocks", 9, ".2f")],
+        )
+        if not args.no_socket:
+            results["socket"] = over_socket(root, args.clients, args.seconds, args.workers, args.threads)
+            report(
+                f"socket, {args.clients} clients, {args.seconds}s per scenario, {args.workers} workers",
+                results["socket"], baseline and baseline.get("socket"), [("errors", "errors", 7, "")],
+            )
+
+    if baseline is None and not args.save:
+        print(f"No baseline '{args.baseline}' yet; save one with --save")
+    if args.save:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(baseline_path, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved the baseline to {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
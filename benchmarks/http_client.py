@@ -0,0 +1,115 @@
+# http_client.py compares a new connection per call, which is what a bare `requests.get` does,
+# against the pooled client in core/client.py, on a local keep-alive HTTP server.
+# It reports the calls per second, the mean latency and how many connections the server accepted.
+#
+# Run from the project directory: python -m benchmarks.http_client
+
+import asyncio
+import http.client
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.client import HTTPClient, AsyncHTTPClient
+
+logging.disable(logging.CRITICAL)
+
+CALLS = 2000
+THREADS = 8
+BODY = json.dumps({"domain": "example.com", "age": 27}).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately; without this, delayed ACKs stall kept-alive connections
+    disable_nagle_algorithm = True
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StandInHandler.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("localhost", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fresh_connection(url_host, port):
+    connection = http.client.HTTPConnection(url_host, port, timeout=10)
+    connection.request("GET", "/domage?domain=example.com")
+    response = connection.getresponse()
+    data = json.loads(response.read())
+    connection.close()
+    return data
+
+
+def measure(name, call, threads):
+    StandInHandler.connections = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(lambda _: timed(call), range(CALLS)))
+    elapsed = time.perf_counter() - started
+    report(name, elapsed, latencies, StandInHandler.connections)
+
+
+def timed(call):
+    started = time.perf_counter()
+    call()
+    return time.perf_counter() - started
+
+
+def report(name, elapsed, latencies, connections):
+    mean = sum(latencies) / len(latencies) * 1000
+    print(f"{name:<28} {CALLS / elapsed:>10.0f} {mean:>10.3f} {connections:>12}")
+
+
+async def measure_async(name, client, url, concurrency):
+    StandInHandler.connections = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def call():
+        async with semaphore:
+            started = time.perf_counter()
+            (await client.get(url)).json()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(CALLS)))
+    report(name, time.perf_counter() - started, latencies, StandInHandler.connections)
+
+
+def main():
+    server = start_server()
+    port = server.server_address[1]
+    url = f"http://localhost:{port}/domage"
+    client = HTTPClient(max_connections=THREADS)
+
+    print(f"{CALLS} GET calls to a local server")
+    print(f"{'client':<28} {'calls/s':>10} {'mean ms':>10} {'connections':>12}")
+    for threads in (1, THREADS):
+        measure(f"new connection, {threads} thread(s)", lambda: fresh_connection("localhost", port), threads)
+        measure(f"pooled, {threads} thread(s)", lambda: client.get(url, params={"domain": "example.com"}).json(), threads)
+    async_client = AsyncHTTPClient(HTTPClient(max_connections=THREADS))
+    asyncio.run(measure_async(f"pooled async, {THREADS} tasks", async_client, url, THREADS))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# json_backends.py compares the JSON serializer backends on representative payloads,
+# including the previous json.dumps + encode path of `destruct`.
+#
+# Run from the project directory: python -m benchmarks.json_backends
+
+import dataclasses
+import datetime
+import json
+import timeit
+
+from core.serializers import SERIALIZERS, default
+
+
+@dataclasses.dataclass
+class Order:
+    id: int
+    customer: str
+    total: float
+    paid: bool
+    created_at: datetime.datetime
+    tags: list
+
+
+CREATED_AT = datetime.datetime(2023, 4, 1, 12, 30)
+
+PAYLOADS = {
+    "small dict": {"status": "ok", "count": 3, "items": ["1", 2, "2", "nepal", 2.3, {"hey": "2"}]},
+    "1k records": [
+        {"id": i, "name": f"user {i}", "email": f"user{i}@example.com", "score": i * 1.5, "active": i % 2 == 0}
+        for i in range(1_000)
+    ],
+    "1k dataclasses": [
+        Order(i, f"customer {i}", i * 9.99, i % 3 == 0, CREATED_AT, ["express", "gift"]) for i in range(1_000)
+    ],
+    "nested unicode": {
+        "domain": "नेपाल.com",
+        "history": [{"year": 2000 + i, "owners": [{"name": "Bishwas", "country": "नेपाल"}] * 5} for i in range(50)],
+    },
+}
+
+
+def legacy_dumps(data):
+    # the previous destruct: json.dumps to str, then a separate encode pass
+    return json.dumps(data, default=default).encode("utf-8")
+
+
+def available_serializers():
+    serializers = {"legacy json.dumps": legacy_dumps}
+    for name, serializer_class in SERIALIZERS.items():
+        try:
+            serializers[name] = serializer_class().dumps
+        except ImportError:
+            print(f"{name} is not installed, skipping it")
+    return serializers
+
+
+def main():
+    serializers = available_serializers()
+    print(f"{'Payload':<18}" + "".join(f"{name:>20}" for name in serializers) + "   (us/call)")
+    for label, payload in PAYLOADS.items():
+        number = 20_000 if label == "small dict" else 200
+        timings = [timeit.timeit(lambda: dumps(payload), number=number) / number for dumps in serializers.values()]
+        print(f"{label:<18}" + "".join(f"{timing * 1e6:>20.1f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
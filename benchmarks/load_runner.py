@@ -0,0 +1,112 @@
+# load_runner.py load-tests the single-process wsgiref runner [core/server.py] against the
+# preforking runner [core.serve] with concurrent keep-alive-less clients, like browsers without pooling.
+#
+# Run from the project directory: python -m benchmarks.load_runner [--path / --clients 32 --seconds 5]
+
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"The server on port {port} did not start")
+
+
+def start_server(command, port, cwd=None):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])))
+    env.setdefault("ENV", "production")
+    process = subprocess.Popen(
+        command + ["--host", "localhost", "--port", str(port)],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_until_ready(port)
+    return process
+
+
+def client(port, path, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection("localhost", port, timeout=10)
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+        except OSError:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def load(port, path, clients, seconds):
+    latencies, errors = [], []
+    deadline = time.monotonic() + seconds
+    threads = [threading.Thread(target=client, args=(port, path, deadline, latencies, errors)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), len(errors)
+
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return float("nan")
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    runners = {
+        "core/server.py": [sys.executable, "core/server.py"],
+        f"core.serve x{args.workers}": [sys.executable, "-m", "core.serve", "--workers", str(args.workers)],
+        f"core.serve x{args.workers} --threads {args.threads}": [
+            sys.executable, "-m", "core.serve", "--workers", str(args.workers), "--threads", str(args.threads),
+        ],
+    }
+
+    print(f"GET {args.path}, {args.clients} clients, {args.seconds}s per runner")
+    print(f"{'runner':<32} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, command in runners.items():
+        port = free_port()
+        process = start_server(command, port)
+        try:
+            latencies, errors = load(port, args.path, args.clients, args.seconds)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+        print(
+            f"{name:<32} {len(latencies) / args.seconds:>10.0f} "
+            f"{percentile(latencies, 0.50) * 1000:>9.2f} {percentile(latencies, 0.95) * 1000:>9.2f} "
+            f"{percentile(latencies, 0.99) * 1000:>9.2f} {errors:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# rate_limit.py measures the overhead core/ratelimit.py adds to a request: one client, 100k distinct
+# clients [IP addresses] cycling through the in-process store, the same from several threads,
+# and the SQLite store shared by processes.
+#
+# Run from the project directory: python -m benchmarks.rate_limit
+
+import os
+import tempfile
+import threading
+import time
+
+from core.ratelimit import RateLimit, RateLimiter, RateLimitExceeded, SQLiteBackend, backends
+
+NUMBER = 500_000
+KEYS = 100_000
+THREADS = 4
+
+
+class FakeRequest:
+    __slots__ = ("environ",)
+
+    def __init__(self, ip):
+        self.environ = {"REMOTE_ADDR": ip}
+
+
+def requests(count):
+    return [FakeRequest(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}") for i in range(count)]
+
+
+def run(limiter, clients, number):
+    allowed = 0
+    check = limiter.check
+    for i in range(number):
+        try:
+            check(clients[i % len(clients)])
+            allowed += 1
+        except RateLimitExceeded:
+            pass
+    return allowed
+
+
+def measure(limiter, clients, number=NUMBER, threads=1):
+    started = time.perf_counter()
+    workers = [threading.Thread(target=run, args=(limiter, clients, number // threads)) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / number * 1e9
+
+
+def main():
+    clients = requests(KEYS)
+    print(f"{'store':<32} {'ns/request':>10}")
+    print(f"{'memory, 1 client':<32} {measure(RateLimiter([RateLimit('1000000/s')]), clients[:1]):>10.0f}")
+    memory = RateLimiter([RateLimit("100/s")])
+    print(f"{'memory, 100k clients':<32} {measure(memory, clients):>10.0f}")
+    print(f"{f'memory, 100k clients, {THREADS} threads':<32} {measure(memory, clients, threads=THREADS):>10.0f}")
+    print(f"keys kept in memory: {len(backends[None])}")
+
+    path = os.path.join(tempfile.mkdtemp(), "rate-limits.sqlite3")
+    backends["core.ratelimit.SQLiteBackend"] = SQLiteBackend(path)
+    sqlite = RateLimiter([RateLimit("100/s", backend="core.ratelimit.SQLiteBackend")])
+    print(f"{'sqlite, 100k clients':<32} {measure(sqlite, clients, number=KEYS):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
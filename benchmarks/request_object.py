@@ -0,0 +1,106 @@
+# request_object.py compares the per-request latency and allocations of the lazy Request against
+# the previous Request, which copied eleven environ keys into attributes on every request.
+#
+# Run from the project directory: python -m benchmarks.request_object
+
+import io
+import json
+import timeit
+import tracemalloc
+
+from core.essentials import Request
+
+NUMBER = 200_000
+
+
+class LegacyRequest:
+    accepts = {}
+
+    method = ''
+    body = ''
+    path = ''
+
+    query = {}
+    params = {}
+
+    cookies = {}
+    files = {}
+
+    server_name = ''
+    server_port = ''
+    user_agent = ''
+    authorization = ''
+
+    def __init__(self, environ):
+        self.accepts = environ.get("HTTP_ACCEPT")
+        self.method = environ.get("REQUEST_METHOD")
+        self.body = environ.get("wsgi.input")
+        self.path = environ.get("PATH_INFO")
+        self.query = environ.get("QUERY_STRING")
+        self.server_name = environ.get("SERVER_NAME")
+        self.server_port = environ.get("SERVER_PORT")
+        self.user_agent = environ.get("HTTP_USER_AGENT")
+        self.cookies = environ.get("HTTP_COOKIE")
+        self.files = environ.get("wsgi.input")
+        self.authorization = environ.get("HTTP_AUTHORIZATION")
+
+
+BODY = json.dumps({"name": "example.com", "tags": ["a", "b"]}).encode("utf-8")
+
+
+def make_environ():
+    return {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/domain/age",
+        "QUERY_STRING": "page=2&sort=name",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "8000",
+        "HTTP_ACCEPT": "application/json",
+        "HTTP_USER_AGENT": "benchmark",
+        "HTTP_COOKIE": "session=abc; theme=dark",
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(BODY)),
+        "wsgi.input": io.BytesIO(BODY),
+    }
+
+
+def untouched(request_class, environ):
+    # a handler that only looks at the method and path
+    request = request_class(environ)
+    return request.method, request.path
+
+
+def parsed(environ):
+    # a handler that reads the query, the cookies and the JSON body
+    environ["wsgi.input"].seek(0)
+    request = Request(environ)
+    return request.query, request.cookies, request.json
+
+
+def allocated_bytes(function, number=10_000):
+    tracemalloc.start()
+    kept = [function() for _ in range(number)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / number
+
+
+def main():
+    environ = make_environ()
+    cases = (
+        ("legacy, body untouched", lambda: untouched(LegacyRequest, environ)),
+        ("lazy, body untouched", lambda: untouched(Request, environ)),
+        ("legacy, construct only", lambda: LegacyRequest(environ)),
+        ("lazy, construct only", lambda: Request(environ)),
+        ("lazy, query+cookies+json", lambda: parsed(environ)),
+    )
+
+    print(f"{'Case':<28}{'ns/request':>12}{'bytes/request':>16}")
+    for label, function in cases:
+        elapsed = timeit.timeit(function, number=NUMBER) / NUMBER
+        print(f"{label:<28}{elapsed * 1e9:>12.1f}{allocated_bytes(function):>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# route_matching.py measures pattern route matching latency as the number of routes grows,
+# comparing the route tree against a linear scan over compiled regexes.
+#
+# Run from the project directory: python -m benchmarks.route_matching
+
+import re
+import timeit
+
+from core.initializers.tree import RouteTree
+
+SIZES = (10, 1_000, 10_000)
+
+
+def declared_path(index):
+    return f"/api/resource{index}/{{id:int}}/items/{{item}}"
+
+
+def request_path(index):
+    return f"/api/resource{index}/42/items/abc"
+
+
+def build_tree(size):
+    tree = RouteTree()
+    for index in range(size):
+        tree.insert(declared_path(index), index)
+    return tree
+
+
+def build_regexes(size):
+    regexes = []
+    for index in range(size):
+        pattern = re.sub(r"\{(\w+):int\}", r"(?P<\1>\\d+)", declared_path(index))
+        pattern = re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", pattern)
+        regexes.append((re.compile(f"^{pattern}$"), index))
+    return regexes
+
+
+def match_regexes(regexes, path):
+    for regex, route in regexes:
+        match = regex.match(path)
+        if match:
+            return route, match.groupdict()
+    return None, None
+
+
+def main():
+    print(f"{'Routes':>8}{'Target':>10}{'tree (ns/match)':>18}{'regex list (ns/match)':>24}")
+    for size in SIZES:
+        tree = build_tree(size)
+        regexes = build_regexes(size)
+        number = max(1_000, 2_000_000 // size)
+        for label, index in (("first", 0), ("last", size - 1), ("miss", size)):
+            path = request_path(index)
+            tree_time = timeit.timeit(lambda: tree.match(path), number=100_000) / 100_000
+            regex_time = timeit.timeit(lambda: match_regexes(regexes, path), number=number) / number
+            print(f"{size:>8}{label:>10}{tree_time * 1e9:>18.1f}{regex_time * 1e9:>24.1f}")
+
+
+if __name__ == "__main__":
+    main()
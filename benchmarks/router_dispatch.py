@@ -0,0 +1,71 @@
+# router_dispatch.py compares the per-request dispatch cost of the compiled dispatch table against
+# the lookups render_api and utils.validate_request used to do on the raw `paths` dict.
+#
+# Run from the project directory: python -m benchmarks.router_dispatch
+# It measures production mode by default; ENV=development adds the registry's mtime checks.
+
+import importlib
+import logging
+import os
+import timeit
+
+os.environ.setdefault("ENV", "production")
+
+from core.constants import CONTROLLERS_ROOT, GLOBAL_METHODS, RESTRICTED_PATH_NAMES
+from core.initializers.router import dispatch_table, paths
+from core.utils import format_path
+
+logging.disable(logging.CRITICAL)
+
+NUMBER = 200_000
+
+
+def legacy_dispatch(path, method):
+    # the previous render_api: path rewriting, several `paths` lookups and an import per request
+    if len(path.split("/")) == 2 and path not in RESTRICTED_PATH_NAMES:
+        path = f"{path}/index"
+    if not paths.get(path):
+        path = format_path(path)
+    try:
+        controller_name = paths[path]["controller_name"]
+    except KeyError:
+        return None
+    if paths[path].get("allowed_methods") is not None:
+        if method not in paths[path]["allowed_methods"]:
+            return None
+    try:
+        mod = importlib.import_module(f"{CONTROLLERS_ROOT}.{controller_name}")
+    except ModuleNotFoundError:
+        return None
+    if hasattr(mod, method.lower()):
+        return getattr(mod, method.lower())
+    return None
+
+
+def compiled_dispatch(path, method):
+    route = dispatch_table.get(path)
+    if route is None:
+        return None
+    if route.allowed_methods is not None and method not in route.allowed_methods:
+        return None
+    if route.handlers is None:
+        return None
+    return route.handlers.get(method)
+
+
+def main():
+    samples = sorted(set(paths) | {"/missing/path"})
+    method = GLOBAL_METHODS[0]
+
+    print(f"{'Path':<20}{'legacy (ns/req)':>18}{'compiled (ns/req)':>20}{'speedup':>10}")
+    for path in samples:
+        legacy = timeit.timeit(lambda: legacy_dispatch(path, method), number=NUMBER)
+        compiled = timeit.timeit(lambda: compiled_dispatch(path, method), number=NUMBER)
+        print(
+            f"{path:<20}{legacy / NUMBER * 1e9:>18.1f}{compiled / NUMBER * 1e9:>20.1f}"
+            f"{legacy / compiled:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
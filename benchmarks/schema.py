@@ -0,0 +1,110 @@
+# schema.py compares decoding and validating a JSON order with the compiled decoders of core/schema.py,
+# from a dataclass and from a JSON Schema, against json.loads and the dict checks controllers write by hand.
+#
+# Run from the project directory: python -m benchmarks.schema
+
+import json
+import timeit
+from dataclasses import dataclass, field
+from typing import Optional, TypedDict
+
+from core.schema import Validator
+from core.serializers import serializer
+
+NUMBER = 50_000
+
+
+class Line(TypedDict):
+    sku: str
+    qty: int
+    price: float
+
+
+@dataclass
+class Order:
+    customer: str
+    lines: list[Line]
+    express: bool = False
+    note: Optional[str] = None
+    tags: list[str] = field(default_factory=list)
+
+
+ORDER_SCHEMA = {
+    "type": "object",
+    "required": ["customer", "lines"],
+    "properties": {
+        "customer": {"type": "string"},
+        "lines": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["sku", "qty", "price"],
+                "properties": {"sku": {"type": "string"}, "qty": {"type": "integer"}, "price": {"type": "number"}},
+            },
+        },
+        "express": {"type": "boolean", "default": False},
+        "note": {"type": ["string", "null"]},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+BODY = json.dumps({
+    "customer": "c-1042",
+    "lines": [{"sku": f"sku-{i}", "qty": i + 1, "price": 9.5} for i in range(5)],
+    "express": True,
+    "note": None,
+    "tags": ["gift", "priority"],
+}).encode()
+
+
+def manual(body):
+    # what controllers did before schemas: parse, then check every field by hand
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("expected an object")
+    customer = data.get("customer")
+    if not isinstance(customer, str):
+        raise ValueError("customer")
+    lines = data.get("lines")
+    if not isinstance(lines, list):
+        raise ValueError("lines")
+    for line in lines:
+        if not isinstance(line, dict):
+            raise ValueError("line")
+        if not isinstance(line.get("sku"), str):
+            raise ValueError("sku")
+        qty = line.get("qty")
+        if not isinstance(qty, int) or isinstance(qty, bool):
+            raise ValueError("qty")
+        if not isinstance(line.get("price"), (int, float)):
+            raise ValueError("price")
+    express = data.get("express", False)
+    if not isinstance(express, bool):
+        raise ValueError("express")
+    note = data.get("note")
+    if note is not None and not isinstance(note, str):
+        raise ValueError("note")
+    tags = data.get("tags", [])
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags")
+    return Order(customer, lines, express, note, tags)
+
+
+def main():
+    dataclass_validator = Validator(Order)
+    json_schema_validator = Validator(ORDER_SCHEMA)
+    cases = (
+        ("json.loads + manual checks", lambda: manual(BODY)),
+        (f"{serializer.name} + dataclass decoder", lambda: dataclass_validator.decode(serializer.loads(BODY))),
+        (f"{serializer.name} + JSON Schema decoder", lambda: json_schema_validator.decode(serializer.loads(BODY))),
+        ("json.loads + dataclass decoder", lambda: dataclass_validator.decode(json.loads(BODY))),
+    )
+    print(f"{len(BODY)} bytes of JSON")
+    print(f"{'decoding':<36} {'µs/body':>8} {'bodies/s':>10}")
+    for name, decode in cases:
+        seconds = min(timeit.repeat(decode, number=NUMBER, repeat=3)) / NUMBER
+        print(f"{name:<36} {seconds * 1e6:>8.2f} {1 / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
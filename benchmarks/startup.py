@@ -0,0 +1,114 @@
+# startup.py measures how long building the route table takes at startup, for a generated project with
+# thousands of controllers: with the pure Python and the C YAML loaders, with the route manifest cache
+# cold and warm, and with the route table printed. In production, where every controller is imported before
+# the workers are forked, the warm manifest is compared with the route module of `python -m core.generate --manifest`.
+#
+# Run from the project directory: python -m benchmarks.startup
+
+import os
+import subprocess
+import sys
+import tempfile
+
+RESOURCES = 50
+CONTROLLERS_PER_RESOURCE = 60
+TWEAKS = 1000
+REPEAT = 5
+
+# the modules the router depends on are imported first, so only the route table is timed
+MEASURE = """
+import sys, time
+import yaml
+if "--pure-yaml" in sys.argv:
+    del yaml.CFullLoader
+import core.cache, core.coalesce, core.compression, core.middleware, core.ratelimit, core.schema
+import core.initializers.registry, core.initializers.tree
+started = time.perf_counter()
+import core.initializers.router
+if "--preload" in sys.argv:
+    # as core/serve.py does before forking the workers
+    from core.initializers.registry import handler_registry
+    from core.initializers.router import iter_routes, refresh_handlers
+    handler_registry.preload({route.controller_name for route in iter_routes()})
+    refresh_handlers()
+sys.stderr.write(f"{time.perf_counter() - started}\\n")
+"""
+
+
+def make_project(root):
+    os.makedirs(os.path.join(root, "controllers"))
+    resources = []
+    for r in range(RESOURCES):
+        resource = f"resource{r}"
+        resources.append(resource)
+        directory = os.path.join(root, "controllers", resource)
+        os.makedirs(directory)
+        for c in range(CONTROLLERS_PER_RESOURCE):
+            with open(os.path.join(directory, f"controller{c}.py"), "w") as file:
+                file.write("def get(request):\n    return {}\n")
+
+    lines = ["resources:"] + [f"  - {resource}" for resource in resources] + ["tweaks:", "  controller:"]
+    for t in range(TWEAKS):
+        lines += [
+            f"    resource{t % RESOURCES}.controller{t % CONTROLLERS_PER_RESOURCE}:",
+            f"      path: /custom/{t}",
+            "      allowed_methods: [ GET, POST ]",
+            "      cache:",
+            "        ttl: 30",
+            "        vary:",
+            "          query: [ id ]",
+        ]
+    lines += ["  path:", "    /health:", "      controller: resource0.controller0"]
+    with open(os.path.join(root, "routes.yaml"), "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def measure(root, manifest, print_routes=False, pure_yaml=False, warm=False, production=False, route_module=False):
+    environment = dict(
+        os.environ, PYTHONPATH=os.getcwd(), ROUTE_MANIFEST=manifest, PRINT_ROUTES="1" if print_routes else "0",
+        ENV="production" if production else "development", USE_ROUTE_MODULE="1" if route_module else "0",
+    )
+    # deployments import controllers from their cached bytecode
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    arguments = [sys.executable, "-c", MEASURE] + (["--pure-yaml"] if pure_yaml else [])
+    if production:
+        arguments.append("--preload")
+    timings = []
+    for _ in range(REPEAT):
+        if manifest and not warm and os.path.exists(manifest):
+            os.remove(manifest)
+        result = subprocess.run(
+            arguments, cwd=root, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+        )
+        timings.append(float(result.stderr.strip().splitlines()[-1]))
+    return min(timings) * 1000
+
+
+def generate_route_module(root):
+    subprocess.run(
+        [sys.executable, "-m", "core.generate", "--manifest"], cwd=root,
+        env=dict(os.environ, PYTHONPATH=os.getcwd()), stdout=subprocess.DEVNULL, check=True,
+    )
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        make_project(root)
+        generate_route_module(root)
+        manifest = os.path.join(root, "__pycache__", "routes.manifest")
+        print(f"{RESOURCES * CONTROLLERS_PER_RESOURCE} controllers, {TWEAKS} tweaks in routes.yaml")
+        print(f"{'startup':<36} {'ms':>8}")
+        for name, options in (
+            ("pure Python YAML, no manifest", {"manifest": "", "pure_yaml": True}),
+            ("C YAML loader, no manifest", {"manifest": ""}),
+            ("C YAML loader, no manifest, printed", {"manifest": "", "print_routes": True}),
+            ("manifest, cold", {"manifest": manifest}),
+            ("manifest, warm", {"manifest": manifest, "warm": True}),
+            ("production, manifest, warm", {"manifest": manifest, "warm": True, "production": True}),
+            ("production, route module", {"manifest": "", "production": True, "route_module": True}),
+        ):
+            print(f"{name:<36} {measure(root, **options):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# token_auth.py compares verifying a bearer token on every request [signature check and JSON decoding]
+# against the verified-token cache of core/probe/authenticate.py, and the cache once it's full and evicting.
+#
+# Run from the project directory: python -m benchmarks.token_auth
+
+import timeit
+
+from core.entities.user import User
+from core.probe.authenticate import Authenticator
+
+NUMBER = 100_000
+
+
+def main():
+    authenticator = Authenticator("benchmark-secret", cache_size=10_000)
+    token = authenticator.issue(User("bob", "bob@example.com", "42", ("admin",)))
+    authenticator.verify(token)
+
+    uncached = min(timeit.repeat(lambda: authenticator.decode(token), number=NUMBER, repeat=3))
+    cached = min(timeit.repeat(lambda: authenticator.verify(token), number=NUMBER, repeat=3))
+
+    # more distinct tokens than the cache holds, so every verification evicts one
+    tokens = [authenticator.issue(User(f"user-{i}")) for i in range(20_000)]
+    cycle = iter(tokens * (NUMBER // len(tokens) + 1))
+    evicting = timeit.timeit(lambda: authenticator.verify(next(cycle)), number=NUMBER)
+
+    print(f"{'verification':<22} {'µs/token':>9}")
+    print(f"{'uncached':<22} {uncached / NUMBER * 1e6:>9.2f}")
+    print(f"{'cached':<22} {cached / NUMBER * 1e6:>9.2f}")
+    print(f"{'full cache, evicting':<22} {evicting / NUMBER * 1e6:>9.2f}")
+    print(f"cache entries: {len(authenticator.cache.entries)}, hits: {authenticator.cache.hits}")
+
+
+if __name__ == "__main__":
+    main()
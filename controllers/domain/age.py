@@ -1,14 +1,17 @@
+from dataclasses import dataclass
+
 from core import essentials
-import requests
+from core.schema import validate
+
+
+@dataclass
+class DomainAge:
+    name: str
+
 
+@validate(DomainAge)
 def post(request: essentials.Request):
-    domain_name = request.body.get("name")
-    if domain_name:
-        response = requests.get(f'https://ipty.de/domage/api.php?domain={domain_name}&mode=full')
-        data = response.json()
-    else:
-        data = {
-            "error": "No domain name provided"
-        }
-    return data
-    
\ No newline at end of file
+    response = request.http.get(
+        "https://ipty.de/domage/api.php", params={"domain": request.data.name, "mode": "full"}
+    )
+    return response.json()
@@ -0,0 +1,227 @@
+# batch.py answers many API calls in one HTTP request. Clients POST a JSON list of sub-requests to BATCH_PATH:
+#
+#   [
+#     {"method": "GET", "path": "/users/42"},
+#     {"method": "GET", "path": "/orders?user=42", "headers": {"X-Api-Key": "..."}},
+#     {"method": "POST", "path": "/audit", "body": {"event": "page_view"}}
+#   ]
+#
+# and get a JSON list back, in the same order: [{"status": 200, "headers": {...}, "body": ...}, ...].
+# Every sub-request goes through the same router, rate limits, caches, schemas and controllers as a request
+# of its own, with the headers of the batch request [e.g. Authorization] unless it sets them. JSON bodies are
+# embedded as they are, other bodies as text.
+#
+# Consecutive GET, HEAD and OPTIONS sub-requests run in parallel, in a pool of BATCH_THREADS threads per process;
+# any other method waits for the ones before it and runs on its own, so writes keep their order.
+# A batch holds at most BATCH_MAX_ITEMS sub-requests and gets BATCH_TIMEOUT seconds: the ones that didn't
+# finish by then are answered with a 504, and the ones after them aren't run. A sub-request that was already
+# running keeps running to the end, as a thread can't be stopped, so a write answered with that 504 may still
+# be committed; its 504 says so, and the tasks it defers are dropped.
+
+import asyncio
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from core.constants import BATCH_MAX_ITEMS, BATCH_PATH, BATCH_THREADS, BATCH_TIMEOUT
+from core.essentials import DEFERRED_TASKS_KEY, JSON_CONTENT_TYPE, STATUS, Request, RequestException
+from core.serializers import serializer
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+# keys of the batch request that sub-requests don't inherit; its conditional headers would answer
+# unrelated cached sub-requests with an empty 304
+OWN_KEYS = frozenset((
+    "REQUEST_METHOD", "PATH_INFO", "QUERY_STRING", "CONTENT_TYPE", "CONTENT_LENGTH", "HTTP_ACCEPT_ENCODING",
+    "HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE", "HTTP_IF_MATCH", "HTTP_IF_UNMODIFIED_SINCE", "HTTP_IF_RANGE",
+    "HTTP_RANGE", "wsgi.input", "wsgi.input_terminated", "wsgiorg.routing_args", DEFERRED_TASKS_KEY,
+))
+
+# response headers left out of the items
+SKIPPED_HEADERS = frozenset(("Content-Length", "Access-Control-Allow-Origin"))
+
+
+def item_error(message, status):
+    return status, [("Content-Type", "text/plain")], message.encode("utf-8")
+
+
+TIMED_OUT = item_error("The batch ran out of time before this request ran.", STATUS.GATEWAY_TIMEOUT_504)
+STILL_RUNNING = item_error(
+    "The batch ran out of time while this request was running; it may still complete.", STATUS.GATEWAY_TIMEOUT_504
+)
+
+
+def plan(items):
+    """
+    Yields the indexes of the sub-requests to run together: runs of safe methods, and every other one alone.
+    """
+    group = []
+    for index, item in enumerate(items):
+        if item["method"] in SAFE_METHODS:
+            group.append(index)
+            continue
+        if group:
+            yield group
+            group = []
+        yield [index]
+    if group:
+        yield group
+
+
+def encode_item(status, headers, body):
+    content_type = ""
+    kept = {}
+    for name, value in headers:
+        if name == "Content-Type":
+            content_type = value
+        if name not in SKIPPED_HEADERS:
+            kept[name] = value
+    if not (content_type.startswith(JSON_CONTENT_TYPE) and body):
+        body = serializer.dumps(body.decode("utf-8", "replace"))
+    return b'{"status":%d,"headers":%s,"body":%s}' % (int(status[:3]), serializer.dumps(kept), body)
+
+
+class Batch:
+    """
+    Runs the sub-requests of batch requests; see the top of this module.
+    """
+
+    def __init__(self, path="/batch", max_items=20, timeout=10.0, threads=8):
+        self.path = path
+        self.max_items = max_items
+        self.timeout = timeout
+        # its threads are started on first use, so forked workers start their own
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="batch")
+
+    def parse(self, environ):
+        """
+        Returns the sub-requests of a batch request, or raises a RequestException for a malformed batch.
+        """
+        request = Request(environ)
+        if request.method != "POST":
+            raise RequestException("Batches are sent with POST.", STATUS.METHOD_NOT_ALLOWED_405)
+        if request.content_type != JSON_CONTENT_TYPE:
+            raise RequestException("Batches are sent as application/json.", STATUS.UNSUPPORTED_MEDIA_TYPE_415)
+        items = request.json
+        if type(items) is not list:
+            raise RequestException("A batch is a JSON list of {method, path, body} objects.")
+        if len(items) > self.max_items:
+            raise RequestException(
+                f"A batch holds at most {self.max_items} requests, this one has {len(items)}.",
+                STATUS.PAYLOAD_TOO_LARGE_413,
+            )
+        parsed = []
+        for index, item in enumerate(items):
+            path = item.get("path") if type(item) is dict else None
+            if type(path) is not str or not path.startswith("/"):
+                raise RequestException(f"Request {index} of the batch has no path.")
+            method = item.get("method", "GET")
+            headers = item.get("headers") or {}
+            if type(method) is not str or type(headers) is not dict:
+                raise RequestException(f"Request {index} of the batch has an invalid method or headers.")
+            parsed.append({"method": method.upper(), "path": path, "body": item.get("body"), "headers": headers})
+        return parsed
+
+    def item_environ(self, environ, item):
+        path, _, query = item["path"].partition("?")
+        sub_environ = {key: value for key, value in environ.items() if key not in OWN_KEYS}
+        sub_environ["REQUEST_METHOD"] = item["method"]
+        sub_environ["PATH_INFO"] = path
+        sub_environ["QUERY_STRING"] = query
+        for name, value in item["headers"].items():
+            key = name.upper().replace("-", "_")
+            sub_environ[key if key == "CONTENT_TYPE" else f"HTTP_{key}"] = str(value)
+        # bodies are embedded in the JSON of the batch, so they're never compressed, even when an item asks
+        sub_environ.pop("HTTP_ACCEPT_ENCODING", None)
+
+        body = item["body"]
+        if body is None:
+            body = b""
+        elif type(body) is str:
+            body = body.encode("utf-8")
+            sub_environ.setdefault("CONTENT_TYPE", "text/plain; charset=utf-8")
+        else:
+            body = serializer.dumps(body)
+            sub_environ.setdefault("CONTENT_TYPE", JSON_CONTENT_TYPE)
+        sub_environ["CONTENT_LENGTH"] = str(len(body))
+        sub_environ["wsgi.input"] = io.BytesIO(body)
+        return sub_environ
+
+    def respond_to(self, respond, environ):
+        if environ["PATH_INFO"] == self.path:
+            return item_error("Batches can't be nested.", STATUS.BAD_REQUEST_400)
+        try:
+            return respond(environ)
+        except Exception:
+            logging.exception(f"Batched request {environ['REQUEST_METHOD']} {environ['PATH_INFO']} failed")
+            return item_error("Internal Server Error", STATUS.INTERNAL_SERVER_ERROR_500)
+
+    def run(self, environ, respond):
+        """
+        Runs a batch request with `respond(environ)`, which returns (status, headers, body bytes),
+        and returns the body of its response.
+        """
+        items = self.parse(environ)
+        environs = [self.item_environ(environ, item) for item in items]
+        responses = [TIMED_OUT] * len(items)
+        deadline = time.monotonic() + self.timeout
+        for group in plan(items):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            futures = {self.executor.submit(self.respond_to, respond, environs[index]): index for index in group}
+            done, pending = wait(futures, timeout=remaining)
+            for future in done:
+                responses[futures[future]] = future.result()
+            for future in pending:
+                responses[futures[future]] = STILL_RUNNING
+            if pending:
+                break
+        return self.finish(environ, environs, responses)
+
+    async def run_async(self, environ, respond_async):
+        """
+        Same as run, for the ASGI application; the sub-requests left when time is up are cancelled,
+        though plain controllers already running in the thread pool run to the end.
+        """
+        items = self.parse(environ)
+        environs = [self.item_environ(environ, item) for item in items]
+        responses = [TIMED_OUT] * len(items)
+        deadline = time.monotonic() + self.timeout
+        for group in plan(items):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            tasks = {
+                asyncio.ensure_future(self.respond_to_async(respond_async, environs[index])): index for index in group
+            }
+            done, pending = await asyncio.wait(tasks, timeout=remaining)
+            for task in done:
+                responses[tasks[task]] = task.result()
+            for task in pending:
+                task.cancel()
+                responses[tasks[task]] = STILL_RUNNING
+            if pending:
+                break
+        return self.finish(environ, environs, responses)
+
+    async def respond_to_async(self, respond_async, environ):
+        if environ["PATH_INFO"] == self.path:
+            return item_error("Batches can't be nested.", STATUS.BAD_REQUEST_400)
+        try:
+            return await respond_async(environ)
+        except Exception:
+            logging.exception(f"Batched request {environ['REQUEST_METHOD']} {environ['PATH_INFO']} failed")
+            return item_error("Internal Server Error", STATUS.INTERNAL_SERVER_ERROR_500)
+
+    def finish(self, environ, environs, responses):
+        # the tasks deferred by the sub-requests run once the batch response is sent
+        for sub_environ, response in zip(environs, responses):
+            tasks = sub_environ.get(DEFERRED_TASKS_KEY)
+            if tasks and response is not TIMED_OUT and response is not STILL_RUNNING:
+                environ.setdefault(DEFERRED_TASKS_KEY, []).extend(tasks)
+        return b"[" + b",".join(encode_item(*response) for response in responses) + b"]"
+
+
+batch = Batch(BATCH_PATH, BATCH_MAX_ITEMS, BATCH_TIMEOUT, BATCH_THREADS)
@@ -0,0 +1,216 @@
+# cache.py is the per-route response cache, declared in routes.yaml with a `cache` key:
+#
+#   cache:
+#     ttl: 60                  # seconds
+#     max_entries: 1000
+#     max_bytes: 10485760      # evicts least recently used responses beyond this size
+#     vary:
+#       query: [name]          # defaults to the whole query string
+#       headers: [accept]
+#       authorization: true    # default; responses are kept per Authorization header, false shares them
+#     backend: mypackage.caches.RedisCache   # optional, defaults to the in-process LRU
+#
+# Cached responses get a strong ETag, and requests with a matching If-None-Match
+# are answered with 304 Not Modified without running the controller or serializing anything.
+
+import hashlib
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+from core.essentials import STATUS
+
+
+class CacheBackend:
+    """
+    The interface of response cache backends. Entries are CachedResponse objects;
+    backends are responsible for their expiry and eviction.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class LRUCache(CacheBackend):
+    """
+    An in-process LRU cache bounded by number of entries and total body size.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None):
+        super().__init__(max_entries, max_bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        if self.max_bytes is not None and entry.size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = entry
+            self.size += entry.size
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def delete(self, key):
+        with self.lock:
+            self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"entries": len(self.entries), "bytes": self.size})
+        return stats
+
+
+class CachedResponse:
+    __slots__ = ("status", "headers", "body", "etag", "expires_at", "size")
+
+    def __init__(self, status, headers, body, etag, expires_at):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.size = len(body)
+
+
+def make_etag(body):
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def import_backend(dotted_path):
+    module_name, _, class_name = dotted_path.rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def vary_headers(vary):
+    """
+    Returns the environ keys of the headers a cache or coalescing key varies on. Authorization is one of them
+    unless `vary` sets `authorization: false`, so a user never gets a response built for another.
+    """
+    headers = tuple(f"HTTP_{header.upper().replace('-', '_')}" for header in vary.get("headers", ()))
+    if vary.get("authorization", True) and "HTTP_AUTHORIZATION" not in headers:
+        headers += ("HTTP_AUTHORIZATION",)
+    return headers
+
+
+class ResponseCache:
+    """
+    Caches the responses of one route; see the top of this module for its routes.yaml options.
+    """
+
+    def __init__(self, ttl=60, max_entries=1000, max_bytes=None, vary=None, backend=None):
+        vary = vary or {}
+        self.ttl = ttl
+        self.vary_query = tuple(vary["query"]) if vary.get("query") is not None else None
+        self.vary_headers = vary_headers(vary)
+        self.vary_header_value = ", ".join(vary.get("headers", ()))
+        backend_class = import_backend(backend) if backend else LRUCache
+        self.backend = backend_class(max_entries=max_entries, max_bytes=max_bytes)
+
+    @classmethod
+    def from_config(cls, config):
+        if not config:
+            return None
+        if config is True:
+            return cls()
+        return cls(**config)
+
+    def key(self, request):
+        environ = request.environ
+        if self.vary_query is None:
+            query = environ.get("QUERY_STRING", "")
+        else:
+            query = tuple(request.query.get(name) for name in self.vary_query)
+        return (request.path, query) + tuple(environ.get(header) for header in self.vary_headers)
+
+    def lookup(self, key, request):
+        """
+        Returns the cached (status, headers, body) for the key, a 304 response if the client
+        already has it, or None on a miss.
+        """
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        return self.respond(entry, request)
+
+    def store(self, key, request, response):
+        """
+        Caches a successful, fully built response and returns it with its ETag.
+        Streams and error responses are returned untouched.
+        """
+        status, headers, body = response
+        if type(body) is not bytes or not status.startswith("200"):
+            return response
+
+        etag = make_etag(body)
+        headers = headers + [("ETag", etag)]
+        if self.vary_header_value:
+            headers.append(("Vary", self.vary_header_value))
+        entry = CachedResponse(status, headers, body, etag, time.monotonic() + self.ttl)
+        self.backend.set(key, entry)
+        return self.respond(entry, request)
+
+    def respond(self, entry, request):
+        if_none_match = request.environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match and etag_matches(if_none_match, entry.etag):
+            headers = [(name, value) for name, value in entry.headers if name not in ("Content-Type", "Content-Length")]
+            return STATUS.NOT_MODIFIED_304, headers, b""
+        return entry.status, entry.headers, entry.body
+
+    def stats(self):
+        return self.backend.stats()
@@ -0,0 +1,332 @@
+# client.py is the outbound HTTP client for controllers, shared by the whole process:
+#
+#   def get(request):
+#       return request.http.get("https://api.example.com/users", params={"page": 1}).json()
+#
+#   async def get(request):
+#       response = await request.async_http.get("https://api.example.com/users")
+#
+# Connections are kept alive and reused per host, up to HTTP_CLIENT_MAX_CONNECTIONS at a time.
+# Idempotent requests are retried with exponential backoff on connection errors and on
+# 502, 503 and 504 responses; a kept-alive connection the server has closed is replaced silently.
+
+import asyncio
+import functools
+import http.client
+import json as jsonlib
+import os
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from core.constants import (
+    HTTP_CLIENT_BACKOFF,
+    HTTP_CLIENT_MAX_CONNECTIONS,
+    HTTP_CLIENT_RETRIES,
+    HTTP_CLIENT_TIMEOUT,
+)
+
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+# errors of a kept-alive connection the server closed while it was idle
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+# seconds after which an idle connection is closed instead of reused
+IDLE_TIMEOUT = 30.0
+
+USER_AGENT = "QuAPI"
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection to a host is free within the pool timeout.
+    """
+
+
+class StaleConnection(Exception):
+    pass
+
+
+class Response:
+    __slots__ = ("status", "reason", "headers", "body", "url")
+
+    def __init__(self, status, reason, headers, body, url):
+        self.status = status
+        self.reason = reason
+        # header names are lower-cased, e.g. {"content-type": "application/json"}
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    @property
+    def text(self):
+        return self.body.decode()
+
+    def json(self):
+        return jsonlib.loads(self.body)
+
+    def __repr__(self):
+        return f"<Response [{self.status}] {self.url}>"
+
+
+class ConnectionPool:
+    """
+    Keeps the idle connections to one host, and limits the connections open at a time.
+    The most recently used connection is reused first, so rarely used ones time out.
+    """
+
+    def __init__(self, scheme, host, port, max_connections, timeout, ssl_context=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.idle = []
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self, pool_timeout=None):
+        """
+        Returns a (connection, reused) pair; the connection must be given back with `release`.
+        """
+        if not self.slots.acquire(timeout=pool_timeout):
+            raise PoolTimeout(f"No connection to {self.host} was free within {pool_timeout}s")
+        now = time.monotonic()
+        with self.lock:
+            while self.idle:
+                connection, idle_since = self.idle.pop()
+                if now - idle_since < IDLE_TIMEOUT:
+                    self.reused += 1
+                    return connection, True
+                connection.close()
+            self.created += 1
+        return self.connect(), False
+
+    def release(self, connection, reusable):
+        if reusable:
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for connection, _ in self.idle:
+                connection.close()
+            self.idle.clear()
+
+    def stats(self):
+        return {"created": self.created, "reused": self.reused, "idle": len(self.idle)}
+
+
+def encode_body(json, data, headers):
+    headers = {"User-Agent": USER_AGENT, **(headers or {})}
+    if json is not None:
+        headers.setdefault("Content-Type", "application/json")
+        return jsonlib.dumps(json).encode(), headers
+    if isinstance(data, dict):
+        headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        return urlencode(data).encode(), headers
+    if isinstance(data, str):
+        return data.encode(), headers
+    return data, headers
+
+
+class HTTPClient:
+    """
+    A thread-safe HTTP/1.1 client with a connection pool per host.
+    """
+
+    def __init__(
+        self,
+        max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+        timeout=HTTP_CLIENT_TIMEOUT,
+        retries=HTTP_CLIENT_RETRIES,
+        backoff=HTTP_CLIENT_BACKOFF,
+        pool_timeout=None,
+    ):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_timeout = pool_timeout if pool_timeout is not None else timeout
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.ssl_context = None
+
+    def pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        pool = self.pools.get(key)
+        if pool is None:
+            with self.lock:
+                pool = self.pools.get(key)
+                if pool is None:
+                    if scheme == "https" and self.ssl_context is None:
+                        self.ssl_context = ssl.create_default_context()
+                    pool = self.pools[key] = ConnectionPool(
+                        scheme, host, port, self.max_connections, self.timeout, self.ssl_context
+                    )
+        return pool
+
+    def request(self, method, url, params=None, json=None, data=None, headers=None, timeout=None):
+        """
+        Sends a request and returns its Response with the whole body read.
+        Connection errors are raised once the retries are used up.
+        """
+        method = method.upper()
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL: {url}")
+        target = parts.path or "/"
+        query = "&".join(filter(None, (parts.query, urlencode(params) if params else "")))
+        if query:
+            target = f"{target}?{query}"
+        body, headers = encode_body(json, data, headers)
+        pool = self.pool(parts.scheme, parts.hostname, parts.port)
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        attempt = 0
+        while True:
+            try:
+                response = self.send(pool, method, target, body, headers, timeout, url)
+            except StaleConnection:
+                continue
+            except (OSError, http.client.HTTPException):
+                if attempt >= retries:
+                    raise
+            else:
+                if response.status not in RETRY_STATUSES or attempt >= retries:
+                    return response
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def send(self, pool, method, target, body, headers, timeout, url):
+        connection, reused = pool.acquire(self.pool_timeout)
+        reusable = False
+        try:
+            # kept-alive connections may carry the timeout of a previous request
+            connection.timeout = timeout if timeout is not None else pool.timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(connection.timeout)
+            try:
+                connection.request(method, target, body, headers)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if reused:
+                    raise StaleConnection()
+                raise
+            content = response.read()
+            reusable = not response.will_close
+            return Response(
+                response.status, response.reason, {name.lower(): value for name, value in response.getheaders()},
+                content, url,
+            )
+        finally:
+            pool.release(connection, reusable)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        return {f"{pool.scheme}://{pool.host}:{pool.port or ''}": pool.stats() for pool in list(self.pools.values())}
+
+
+class AsyncHTTPClient:
+    """
+    The async variant for async controllers. Requests run on the same pooled client in a thread pool
+    sized to the connection limit, so the event loop never blocks on the network.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(
+                        max_workers=self.client.max_connections, thread_name_prefix="http-client"
+                    )
+        return self.executor
+
+    async def request(self, method, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.get_executor(), functools.partial(self.client.request, method, url, **kwargs)
+        )
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url, **kwargs):
+        return await self.request("PUT", url, **kwargs)
+
+    async def patch(self, url, **kwargs):
+        return await self.request("PATCH", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        return await self.request("HEAD", url, **kwargs)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+http_client = HTTPClient()
+async_http_client = AsyncHTTPClient(http_client)
+
+
+def reset_after_fork():
+    # forked workers must not share sockets or inherit dead executor threads
+    http_client.pools = {}
+    http_client.lock = threading.Lock()
+    async_http_client.executor = None
+    async_http_client.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
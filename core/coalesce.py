@@ -0,0 +1,134 @@
+# coalesce.py is single-flight request coalescing, declared per route in routes.yaml with a `coalesce` key:
+#
+#   coalesce:
+#     vary:
+#       query: [name]        # defaults to the whole query string
+#       headers: [accept]
+#       authorization: true  # default; requests only share a run with the same Authorization header
+#
+# Concurrent GET requests with the same method, path and vary values share one run of the controller:
+# the first one runs it, the others wait for its response. It works both for threads and for
+# coroutines on the event loop; nothing is kept once the response is ready, unlike the response cache.
+# When the leading coroutine is cancelled, e.g. its client went away, one of the others runs the controller instead.
+
+import asyncio
+import threading
+
+from core.cache import vary_headers
+
+
+class LeaderCancelled(Exception):
+    """
+    Set on the future of a flight whose leader was cancelled; its followers start the flight again.
+    """
+
+
+class Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces the in-flight requests of one route; see the top of this module for its routes.yaml options.
+    """
+
+    def __init__(self, vary=None):
+        vary = vary or {}
+        self.vary_query = tuple(vary["query"]) if vary.get("query") is not None else None
+        self.vary_headers = vary_headers(vary)
+        self.flights = {}
+        self.lock = threading.Lock()
+        # futures of the ASGI application; they are only touched from the event loop thread
+        self.async_flights = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_config(cls, config):
+        if not config:
+            return None
+        if config is True:
+            return cls()
+        return cls(**config)
+
+    def key(self, request):
+        environ = request.environ
+        if self.vary_query is None:
+            query = environ.get("QUERY_STRING", "")
+        else:
+            query = tuple(request.query.get(name) for name in self.vary_query)
+        return (request.method, request.path, query) + tuple(environ.get(header) for header in self.vary_headers)
+
+    def run(self, key, function):
+        """
+        Returns (result, leader); `function` only runs in the leader, the first request with this key,
+        and the others get its result or exception.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, True
+
+    async def run_async(self, key, function):
+        """
+        Same as run, for coroutine functions on the event loop.
+        """
+        future = self.async_flights.get(key)
+        if future is not None:
+            self.coalesced += 1
+        while future is not None:
+            try:
+                # shielded, so a follower whose client goes away doesn't cancel the leader
+                return await asyncio.shield(future), False
+            except LeaderCancelled:
+                # the first follower to wake up leads the next flight, and the others follow it
+                future = self.async_flights.get(key)
+
+        future = self.async_flights[key] = asyncio.get_running_loop().create_future()
+        self.executions += 1
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            # the followers' requests are fine, so they aren't cancelled with the leader's
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # marks the exception as retrieved when no follower awaits it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self.async_flights[key]
+        return result, True
+
+    def stats(self):
+        return {"executions": self.executions, "coalesced": self.coalesced}
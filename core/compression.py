@@ -0,0 +1,388 @@
+# compression.py compresses responses with the best encoding the client accepts [Accept-Encoding].
+# gzip is always available; br and zstd are used when the brotli and zstandard packages are installed.
+# The encodings and their order of preference come from the COMPRESSION environment variable
+# [default: br,zstd,gzip; empty turns compression off], and routes can tune it in routes.yaml:
+#
+#   compress:
+#     level: 9                  # or per encoding, e.g. {gzip: 9, br: 5}
+#     min_size: 512             # smaller bodies are sent as they are [default: COMPRESSION_MIN_SIZE]
+#     encodings: [gzip]
+#
+# `compress: false` turns it off for a route. Only text-like content types are compressed, and
+# streamed responses are compressed chunk by chunk. Compressed bodies of cached responses are kept,
+# keyed by their ETag, so repeated hits are never compressed twice.
+
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from core.constants import COMPRESSION, COMPRESSION_MIN_SIZE
+from core.essentials import StreamingResponse
+
+COMPRESSIBLE_TYPES = frozenset((
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+))
+
+# compressed variants of cached responses kept at most
+MAX_VARIANTS = 1024
+
+
+class GzipEncoding:
+    name = "gzip"
+    default_level = 6
+    max_level = 9
+
+    def compress(self, data, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def stream(self, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        # every chunk is flushed, so clients get it as soon as it's produced
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+class BrotliEncoding:
+    name = "br"
+    # the higher levels are too slow for dynamic responses
+    default_level = 4
+    max_level = 11
+
+    def __init__(self):
+        import brotli
+
+        self.brotli = brotli
+
+    def compress(self, data, level):
+        return self.brotli.compress(data, quality=level)
+
+    def stream(self, level):
+        compressor = self.brotli.Compressor(quality=level)
+        return lambda chunk: compressor.process(chunk) + compressor.flush(), compressor.finish
+
+
+class ZstdEncoding:
+    name = "zstd"
+    default_level = 3
+    max_level = 22
+
+    def __init__(self):
+        import zstandard
+
+        self.zstandard = zstandard
+
+    def compress(self, data, level):
+        return self.zstandard.ZstdCompressor(level=level).compress(data)
+
+    def stream(self, level):
+        compressor = self.zstandard.ZstdCompressor(level=level).compressobj()
+        flush_block = self.zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(flush_block), compressor.flush
+
+
+ENCODINGS = {
+    "br": BrotliEncoding,
+    "zstd": ZstdEncoding,
+    "gzip": GzipEncoding,
+}
+
+
+def load_encodings(names):
+    """
+    Returns instances of the requested encodings, in order, skipping the ones that are not installed.
+    """
+    encodings = []
+    for name in names:
+        encoding_class = ENCODINGS.get(name)
+        if encoding_class is None:
+            logging.warning(f"Unknown compression encoding '{name}', skipping it")
+            continue
+        try:
+            encodings.append(encoding_class())
+        except ImportError:
+            pass
+    return tuple(encodings)
+
+
+def is_compressible(content_type):
+    content_type = content_type.partition(";")[0].strip().lower()
+    return (
+        content_type.startswith("text/")
+        or content_type in COMPRESSIBLE_TYPES
+        or content_type.endswith(("+json", "+xml"))
+    )
+
+
+def parse_accept_encoding(accept_encoding):
+    """
+    Returns {encoding: q} for an Accept-Encoding header, e.g. {"gzip": 1.0, "br": 0.5}.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        parameter, _, value = parameters.strip().partition("=")
+        if parameter.strip() == "q":
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def header_value(headers, name):
+    for header, value in headers:
+        if header == name:
+            return value
+    return None
+
+
+class CompressionStats:
+    """
+    Totals per encoding for the metrics endpoint: responses, bytes in and out, and CPU seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.encodings = {}
+
+    def record(self, encoding, bytes_in, bytes_out, cpu_seconds):
+        with self.lock:
+            totals = self.encodings.get(encoding)
+            if totals is None:
+                totals = self.encodings[encoding] = [0, 0, 0, 0.0]
+            totals[0] += 1
+            totals[1] += bytes_in
+            totals[2] += bytes_out
+            totals[3] += cpu_seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {encoding: tuple(totals) for encoding, totals in self.encodings.items()}
+
+
+class VariantCache:
+    """
+    Keeps compressed bodies by (ETag, encoding, level), least recently used first out.
+    """
+
+    def __init__(self, max_entries=MAX_VARIANTS):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return body
+
+    def set(self, key, body):
+        with self.lock:
+            self.entries[key] = body
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+compression_stats = CompressionStats()
+variant_cache = VariantCache()
+
+
+class CompressedStream:
+    """
+    Compresses a stream of bytes chunks as it's sent; closing it closes the underlying stream.
+    """
+
+    def __init__(self, chunks, encoding, level):
+        self.chunks = chunks
+        self.encoding = encoding
+        self.level = level
+
+    def __iter__(self):
+        compress, finish = self.encoding.stream(self.level)
+        bytes_in = bytes_out = 0
+        cpu_seconds = 0.0
+        for chunk in self.chunks:
+            started = time.thread_time()
+            compressed = compress(chunk)
+            cpu_seconds += time.thread_time() - started
+            bytes_in += len(chunk)
+            bytes_out += len(compressed)
+            if compressed:
+                yield compressed
+        tail = finish()
+        compression_stats.record(self.encoding.name, bytes_in, bytes_out + len(tail), cpu_seconds)
+        if tail:
+            yield tail
+
+    def close(self):
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class AsyncCompressedStream(CompressedStream):
+    """
+    Same as CompressedStream, for async iterators.
+    """
+
+    async def __aiter__(self):
+        compress, finish = self.encoding.stream(self.level)
+        bytes_in = bytes_out = 0
+        cpu_seconds = 0.0
+        async for chunk in self.chunks:
+            if type(chunk) is str:
+                chunk = chunk.encode("utf-8")
+            started = time.thread_time()
+            compressed = compress(chunk)
+            cpu_seconds += time.thread_time() - started
+            bytes_in += len(chunk)
+            bytes_out += len(compressed)
+            if compressed:
+                yield compressed
+        tail = finish()
+        compression_stats.record(self.encoding.name, bytes_in, bytes_out + len(tail), cpu_seconds)
+        if tail:
+            yield tail
+
+    async def aclose(self):
+        aclose = getattr(self.chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class Compressor:
+    """
+    Compresses the responses of a route; see the top of this module for its routes.yaml options.
+    """
+
+    def __init__(self, level=None, min_size=COMPRESSION_MIN_SIZE, encodings=None):
+        self.encodings = load_encodings(encodings) if encodings is not None else DEFAULT_ENCODINGS
+        self.min_size = min_size
+        self.levels = {}
+        for encoding in self.encodings:
+            encoding_level = level.get(encoding.name) if isinstance(level, dict) else level
+            if encoding_level is None:
+                encoding_level = encoding.default_level
+            self.levels[encoding.name] = min(encoding_level, encoding.max_level)
+        # Accept-Encoding headers repeat a lot, so the negotiated encoding is remembered per header value
+        self.negotiated = {}
+
+    @classmethod
+    def from_config(cls, config):
+        if config is False or not DEFAULT_ENCODINGS:
+            return None
+        if config is None or config is True:
+            return default_compressor
+        return cls(**config)
+
+    def negotiate(self, accept_encoding):
+        """
+        Returns the preferred encoding the client accepts, or None to send the body as it is.
+        """
+        if not accept_encoding:
+            return None
+        try:
+            return self.negotiated[accept_encoding]
+        except KeyError:
+            pass
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        chosen = None
+        for encoding in self.encodings:
+            if accepted.get(encoding.name, wildcard) > 0:
+                chosen = encoding
+                break
+        if len(self.negotiated) >= 256:
+            self.negotiated.clear()
+        self.negotiated[accept_encoding] = chosen
+        return chosen
+
+    def compress(self, environ, response, stream_chunks=iter):
+        """
+        Returns the response compressed for the client, or as it is when it's small, not text-like,
+        already encoded or the client accepts none of the encodings.
+        `stream_chunks` turns the content of a sync StreamingResponse into an iterator of bytes.
+        """
+        status, headers, body = response
+        content_type = header_value(headers, "Content-Type")
+        if (
+            content_type is None
+            or not is_compressible(content_type)
+            or header_value(headers, "Content-Encoding") is not None
+            or (type(body) is bytes and len(body) < self.min_size)
+        ):
+            return response
+
+        headers = add_vary(headers)
+        encoding = self.negotiate(environ.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None:
+            return status, headers, body
+        level = self.levels[encoding.name]
+
+        if type(body) is not bytes:
+            return self.compress_stream(status, headers, body, encoding, level, stream_chunks)
+
+        etag = header_value(headers, "ETag")
+        compressed = variant_cache.get((etag, encoding.name, level)) if etag else None
+        cpu_seconds = None
+        if compressed is None:
+            started = time.thread_time()
+            compressed = encoding.compress(body, level)
+            cpu_seconds = time.thread_time() - started
+            if etag:
+                variant_cache.set((etag, encoding.name, level), compressed)
+        if len(compressed) >= len(body):
+            return status, headers, body
+        # only counted when the compressed body is the one sent
+        if cpu_seconds is not None:
+            compression_stats.record(encoding.name, len(body), len(compressed), cpu_seconds)
+
+        encoded_headers = []
+        for name, value in headers:
+            if name == "Content-Length":
+                value = str(len(compressed))
+            elif name == "ETag" and not value.startswith("W/"):
+                # the compressed body is a different representation, so its validator is weak
+                value = f"W/{value}"
+            encoded_headers.append((name, value))
+        encoded_headers.append(("Content-Encoding", encoding.name))
+        return status, encoded_headers, compressed
+
+    def compress_stream(self, status, headers, stream, encoding, level, stream_chunks):
+        """
+        The length of a compressed stream is unknown up front, so it's sent with chunked transfer encoding.
+        """
+        if hasattr(stream.content, "__aiter__"):
+            content = AsyncCompressedStream(stream.content, encoding, level)
+        else:
+            content = CompressedStream(stream_chunks(stream.content), encoding, level)
+        compressed = StreamingResponse(content, stream.status, stream.content_type)
+        headers = [(name, value) for name, value in headers if name != "Content-Length"]
+        headers.append(("Content-Encoding", encoding.name))
+        return status, headers, compressed
+
+
+def add_vary(headers):
+    vary = header_value(headers, "Vary")
+    if vary is None:
+        return headers + [("Vary", "Accept-Encoding")]
+    if "accept-encoding" in vary.lower():
+        return headers
+    return [(name, f"{value}, Accept-Encoding" if name == "Vary" else value) for name, value in headers]
+
+
+DEFAULT_ENCODINGS = load_encodings(name.strip() for name in COMPRESSION.split(",") if name.strip())
+default_compressor = Compressor()
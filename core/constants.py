@@ -3,6 +3,65 @@ import os
 
 CONTROLLERS_ROOT = "controllers"
 ENV = os.environ.get("ENV", "development")
+# number of threads that run sync controllers under the ASGI application
+ASGI_THREAD_POOL_SIZE = int(os.environ.get("ASGI_THREAD_POOL_SIZE", 32))
+# JSON serializer backend; auto, orjson, msgspec or stdlib
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+# response encodings in order of preference; an empty value turns compression off, see core/compression.py
+COMPRESSION = os.environ.get("COMPRESSION", "br,zstd,gzip")
+# responses smaller than this many bytes are not compressed
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+# snapshot of the route declarations reused by cold starts, see core/initializers/manifest.py; empty turns it off
+ROUTE_MANIFEST = os.environ.get("ROUTE_MANIFEST", "__pycache__/routes.manifest")
+# module generated by `python -m core.generate --manifest`, imported at startup in place of routes.yaml and the
+# resource directories; on by default in production. See core/initializers/manifest.py
+ROUTE_MODULE = os.environ.get("ROUTE_MODULE", "routes_manifest")
+USE_ROUTE_MODULE = os.environ.get("USE_ROUTE_MODULE", "1" if ENV == "production" else "0") == "1"
+# prints the route table at startup; on by default in development
+PRINT_ROUTES = os.environ.get("PRINT_ROUTES", "0" if ENV == "production" else "1") == "1"
+# path of the Prometheus metrics endpoint; an empty value turns metrics off
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")
+# path of the batch endpoint; an empty value turns it off. See core/batch.py
+BATCH_PATH = os.environ.get("BATCH_PATH", "/batch")
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 20))  # sub-requests per batch
+BATCH_TIMEOUT = float(os.environ.get("BATCH_TIMEOUT", 10))  # seconds per batch
+BATCH_THREADS = int(os.environ.get("BATCH_THREADS", 8))  # sub-requests run at once, per process
+
+# sampled request profiling; see core/profiling.py
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))  # fraction of requests profiled
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")  # signs X-Profile headers; empty ignores them
+PROFILE_SLOW_THRESHOLD = float(os.environ.get("PROFILE_SLOW_THRESHOLD", 0))  # seconds; 0 logs no slow requests
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# outbound HTTP client; see core/client.py
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.environ.get("HTTP_CLIENT_MAX_CONNECTIONS", 10))  # per host
+HTTP_CLIENT_TIMEOUT = float(os.environ.get("HTTP_CLIENT_TIMEOUT", 10))  # seconds
+HTTP_CLIENT_RETRIES = int(os.environ.get("HTTP_CLIENT_RETRIES", 2))
+HTTP_CLIENT_BACKOFF = float(os.environ.get("HTTP_CLIENT_BACKOFF", 0.1))  # seconds, doubled per retry
+
+# token authentication; see core/probe/authenticate.py
+AUTH_SECRET = os.environ.get("AUTH_SECRET", "")
+AUTH_TOKEN_TTL = int(os.environ.get("AUTH_TOKEN_TTL", 3600))  # seconds
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))  # verified tokens kept
+
+# SQLite file shared by the processes using core.ratelimit.SQLiteBackend [default: in the temp directory]
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", "")
+
+# tasks deferred until the response is sent; see core/tasks.py
+TASK_WORKERS = int(os.environ.get("TASK_WORKERS", 4))  # threads per process
+TASK_QUEUE_SIZE = int(os.environ.get("TASK_QUEUE_SIZE", 1000))  # tasks waiting at most
+TASK_QUEUE_TIMEOUT = float(os.environ.get("TASK_QUEUE_TIMEOUT", 1))  # seconds to wait for room before running inline
+TASK_DRAIN_TIMEOUT = float(os.environ.get("TASK_DRAIN_TIMEOUT", 30))  # seconds given to queued tasks on shutdown
+
+# logging; see core/logger.py
+LOG_MODE = os.environ.get("LOG_MODE", "sync")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", 256))
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+# fraction of access logs kept once more than LOG_SAMPLE_THRESHOLD records are waiting
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+LOG_SAMPLE_THRESHOLD = int(os.environ.get("LOG_SAMPLE_THRESHOLD", 1000))
 
 
 class LOG_COLOR:
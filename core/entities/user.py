@@ -1,2 +1,29 @@
+import dataclasses
+
+
+@dataclasses.dataclass
 class User:
-    pass
+    """
+    The authenticated user of a request, built from the claims of its token.
+    """
+    username: str
+    email: str = ""
+    id: str = ""
+    roles: tuple = ()
+
+    @classmethod
+    def from_claims(cls, claims):
+        return cls(
+            username=claims.get("username", claims.get("sub", "")),
+            email=claims.get("email", ""),
+            id=str(claims.get("sub", "")),
+            roles=tuple(claims.get("roles", ())),
+        )
+
+    def to_claims(self):
+        return {
+            "sub": self.id or self.username,
+            "username": self.username,
+            "email": self.email,
+            "roles": list(self.roles),
+        }
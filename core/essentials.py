@@ -1,40 +1,228 @@
-import json
+from urllib.parse import parse_qsl
 
+from core.client import async_http_client, http_client
+from core.serializers import serializer
 
-class Request:
-    accepts = {}
+JSON_CONTENT_TYPE = "application/json"
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
 
-    method = ''
-    body = ''
-    path = ''
+# environ key of the tasks a request deferred until its response is sent
+DEFERRED_TASKS_KEY = "quapi.deferred_tasks"
 
-    query = {}
-    params = {}
+# marks a lazily parsed attribute that hasn't been parsed yet; None can be a parsed value
+NOT_PARSED = object()
 
-    cookies = {}
-    files = {}
 
-    server_name = ''
-    server_port = ''
-    user_agent = ''
-    authorization = ''
+class Request:
+    """
+    A view over the WSGI environ. Nothing is copied or parsed up front; the query string, cookies,
+    headers and body are parsed on first access and cached, and the body is read at most once.
+    """
+    __slots__ = (
+        "environ", "method", "path",
+        "_params", "_query", "_cookies", "_headers", "_raw_body", "_json", "_form", "_db", "_user",
+        "data",
+    )
 
     def __init__(self, environ):
-        self.accepts = environ.get("HTTP_ACCEPT")
+        self.environ = environ
         self.method = environ.get("REQUEST_METHOD")
-        self.body = environ.get("wsgi.input")
         self.path = environ.get("PATH_INFO")
-        self.query = environ.get("QUERY_STRING")
-        # self.params = environ.get("wsgiorg.routing_args")[1]
-        self.server_name = environ.get("SERVER_NAME")
-        self.server_port = environ.get("SERVER_PORT")
-        self.user_agent = environ.get("HTTP_USER_AGENT")
-        self.cookies = environ.get("HTTP_COOKIE")
-        self.files = environ.get("wsgi.input")
-        self.authorization = environ.get("HTTP_AUTHORIZATION")
+        self._params = None
+        self._query = None
+        self._cookies = None
+        self._headers = None
+        self._raw_body = None
+        self._json = NOT_PARSED
+        self._form = None
+        self._db = None
+        self._user = NOT_PARSED
+        # the body decoded by the schema of the controller method, see core/schema.py
+        self.data = None
+
+    @property
+    def params(self):
+        # captured values of pattern routes, e.g. {"id": 1} for /users/{id:int}
+        if self._params is None:
+            routing_args = self.environ.get("wsgiorg.routing_args")
+            self._params = routing_args[1] if routing_args else {}
+        return self._params
+
+    @params.setter
+    def params(self, params):
+        self._params = params
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = dict(parse_qsl(self.environ.get("QUERY_STRING", ""), keep_blank_values=True))
+        return self._query
+
+    @property
+    def cookies(self):
+        if self._cookies is None:
+            cookies = {}
+            for cookie in self.environ.get("HTTP_COOKIE", "").split(";"):
+                name, separator, value = cookie.partition("=")
+                if separator:
+                    cookies[name.strip()] = value.strip().strip('"')
+            self._cookies = cookies
+        return self._cookies
+
+    @property
+    def headers(self):
+        # header names are lower-cased and dashed, e.g. {"user-agent": "curl/8.0"}
+        if self._headers is None:
+            headers = {}
+            for key, value in self.environ.items():
+                if key.startswith("HTTP_"):
+                    headers[key[5:].replace("_", "-").lower()] = value
+                elif key in ("CONTENT_TYPE", "CONTENT_LENGTH") and value:
+                    headers[key.replace("_", "-").lower()] = value
+            self._headers = headers
+        return self._headers
+
+    @property
+    def content_type(self):
+        return self.environ.get("CONTENT_TYPE", "").partition(";")[0].strip().lower()
+
+    @property
+    def content_length(self):
+        try:
+            return max(int(self.environ.get("CONTENT_LENGTH") or 0), 0)
+        except ValueError:
+            return 0
+
+    @property
+    def raw_body(self):
+        """
+        The request body as bytes. It honors Content-Length and never reads past it,
+        unless the server marks the input as terminated.
+        """
+        if self._raw_body is None:
+            stream = self.environ.get("wsgi.input")
+            if stream is None:
+                self._raw_body = b""
+            elif self.environ.get("wsgi.input_terminated"):
+                self._raw_body = stream.read()
+            else:
+                length = self.content_length
+                self._raw_body = stream.read(length) if length else b""
+        return self._raw_body
+
+    @property
+    def json(self):
+        if self._json is NOT_PARSED:
+            raw_body = self.raw_body
+            try:
+                self._json = serializer.loads(raw_body) if raw_body else None
+            except ValueError as e:
+                raise RequestException("Request body is not valid JSON.", STATUS.BAD_REQUEST_400) from e
+        return self._json
+
+    @property
+    def form(self):
+        if self._form is None:
+            if self.content_type in (FORM_CONTENT_TYPE, ""):
+                body = self.raw_body.decode("utf-8", "replace")
+                self._form = dict(parse_qsl(body, keep_blank_values=True))
+            else:
+                self._form = {}
+        return self._form
+
+    @property
+    def body(self):
+        """
+        The decoded body; parsed JSON for JSON requests, form fields for form or untyped requests,
+        and the raw bytes for any other content type.
+        """
+        content_type = self.content_type
+        if content_type == JSON_CONTENT_TYPE:
+            return self.json
+        if content_type in (FORM_CONTENT_TYPE, ""):
+            return self.form
+        return self.raw_body
+
+    @property
+    def files(self):
+        return self.environ.get("wsgi.input")
+
+    @property
+    def accepts(self):
+        return self.environ.get("HTTP_ACCEPT")
+
+    @property
+    def server_name(self):
+        return self.environ.get("SERVER_NAME")
+
+    @property
+    def server_port(self):
+        return self.environ.get("SERVER_PORT")
+
+    @property
+    def user_agent(self):
+        return self.environ.get("HTTP_USER_AGENT")
+
+    @property
+    def authorization(self):
+        return self.environ.get("HTTP_AUTHORIZATION")
+
+    @property
+    def http(self):
+        # the pooled outbound HTTP client, shared by the whole process
+        return http_client
+
+    @property
+    def async_http(self):
+        return async_http_client
+
+    @property
+    def db(self):
+        """
+        The database session of this request; see core/initializers/database.py.
+        It's committed when the controller returns and rolled back when it raises.
+        """
+        if self._db is None:
+            from core.initializers.database import Session, database
+
+            if database is None:
+                raise RequestException("No database is configured in db.yaml.", STATUS.INTERNAL_SERVER_ERROR_500)
+            self._db = Session(database.pool)
+        return self._db
+
+    @property
+    def user(self):
+        """
+        The User of the request's bearer token, or None without one; see core/probe/authenticate.py.
+        An invalid, expired or revoked token raises a RequestException with a 401.
+        """
+        if self._user is NOT_PARSED:
+            from core.probe.authenticate import authenticator
+
+            self._user = authenticator.authenticate(self)
+        return self._user
+
+    @user.setter
+    def user(self, user):
+        self._user = user
+
+    def defer(self, function, *args, **kwargs):
+        """
+        Runs function(*args, **kwargs) once the response is sent; see core/tasks.py.
+        """
+        from core.tasks import task_queue
+
+        task_queue.defer(self, function, args, kwargs)
+
+    def cancel_deferred(self):
+        self.environ.pop(DEFERRED_TASKS_KEY, None)
+
+    def close_db(self, commit=True):
+        if self._db is not None:
+            self._db.close(commit)
 
     def __str__(self):
-        return f"<Essential.Request: {self.method}, {self.path}, {self.query}>"
+        return f"<Essential.Request: {self.method}, {self.path}, {self.environ.get('QUERY_STRING')}>"
 
 
 class STATUS:
@@ -64,3 +252,29 @@ class STATUS:
     UNSUPPORTED_MEDIA_TYPE_415 = "415 Unsupported Media Type"
     RANGE_NOT_SATISFIABLE_416 = "416 Range Not Satisfiable"
     EXPECTATION_FAILED_417 = "417 Expectation Failed"
+    TOO_MANY_REQUESTS_429 = "429 Too Many Requests"
+    INTERNAL_SERVER_ERROR_500 = "500 Internal Server Error"
+    SERVICE_UNAVAILABLE_503 = "503 Service Unavailable"
+    GATEWAY_TIMEOUT_504 = "504 Gateway Timeout"
+
+
+class RequestException(Exception):
+    def __init__(self, message, status=STATUS.BAD_REQUEST_400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class StreamingResponse:
+    """
+    A response whose body is sent piece by piece instead of being held in memory.
+    The content can be an iterable (or async iterable) of bytes or str chunks, or a binary file object.
+    Without a content_length, the body is streamed with chunked transfer encoding.
+    """
+    __slots__ = ("content", "status", "content_type", "content_length")
+
+    def __init__(self, content, status=STATUS.OK_200, content_type="application/octet-stream", content_length=None):
+        self.content = content
+        self.status = status
+        self.content_type = content_type
+        self.content_length = content_length
@@ -1,14 +1,30 @@
-#!/bin/python3
+#!/usr/bin/env python3
+# generate.py scaffolds controllers and regenerates the route module; run it from the project directory:
+#
+#   PYTHONPATH=. python -m core.generate -c shop order --methods get post --schema --cache 30 --rate-limit 100/minute
+#   PYTHONPATH=. python -m core.generate --manifest
+#
+# -c writes controllers/shop/order.py with the given methods, declares it in routes.yaml under tweaks.controller
+# [path, allowed_methods and the schema, cache and rate_limit asked for] and adds its resource to `resources`.
+# routes.yaml is edited in place, so its comments and layout are kept. Both then regenerate the route module
+# that production imports at startup instead of reading routes.yaml; see core/initializers/manifest.py.
 
 import argparse
-import logging
 import os
 import pathlib
+import re
 
-from constants import LOG_COLOR
+import yaml
+
+from core.constants import CONTROLLERS_ROOT, GLOBAL_METHODS, LOG_COLOR, ROUTE_MODULE
+from core.initializers.declarations import ROUTES_FILE, read_routes
+from core.initializers.manifest import RouteModule
 
 CURRENT_PATH = pathlib.Path(os.getcwd())
 
+# methods whose request body is validated with --schema
+BODY_METHODS = ("post", "put", "patch")
+
 
 def generate_content(params, handler_name, content, extension):
     parent_name = params[0]
@@ -24,25 +40,223 @@ def generate_content(params, handler_name, content, extension):
     with open(full_file_path, "w", encoding="UTF-8") as f:
         f.write(content)
 
-        logging.info("[CREATED] {}/{}.{}".format(file_path, child_name, extension))
+    print(f"{LOG_COLOR.OK_GREEN}[CREATED] {file_path}/{child_name}.{extension}{LOG_COLOR.ENDC}")
 
 
-def controller_generator():
+def schema_name(child_name):
+    return "".join(part.capitalize() for part in child_name.split("_")) + "Body"
+
+
+def controller_content(controller_name, methods, schema):
+    """
+    Returns the source of a controller with a function per method.
     """
-    This function generates a Python controller file with a default "Hello World" response.
+    lines = []
+    if schema:
+        lines += [
+            "from dataclasses import dataclass",
+            "",
+            "from core.essentials import STATUS, Request",
+            "",
+            "",
+            "@dataclass",
+            f"class {schema}:",
+            "    # the fields of the request body, validated before the controller runs; see core/schema.py",
+            "    name: str",
+        ]
+    else:
+        lines += ["from core.essentials import STATUS, Request"]
+
+    for method in methods:
+        lines += ["", "", f"def {method}(request: Request):"]
+        if schema and method in BODY_METHODS:
+            lines.append(f"    # request.data is the validated {schema}")
+            result = f'{{"controller": "{controller_name}", "name": request.data.name}}'
+        else:
+            result = f'{{"controller": "{controller_name}"}}'
+        status = "STATUS.CREATED_201" if method == "post" else "STATUS.OK_200"
+        lines.append(f"    return {result}, {status}")
+    return "\n".join(lines) + "\n"
+
+
+def route_entry(controller_name, path, methods, schema, cache, rate_limit):
+    """
+    Returns the declaration of a controller under tweaks.controller in routes.yaml.
+    """
+    entry = {
+        "path": path,
+        "allowed_methods": [method.upper() for method in methods],
+        # the controller is only served at `path`, not also at /<resource>/<name>
+        "unique": True,
+    }
+    if schema:
+        entry["schema"] = {
+            method.upper(): f"{CONTROLLERS_ROOT}.{controller_name}.{schema}"
+            for method in methods if method in BODY_METHODS
+        }
+    if cache:
+        entry["cache"] = {"ttl": cache}
+    if rate_limit:
+        entry["rate_limit"] = {"rate": rate_limit, "key": "ip"}
+    return entry
+
+
+def block_key(lines, key, start=0, end=None, indent=None):
     """
-    content = """def get(request):
-    return "Hello World", "200 OK"
+    Returns the index of the line `key:` opening a block, at the given indentation, or None.
     """
-    handler_name = "controllers"
+    pattern = re.compile(rf"^(\s*){re.escape(key)}:\s*(#.*)?$")
+    for index in range(start, len(lines) if end is None else end):
+        match = pattern.match(lines[index])
+        if match and (indent is None or len(match.group(1)) == indent):
+            return index
+    return None
+
+
+def block_end(lines, start):
+    # the block of a top-level key ends at the next top-level key
+    for index in range(start + 1, len(lines)):
+        line = lines[index]
+        if line.strip() and not line[0].isspace() and not line.startswith("#"):
+            return index
+    return len(lines)
+
+
+def indented(text, indent):
+    return [" " * indent + line for line in text.splitlines()]
+
+
+def add_resource(lines, routes, resource):
+    if resource in (routes.get("resources") or ()):
+        return lines
+    start = block_key(lines, "resources", indent=0)
+    if start is None:
+        if "resources" in routes:
+            return None
+        return ["resources:", f"  - {resource}"] + lines
+    # after the last item of the list
+    end = block_end(lines, start)
+    position = start + 1
+    item_indent = "  "
+    for index in range(start + 1, end):
+        match = re.match(r"^(\s*)- ", lines[index])
+        if match:
+            position = index + 1
+            item_indent = match.group(1)
+    return lines[:position] + [f"{item_indent}- {resource}"] + lines[position:]
+
+
+def add_controller(lines, routes, controller_name, entry):
+    entry_text = yaml.safe_dump({controller_name: entry}, sort_keys=False, default_flow_style=None)
+    tweaks = routes.get("tweaks")
+    start = block_key(lines, "tweaks", indent=0)
+    if start is None:
+        if tweaks is not None:
+            return None
+        return lines + ["tweaks:", "  controller:"] + indented(entry_text, 4) + ["  path: {}"]
+    if tweaks is None:
+        tweaks = {}
+    if type(tweaks) is not dict:
+        return None
+
+    end = block_end(lines, start)
+    controller = block_key(lines, "controller", start + 1, end)
+    if controller is None:
+        if tweaks.get("controller"):
+            # e.g. a flow mapping; routes.yaml is rewritten instead
+            return None
+        # a missing or empty `controller: {}` is replaced
+        lines = [line for line in lines[:end] if not re.match(r"^\s+controller:\s*\{\s*\}", line)] + lines[end:]
+        added = ["  controller:"] + indented(entry_text, 4)
+        if tweaks.get("path") is None:
+            added.append("  path: {}")
+        return lines[:start + 1] + added + lines[start + 1:]
+
+    # after the last controller declared
+    indent = len(lines[controller]) - len(lines[controller].lstrip())
+    position = controller + 1
+    for index in range(controller + 1, end):
+        line = lines[index]
+        if line.strip() and not line.lstrip().startswith("#"):
+            if len(line) - len(line.lstrip()) <= indent:
+                break
+            position = index + 1
+    return lines[:position] + indented(entry_text, indent + 2) + lines[position:]
+
+
+def declare_controller(resource, controller_name, entry):
+    """
+    Declares the controller in routes.yaml, keeping its comments and layout when it can.
+    """
+    text = ROUTES_FILE.read_text(encoding="utf-8") if ROUTES_FILE.exists() else ""
+    routes = yaml.safe_load(text) or {}
+    controller_tweaks = (routes.get("tweaks") or {}).get("controller") or {}
+    if controller_name in controller_tweaks:
+        print(f"{LOG_COLOR.WARNING}{controller_name} is already declared in routes.yaml, left as it is{LOG_COLOR.ENDC}")
+        return
+
+    lines = add_resource(text.splitlines(), routes, resource)
+    if lines is not None:
+        lines = add_controller(lines, routes, controller_name, entry)
+    if lines is not None:
+        edited = "\n".join(lines) + "\n"
+        parsed = yaml.safe_load(edited) or {}
+        if ((parsed.get("tweaks") or {}).get("controller") or {}).get(controller_name) != entry:
+            lines = None
+
+    if lines is None:
+        print(f"{LOG_COLOR.WARNING}routes.yaml is rewritten without its comments, as its layout isn't the usual one"
+              f"{LOG_COLOR.ENDC}")
+        resources = routes.setdefault("resources", [])
+        if resource not in resources:
+            resources.append(resource)
+        tweaks = routes.setdefault("tweaks", {})
+        tweaks.setdefault("controller", {})[controller_name] = entry
+        tweaks.setdefault("path", {})
+        edited = yaml.safe_dump(routes, sort_keys=False, default_flow_style=None)
+
+    ROUTES_FILE.write_text(edited, encoding="utf-8")
+    print(f"{LOG_COLOR.OK_GREEN}[DECLARED] {controller_name} at {entry['path']} in routes.yaml{LOG_COLOR.ENDC}")
+
+
+def controller_generator():
+    """
+    Generates a controller with a function per method, and declares it in routes.yaml.
+    """
+    resource, child_name = args.controller
+    controller_name = f"{resource}.{child_name}"
+    if not (resource.isidentifier() and child_name.isidentifier()):
+        raise SystemExit(f"{LOG_COLOR.FAIL}{controller_name} isn't a valid controller name{LOG_COLOR.ENDC}")
+    methods = [method.lower() for method in args.methods]
+    schema = schema_name(child_name) if args.schema else None
+    if schema and not any(method in BODY_METHODS for method in methods):
+        raise SystemExit(f"{LOG_COLOR.FAIL}--schema needs one of the methods {', '.join(BODY_METHODS)}{LOG_COLOR.ENDC}")
+
+    file = CURRENT_PATH / CONTROLLERS_ROOT / resource / f"{child_name}.py"
+    if file.exists() and not args.force:
+        raise SystemExit(f"{LOG_COLOR.FAIL}{file} already exists; use --force to overwrite it{LOG_COLOR.ENDC}")
+
+    handler_name = CONTROLLERS_ROOT
     extension = "py"
-    generate_content(args.controller, handler_name, content, extension)
+    generate_content(args.controller, handler_name, controller_content(controller_name, methods, schema), extension)
+    entry = route_entry(
+        controller_name, args.path or f"/{resource}/{child_name}", methods, schema, args.cache, args.rate_limit
+    )
+    declare_controller(resource, controller_name, entry)
+
+
+def route_module_generator():
+    """
+    Regenerates the route module from routes.yaml and the controllers of its resources.
+    """
+    routes, paths = read_routes()
+    path = RouteModule(ROUTE_MODULE or "routes_manifest").write(routes, paths, ROUTES_FILE)
+    print(f"{LOG_COLOR.OK_GREEN}[GENERATED] {os.path.relpath(path)} with {len(paths)} paths{LOG_COLOR.ENDC}")
 
 
 # Instantiate the parser
 parser = argparse.ArgumentParser(
-    description="%fGenerator Handler for {LOG_COLOR.UNDERLINE}FyMO{LOG_COLOR.ENDC}"
-    % LOG_COLOR.OK_CYAN
+    description=f"{LOG_COLOR.OK_CYAN}Generator Handler for {LOG_COLOR.UNDERLINE}QuAPI{LOG_COLOR.ENDC}"
 )
 
 # make default value for controller
@@ -53,14 +267,33 @@ parser.add_argument(
     help="The controller name that you wanna create with.",
     nargs=2,
 )
+parser.add_argument(
+    "--methods", nargs="+", default=["get"], choices=[method.lower() for method in GLOBAL_METHODS],
+    help="Methods of the controller [default: get].",
+)
+parser.add_argument("--path", type=str, help="Path of the controller [default: /<resource>/<name>].")
+parser.add_argument("--schema", action="store_true", help="Validate the body of post, put and patch with a dataclass.")
+parser.add_argument("--cache", type=int, metavar="TTL", help="Cache GET responses for TTL seconds.")
+parser.add_argument(
+    "--rate-limit", dest="rate_limit", type=str, metavar="RATE", help="Limit requests, e.g. 100/minute."
+)
+parser.add_argument("--force", action="store_true", help="Overwrite the controller if it exists.")
+parser.add_argument(
+    "--manifest", action="store_true", help="Only regenerate the route module imported at startup in production."
+)
 
-args = parser.parse_args()
+if __name__ == "__main__":
+    args = parser.parse_args()
 
-try:
-    if args.controller:
-        controller_generator()
+    try:
+        if args.controller:
+            controller_generator()
+        if args.controller or args.manifest:
+            route_module_generator()
+        else:
+            parser.print_help()
 
-except PermissionError:
-    print(
-        f"{LOG_COLOR.FAIL}You don't have any permissions to do this, please use admin privileges.{LOG_COLOR.ENDC}"
-    )
+    except PermissionError:
+        print(
+            f"{LOG_COLOR.FAIL}You don't have any permissions to do this, please use admin privileges.{LOG_COLOR.ENDC}"
+        )
@@ -1,47 +1,281 @@
-# import os
-# import pathlib
-
-# import yaml
-# import logging
-# from pony import orm
-# from pony.orm import commit
-#
-# from core.constants import ENV
-#
-# CURRENT_DIR = pathlib.Path(os.getcwd())
-#
-# db = orm.Database()
-#
-# if os.path.exists(CURRENT_DIR / "db.yaml"):
-#     db_config = yaml.load(open(CURRENT_DIR / "db.yaml", "r"), Loader=yaml.FullLoader)
-#     if ENV == "development":
-#         dev_db = db_config.get("development")
-#         if dev_db:
-#             db = orm.Database()
-#             filename = dev_db.get("filename")
-#             provider = dev_db.get("provider")
-#             if provider == "sqlite":
-#                 if filename:
-#                     if not os.path.exists(CURRENT_DIR / filename):
-#                         open(CURRENT_DIR / filename, 'a').close()
-#                     dev_db.update({"filename": str(CURRENT_DIR / filename)})
-#
-#             db.bind(**dev_db)
-#             orm.set_sql_debug(True)
-#             db.generate_mapping(create_tables=True)
-#             print("Dev Database initialized")
-#         else:
-#             logging.warning("No development database found in db.yaml")
-#     elif ENV == "production":
-#         prod_db = db_config.get("production")
-#         if prod_db:
-#             db = orm.Database()
-#             db.bind(**prod_db)
-#             db.generate_mapping(create_tables=True)
+# database.py reads the section of db.yaml for the current ENV and builds a bounded connection pool:
 #
-#         else:
-#             logging.warning("No production database found in db.yaml")
+#   development:
+#     provider: sqlite
+#     filename: db.sqlite3
+#     pool_size: 5            # connections kept open
+#     max_overflow: 10        # extra connections opened under load, closed when given back
+#     pool_timeout: 30        # seconds to wait for a free connection before responding 503
+#     pool_recycle: 3600      # seconds after which a connection is replaced
+#     pre_ping: true          # checks a connection with SELECT 1 before handing it out
+#     cached_statements: 256  # prepared statements kept per connection
+#     echo: false             # true logs every SQL statement; off unless turned on, even in development
+#     persist_tasks: false    # keeps deferred tasks in the database until they ran; see core/tasks.py
+#     pragmas:
+#       journal_mode: wal
 #
-# else:
-#     logging.warning("No db.yaml found, skipping database initialization")
-# #
+# Controllers get a request-scoped session as `request.db`; it takes a connection on first use,
+# and the server commits it when the controller returns, or rolls it back when it raises.
+# Connections are opened lazily, so every forked worker has its own.
+
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import yaml
+
+from ..constants import ENV
+from ..essentials import STATUS, RequestException
+
+CURRENT_DIR = pathlib.Path(os.getcwd())
+
+
+class PoolTimeout(RequestException):
+    """
+    Raised when no connection is free within the pool timeout; it's answered with a 503.
+    """
+
+    def __init__(self, timeout):
+        super().__init__(f"No database connection was free within {timeout}s.", STATUS.SERVICE_UNAVAILABLE_503)
+
+
+class PooledConnection:
+    __slots__ = ("connection", "created_at")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Keeps up to `size` idle connections and opens up to `max_overflow` more under load.
+    Callers wait up to `timeout` seconds for a connection once all of them are in use.
+    """
+
+    def __init__(self, connect, size=5, max_overflow=10, timeout=30.0, recycle=3600, pre_ping=True):
+        self.connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.reset()
+
+    def reset(self):
+        self.idle = []
+        self.opened = 0
+        self.condition = threading.Condition()
+        # wait-time statistics for the metrics endpoint
+        self.checkouts = 0
+        self.wait_sum = 0.0
+        self.timeouts = 0
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self.condition:
+            while not self.idle and self.opened >= self.size + self.max_overflow:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(self.timeout)
+                self.condition.wait(remaining)
+            pooled = self.idle.pop() if self.idle else None
+            if pooled is None:
+                self.opened += 1
+            self.checkouts += 1
+            self.wait_sum += time.monotonic() - started
+
+        if pooled is not None and self.is_healthy(pooled):
+            return pooled
+        if pooled is not None:
+            self.close_connection(pooled.connection)
+        try:
+            return PooledConnection(self.connect())
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+    def is_healthy(self, pooled):
+        if self.recycle and time.monotonic() - pooled.created_at > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                pooled.connection.execute("SELECT 1")
+            except sqlite3.Error:
+                return False
+        return True
+
+    def release(self, pooled):
+        connection = pooled.connection
+        if connection.in_transaction:
+            connection.rollback()
+        with self.condition:
+            if len(self.idle) < self.size:
+                self.idle.append(pooled)
+                pooled = None
+            else:
+                self.opened -= 1
+            self.condition.notify()
+        if pooled is not None:
+            self.close_connection(connection)
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+        for pooled in idle:
+            self.close_connection(pooled.connection)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "idle": len(self.idle),
+                "in_use": self.opened - len(self.idle),
+                "checkouts": self.checkouts,
+                "wait_seconds": self.wait_sum,
+                "timeouts": self.timeouts,
+            }
+
+
+class Session:
+    """
+    A unit of work on one pooled connection, taken on first use and given back by `close`.
+    Rows are returned as dicts, so controllers can return them as they are.
+    """
+    __slots__ = ("pool", "pooled")
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.pooled = None
+
+    @property
+    def connection(self):
+        if self.pooled is None:
+            self.pooled = self.pool.acquire()
+        return self.pooled.connection
+
+    def execute(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.connection.executemany(sql, parameters)
+
+    def fetch_one(self, sql, parameters=()):
+        row = self.execute(sql, parameters).fetchone()
+        return dict(row) if row is not None else None
+
+    def fetch_all(self, sql, parameters=()):
+        return [dict(row) for row in self.execute(sql, parameters).fetchall()]
+
+    def commit(self):
+        if self.pooled is not None:
+            self.pooled.connection.commit()
+
+    def rollback(self):
+        if self.pooled is not None:
+            self.pooled.connection.rollback()
+
+    def close(self, commit=True):
+        """
+        Commits or rolls back, and gives the connection back to the pool.
+        """
+        pooled, self.pooled = self.pooled, None
+        if pooled is None:
+            return
+        try:
+            if commit:
+                pooled.connection.commit()
+        finally:
+            self.pool.release(pooled)
+
+
+class Database:
+    def __init__(self, config):
+        self.filename = config.get("filename", "db.sqlite3")
+        self.uri = self.filename == ":memory:"
+        if self.uri:
+            # every connection of the pool shares one in-memory database
+            self.filename = f"file:quapi-{id(self)}?mode=memory&cache=shared"
+        else:
+            self.filename = str(CURRENT_DIR / self.filename)
+        self.busy_timeout = config.get("busy_timeout", 5.0)
+        self.cached_statements = config.get("cached_statements", 256)
+        self.echo = config.get("echo", False)
+        self.pragmas = config.get("pragmas") or {}
+        self.persist_tasks = config.get("persist_tasks", False)
+        self.pool = ConnectionPool(
+            self.connect,
+            size=config.get("pool_size", 5),
+            max_overflow=config.get("max_overflow", 10),
+            timeout=config.get("pool_timeout", 30.0),
+            recycle=config.get("pool_recycle", 3600),
+            pre_ping=config.get("pre_ping", True),
+        )
+
+    def connect(self):
+        connection = sqlite3.connect(
+            self.filename,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            uri=self.uri,
+        )
+        connection.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+        if self.echo:
+            connection.set_trace_callback(logging.info)
+        return connection
+
+    @contextmanager
+    def session(self):
+        """
+        A session for code that runs outside a request, e.g. scripts and background tasks.
+        """
+        session = Session(self.pool)
+        try:
+            yield session
+        except BaseException:
+            session.close(commit=False)
+            raise
+        session.close(commit=True)
+
+    def stats(self):
+        return self.pool.stats()
+
+
+def load_database(config_path, env):
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path, "r") as config_file:
+        config = yaml.load(config_file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or {}
+    env_config = config.get(env)
+    if not env_config:
+        logging.warning(f"No {env} database found in db.yaml")
+        return None
+    provider = env_config.get("provider", "sqlite")
+    if provider != "sqlite":
+        logging.warning(f"Database provider {provider} is not supported, skipping database initialization")
+        return None
+    return Database(env_config)
+
+
+database = load_database(CURRENT_DIR / "db.yaml", ENV)
+
+if database is not None:
+    # forked workers open their own connections
+    os.register_at_fork(after_in_child=database.pool.reset)
@@ -0,0 +1,115 @@
+# declarations.py reads routes.yaml into the route declarations the router compiles: {path: declaration},
+# from the root, the tweaks and the controllers found in the directories of its resources.
+# It has no side effects, so tools such as core/generate.py use it without building the routes.
+
+import os
+import pathlib
+
+from ..constants import CONTROLLERS_ROOT, LOG_COLOR
+from .manifest import load_yaml
+
+CURRENT_DIR = pathlib.Path(os.getcwd())
+ROUTES_FILE = CURRENT_DIR / "routes.yaml"
+
+# directories of a resource that are not controllers
+EXCLUDED_CONTROLLER_FILES = frozenset(("__pycache__", "templates", "__init__.py"))
+
+
+def declare_paths(routes):
+    """
+    Returns {path: declaration} for routes.yaml: the root, the tweaks and the controllers of every resource.
+    """
+    paths = {}
+
+    # sets the global root path domain.com/
+    if routes.get("root"):
+        paths.update({
+            '/': {'controller_name': routes.get("root")}
+        })
+
+    tweaks = routes.get("tweaks")
+    controller_tweaks = tweaks.get("controller")
+    path_tweaks = tweaks.get("path")
+
+    for key, value in controller_tweaks.items():
+        # Basically, reads and formats tweaks.controller from routes.yaml
+        if type(value) is str:
+            paths.update({
+                f"/{value}": {'controller_name': key}
+            })
+        elif type(value) is dict:
+            path = value.get("path")
+            allowed_methods = value.get("allowed_methods")
+            paths.update({
+                f"{path}": {
+                    'controller_name': key,
+                    "allowed_methods": allowed_methods,
+                    "cache": value.get("cache"),
+                    "coalesce": value.get("coalesce"),
+                    "compress": value.get("compress"),
+                    "middleware": value.get("middleware"),
+                    "rate_limit": value.get("rate_limit"),
+                    "schema": value.get("schema"),
+                    "profile": value.get("profile"),
+                },
+            })
+
+    for key, value in path_tweaks.items():
+        # Reads and formats tweaks.path from routes.yaml
+        # Basically, it's a way to add custom paths to the routes
+        # without having to create a specific controller for it.
+        paths.update({
+            f"{key}": {
+                'controller_name': value.get("controller"),
+                "cache": value.get("cache"),
+                "coalesce": value.get("coalesce"),
+                "compress": value.get("compress"),
+                "middleware": value.get("middleware"),
+                "rate_limit": value.get("rate_limit"),
+                "schema": value.get("schema"),
+                "profile": value.get("profile"),
+            }
+        })
+
+    for resource in routes.get("resources") or ():
+        try:
+            # check if the controller exists
+            controller_files = os.listdir(os.path.join(CONTROLLERS_ROOT, resource))
+        except FileNotFoundError as e:
+            print(f"{LOG_COLOR.FAIL}FileNotFoundError: {e}{LOG_COLOR.ENDC}")
+            print(
+                f"{LOG_COLOR.WARNING}Please create a directory named '{resource}' in '{CONTROLLERS_ROOT}' directory.{LOG_COLOR.ENDC}")
+            continue
+
+        for controller_file in controller_files:
+            if controller_file in EXCLUDED_CONTROLLER_FILES:
+                continue
+            no_extension_controller_file_name = controller_file.removesuffix(".py")
+            controller_name = f"{resource}.{no_extension_controller_file_name}"
+
+            # check if controller_name is in tweaks.controller, and unique path is set, if so, don't add it
+            if controller_name in controller_tweaks:
+                if controller_tweaks.get(controller_name).get("unique"):
+                    continue
+
+            path = f"/{resource}/{no_extension_controller_file_name}"
+            paths.update(
+                {
+                    path: {
+                        'controller_name': controller_name
+                    }
+                }
+            )
+
+    return paths
+
+
+def read_routes():
+    routes = load_yaml(ROUTES_FILE)
+    return routes, declare_paths(routes)
+
+
+def manifest_files(data):
+    # the declared paths change with routes.yaml and with the files in the resource directories
+    routes, _ = data
+    return [ROUTES_FILE] + [os.path.join(CONTROLLERS_ROOT, resource) for resource in routes.get("resources") or ()]
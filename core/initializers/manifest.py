@@ -0,0 +1,207 @@
+# manifest.py caches what the router reads at startup: the parsed routes.yaml and the paths declared
+# from it and from the controllers found in its resource directories. The snapshot is keyed by the
+# modification times of routes.yaml and of those directories, so adding, removing or renaming a controller,
+# or editing routes.yaml, rebuilds it; otherwise every worker's cold start skips YAML parsing and
+# directory walks. The file is set with the ROUTE_MANIFEST environment variable; empty turns it off.
+#
+# For production, `python -m core.generate --manifest` writes the same declarations as a Python module
+# [ROUTE_MODULE, default: routes_manifest.py] that also imports every declared controller. Startup then imports
+# that module and nothing else: no YAML, no directory listings, no controller lookups. It's checked against
+# a digest of routes.yaml; controllers added to a resource by hand need it regenerated.
+
+import ast
+import hashlib
+import importlib
+import importlib.util
+import logging
+import os
+import pickle
+import pprint
+
+import yaml
+
+from ..constants import CONTROLLERS_ROOT
+
+# bumped whenever the layout of the snapshot changes, so older ones are rebuilt
+MANIFEST_VERSION = 2
+
+# the C loader, when PyYAML is built with libyaml, parses several times faster
+YAML_LOADER = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+
+def load_yaml(path):
+    with open(path, "rb") as file:
+        return yaml.load(file, Loader=YAML_LOADER)
+
+
+def stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def fingerprint(files):
+    return {str(path): stat_key(path) for path in files}
+
+
+def is_fresh(files):
+    return all(stat_key(path) == key for path, key in files.items())
+
+
+class RouteManifest:
+    """
+    The snapshot file of the route declarations; see the top of this module.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        if not self.path:
+            return None
+        try:
+            with open(self.path, "rb") as file:
+                snapshot = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+            return None
+        if type(snapshot) is not dict or snapshot.get("version") != MANIFEST_VERSION:
+            return None
+        if not is_fresh(snapshot["files"]):
+            return None
+        return snapshot["data"]
+
+    def write(self, files, data):
+        if not self.path:
+            return
+        snapshot = {"version": MANIFEST_VERSION, "files": fingerprint(files), "data": data}
+        # written aside and renamed, so workers starting at the same time never read half a snapshot
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(temporary_path, "wb") as file:
+                pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            # e.g. a read-only deployment; startup just doesn't get faster
+            logging.debug(f"Route manifest {self.path} can't be written: {e}")
+
+    def load(self, build, files_of):
+        """
+        Returns the cached data when it's fresh, or builds it with `build()` and caches it, keyed by
+        the modification times of the files and directories `files_of(data)` returns.
+        """
+        data = self.read()
+        if data is None:
+            data = build()
+            self.write(files_of(data), data)
+        return data
+
+
+def file_digest(path):
+    try:
+        with open(path, "rb") as file:
+            return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+
+def is_controller(controller_name):
+    if not all(part.isidentifier() for part in controller_name.split(".")):
+        return False
+    try:
+        return importlib.util.find_spec(f"{CONTROLLERS_ROOT}.{controller_name}") is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def python_literal(data):
+    text = pprint.pformat(data, width=120, sort_dicts=False)
+    try:
+        if ast.literal_eval(text) == data:
+            return text
+    except (ValueError, SyntaxError):
+        pass
+    raise ValueError(f"routes.yaml has values that can't be written to a Python module: {text[:200]}")
+
+
+ROUTE_MODULE_SOURCE = """\
+# {file_name} is generated by `python -m core.generate --manifest` from routes.yaml and the controllers
+# of its resources; production startup imports it in their place. Don't edit it, regenerate it.
+
+{imports}
+
+VERSION = {version}
+ROUTES_DIGEST = {digest!r}
+
+ROUTES = {routes}
+
+PATHS = {paths}
+
+CONTROLLERS = {{
+{controllers}}}
+"""
+
+
+class RouteModule:
+    """
+    The generated module of the route declarations and controllers; see the top of this module.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def path(self):
+        return os.path.join(os.getcwd(), *self.name.split(".")) + ".py"
+
+    def load(self, routes_file):
+        """
+        Returns (routes, paths, {controller name: module}), or None when there's no module or it's out of date.
+        """
+        if not self.name:
+            return None
+        try:
+            module = importlib.import_module(self.name)
+        except ModuleNotFoundError as e:
+            if e.name != self.name:
+                # e.g. a controller that was removed
+                logging.warning(f"Route module {self.name} can't be imported, regenerate it: {e}")
+            return None
+        digest = file_digest(routes_file)
+        # without routes.yaml, e.g. in an image shipping only the module, the module is the routes
+        if getattr(module, "VERSION", None) != MANIFEST_VERSION or digest not in (None, module.ROUTES_DIGEST):
+            logging.warning(
+                f"Route module {self.name} is out of date with routes.yaml; "
+                "regenerate it with `python -m core.generate --manifest`"
+            )
+            return None
+        return module.ROUTES, module.PATHS, module.CONTROLLERS
+
+    def write(self, routes, paths, routes_file):
+        """
+        Writes the module for the declarations of routes.yaml; returns its path.
+        """
+        controller_names = sorted({
+            declaration["controller_name"] for declaration in paths.values() if declaration.get("controller_name")
+        })
+        controller_names = [controller_name for controller_name in controller_names if is_controller(controller_name)]
+        source = ROUTE_MODULE_SOURCE.format(
+            file_name=os.path.basename(self.path),
+            imports="\n".join(f"import {CONTROLLERS_ROOT}.{controller_name}" for controller_name in controller_names),
+            version=MANIFEST_VERSION,
+            digest=file_digest(routes_file),
+            routes=python_literal(routes),
+            paths=python_literal(paths),
+            controllers="".join(
+                f"    {controller_name!r}: {CONTROLLERS_ROOT}.{controller_name},\n"
+                for controller_name in controller_names
+            ),
+        )
+        # written aside and renamed, like the snapshot
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(source)
+        os.replace(temporary_path, self.path)
+        return self.path
@@ -0,0 +1,124 @@
+# registry.py keeps the imported controller modules and their method handlers (get, post, etc.),
+# so a request never goes through importlib. In development, a controller is re-imported when its
+# file changes on disk, which keeps hot reload working.
+
+import importlib
+import os
+import threading
+from types import MappingProxyType
+
+from ..constants import CONTROLLERS_ROOT, ENV, GLOBAL_METHODS
+
+
+class Controller:
+    __slots__ = ("module", "handlers", "file", "mtime")
+
+    def __init__(self, module):
+        self.module = module
+        self.handlers = MappingProxyType(collect_handlers(module))
+        self.file = getattr(module, "__file__", None)
+        self.mtime = get_mtime(self.file)
+
+
+def get_mtime(file):
+    try:
+        return os.stat(file).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+def collect_handlers(module):
+    """
+    Returns the method handlers of a controller module, e.g. {"GET": get, "POST": post}.
+    """
+    handlers = {}
+    for method in GLOBAL_METHODS:
+        handler = getattr(module, method.lower(), None)
+        if callable(handler):
+            handlers[method] = handler
+    return handlers
+
+
+class HandlerRegistry:
+    """
+    Resolves controllers once, either at startup through `preload` or lazily on first hit.
+    With `watch` enabled, every lookup compares the controller file's mtime and re-imports it
+    when it changed; missing controllers are not remembered, so they can be created later.
+    """
+
+    def __init__(self, watch=False):
+        self.watch = watch
+        self.controllers = {}
+        self.lock = threading.Lock()
+
+    def get(self, controller_name):
+        controller = self.controllers.get(controller_name)
+        if controller is not None:
+            if not self.watch or get_mtime(controller.file) == controller.mtime:
+                return controller
+        elif controller_name in self.controllers:
+            # the controller was not found and it's remembered as such
+            return None
+        return self.load(controller_name)
+
+    def load(self, controller_name):
+        with self.lock:
+            stale = self.controllers.get(controller_name)
+            try:
+                if stale is not None and self.watch:
+                    module = importlib.reload(stale.module)
+                else:
+                    module = importlib.import_module(f"{CONTROLLERS_ROOT}.{controller_name}")
+            except ModuleNotFoundError:
+                if self.watch:
+                    self.controllers.pop(controller_name, None)
+                else:
+                    self.controllers[controller_name] = None
+                return None
+
+            controller = Controller(module)
+            self.controllers[controller_name] = controller
+            return controller
+
+    def register(self, controller_name, module):
+        """
+        Adds a controller module imported elsewhere, e.g. by the generated route module.
+        """
+        with self.lock:
+            self.controllers[controller_name] = Controller(module)
+
+    def preload(self, controller_names):
+        for controller_name in controller_names:
+            if controller_name not in self.controllers:
+                self.load(controller_name)
+
+    def reload(self):
+        """
+        Re-imports every loaded controller, e.g. before a graceful reload of the server workers.
+        """
+        with self.lock:
+            controllers = list(self.controllers.items())
+        for controller_name, controller in controllers:
+            if controller is None:
+                self.controllers.pop(controller_name, None)
+                continue
+            try:
+                module = importlib.reload(controller.module)
+            except ModuleNotFoundError:
+                self.controllers.pop(controller_name, None)
+                continue
+            self.controllers[controller_name] = Controller(module)
+
+    def handlers(self, controller_name):
+        """
+        Returns the method handlers of a controller, or None if the controller does not exist.
+        """
+        controller = self.get(controller_name)
+        return controller.handlers if controller is not None else None
+
+    def module(self, controller_name):
+        controller = self.get(controller_name)
+        return controller.module if controller is not None else None
+
+
+handler_registry = HandlerRegistry(watch=ENV == "development")
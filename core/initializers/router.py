@@ -2,87 +2,234 @@
 # it configures the routes from routes.yaml and then it uses the controller name to import the controller and
 # call the correct method (get, post, put, delete, etc.)
 
-import os
-import pathlib
-import re
-import yaml
-
-from ..constants import CONTROLLERS_ROOT, LOG_COLOR
-
-paths = {}
-
-CURRENT_DIR = pathlib.Path(os.getcwd())
-
-routes = yaml.load(open(CURRENT_DIR / "routes.yaml", "r"), Loader=yaml.FullLoader)
-
-# sets the global root path domain.com/
-if routes.get("root"):
-    paths.update({
-        '/': {'controller_name': routes.get("root")}
-    })
-
-resources = routes.get("resources")
-tweaks = routes.get("tweaks")
-controller_tweaks = tweaks.get("controller")
-path_tweaks = tweaks.get("path")
-
-for key, value in controller_tweaks.items():
-    # Basically, reads and formats tweaks.controller from routes.yaml
-    if type(value) is str:
-        paths.update({
-            f"/{value}": {'controller_name': key}
-        })
-    elif type(value) is dict:
-        path = value.get("path")
-        allowed_methods = value.get("allowed_methods")
-        paths.update({
-            f"{path}": {
-                'controller_name': key,
-                "allowed_methods": allowed_methods
-            },
-        })
-
-for key, value in path_tweaks.items():
-    # Reads and formats tweaks.path from routes.yaml
-    # Basically, it's a way to add custom paths to the routes
-    # without having to create a specific controller for it.
-    paths.update({
-        f"{key}": {
-            'controller_name': value.get("controller")
-        }
-    })
-
-if resources:
-    for resource in resources:
-        try:
-            # check if the controller exists
-            excluded_directories = {"__pycache__", "templates", "__init__.py"}
-            controllers_dir = [x for x in os.listdir(os.path.join(CONTROLLERS_ROOT, resource)) if
-                               x not in excluded_directories]
-
-            for controller_file in controllers_dir:
-                no_extension_controller_file_name = re.sub(r'\.py$', '', controller_file)
-                controller_name = f"{resource}.{no_extension_controller_file_name}"
-
-                # check if controller_name is in tweaks.controller, and unique path is set, if so, don't add it
-                if controller_name in controller_tweaks:
-                    if controller_tweaks.get(controller_name).get("unique"):
-                        continue
-
-                path = f"/{resource}/{no_extension_controller_file_name}"
-                paths.update(
-                    {
-                        path: {
-                            'controller_name': controller_name
-                        }
-                    }
-                )
-        except FileNotFoundError as e:
-            print(f"{LOG_COLOR.FAIL}FileNotFoundError: {e}{LOG_COLOR.ENDC}")
-            print(
-                f"{LOG_COLOR.WARNING}Please create a directory named '{resource}' in '{CONTROLLERS_ROOT}' directory.{LOG_COLOR.ENDC}")
-
-# print paths as table
-print(f"{LOG_COLOR.OK_CYAN}{'Path':<20}{'Controller':<20}{'Allowed Methods'}{LOG_COLOR.ENDC}")
-for key, value in paths.items():
-    print(f"{key:<20}{value.get('controller_name'):<20}{value.get('allowed_methods')}")
+from types import MappingProxyType
+
+from ..cache import ResponseCache
+from ..coalesce import SingleFlight
+from ..compression import Compressor
+from ..constants import LOG_COLOR, PRINT_ROUTES, ROUTE_MANIFEST, ROUTE_MODULE, USE_ROUTE_MODULE
+from ..middleware import compose_handlers, load_middleware
+from ..profiling import sample_rate
+from ..ratelimit import RateLimiter, make_limits
+from ..schema import load_validators, with_validator
+from .declarations import ROUTES_FILE, manifest_files, read_routes
+from .manifest import RouteManifest, RouteModule
+from .registry import handler_registry
+from .tree import RouteTree, is_pattern
+
+# in production, the route module generated by core/generate.py stands in for routes.yaml and the resource
+# directories, and registers the controllers it imports
+route_module = RouteModule(ROUTE_MODULE).load(ROUTES_FILE) if USE_ROUTE_MODULE else None
+if route_module is not None:
+    routes, paths, controllers = route_module
+    for controller_name, module in controllers.items():
+        handler_registry.register(controller_name, module)
+else:
+    routes, paths = RouteManifest(ROUTE_MANIFEST).load(read_routes, manifest_files)
+
+# middleware applied to every route, ahead of the route's own; see core/middleware.py
+global_middleware = tuple(map(load_middleware, routes.get("middleware") or ()))
+# rate limits applied to every route, ahead of the route's own; see core/ratelimit.py
+global_rate_limits = make_limits(routes.get("rate_limit"), "*")
+
+
+class Route:
+    """
+    A compiled entry of the dispatch table. Everything a request needs is resolved here once,
+    so dispatching is a single hash lookup on the raw request path.
+    """
+    __slots__ = (
+        "path", "controller_name", "allowed_methods", "resolved_handlers", "cache", "coalesce", "compression",
+        "middleware", "guards", "composed", "rate_limit", "validators", "profile_rate",
+    )
+
+    def __init__(
+        self, path, controller_name, allowed_methods=None, cache=None, coalesce=None, compression=None, middleware=(),
+        rate_limit=None, validators=None, profile_rate=None,
+    ):
+        self.path = path
+        self.controller_name = controller_name
+        # None means every method is allowed, as in routes.yaml
+        self.allowed_methods = frozenset(allowed_methods) if allowed_methods is not None else None
+        self.resolved_handlers = None
+        # the ResponseCache of the route, None when it's not cached
+        self.cache = cache
+        # the SingleFlight of the route, None when concurrent requests are not coalesced
+        self.coalesce = coalesce
+        # the Compressor of the route, None when its responses are never compressed
+        self.compression = compression
+        # middleware callables, outermost first
+        self.middleware, self.guards = split_guards(tuple(middleware), cache is not None or coalesce is not None)
+        # (controller methods, composed methods) of the last composition, when watching files
+        self.composed = (None, None)
+        # the RateLimiter of the route, None when its requests are not limited
+        self.rate_limit = rate_limit
+        # {method: Validator} of the request bodies, from `schema` in routes.yaml
+        self.validators = validators or {}
+        # fraction of the requests profiled, from `profile` in routes.yaml; None uses PROFILE_SAMPLE_RATE
+        self.profile_rate = profile_rate
+
+    @property
+    def handlers(self):
+        # None means the controller module could not be found
+        if handler_registry.watch:
+            handlers = handler_registry.handlers(self.controller_name)
+            if not self.middleware and not self.validators:
+                return handlers
+            # the registry hands out the same mapping until the controller is re-imported
+            source, composed = self.composed
+            if source is not handlers:
+                composed = self.compose(handlers)
+                self.composed = (handlers, composed)
+            return composed
+        return self.resolved_handlers
+
+    def compose(self, handlers):
+        """
+        Returns the controller methods composed with the route's body validators and middleware;
+        routes without either use the controller methods as they are.
+        Bodies are validated right before the controller, after the middleware.
+        """
+        if (not self.middleware and not self.validators) or handlers is None:
+            return handlers
+        if self.validators:
+            handlers = {
+                method: with_validator(handler, self.validators[method]) if method in self.validators else handler
+                for method, handler in handlers.items()
+            }
+        return MappingProxyType(compose_handlers(handlers, self.middleware))
+
+    def __repr__(self):
+        return f"<Route: {self.path}, {self.controller_name}>"
+
+
+def split_guards(middleware, shared):
+    """
+    Returns (middleware, guards). On routes whose responses are shared, from the cache or from a coalesced run,
+    the leading before middleware, e.g. require_authorization, are guards: they run ahead of the cache and
+    of the coalescing, so every request goes through them, and the rest is composed with the controller.
+    """
+    if not shared:
+        return middleware, ()
+    count = 0
+    while count < len(middleware) and getattr(middleware[count], "middleware_kind", "around") == "before":
+        count += 1
+    guards, middleware = middleware[:count], middleware[count:]
+    for callable_ in middleware:
+        if getattr(callable_, "middleware_kind", "around") == "before":
+            raise ValueError(
+                f"Before middleware {callable_.__qualname__} would be skipped by responses from the cache "
+                "or of coalesced requests; declare it ahead of the around and after middleware"
+            )
+    return middleware, guards
+
+
+def path_aliases(path):
+    """
+    Returns the normalized spellings of a path; /x, /x/ and /x/index all point to the same route.
+    """
+    stem = path[:-len("/index")] if path.endswith("/index") else path
+    stem = stem.rstrip("/")
+    return stem or "/", f"{stem}/", f"{stem}/index"
+
+
+def make_route(path, declaration):
+    route = Route(
+        path,
+        declaration.get("controller_name"),
+        declaration.get("allowed_methods"),
+        ResponseCache.from_config(declaration.get("cache")),
+        SingleFlight.from_config(declaration.get("coalesce")),
+        Compressor.from_config(declaration.get("compress")),
+        global_middleware + tuple(map(load_middleware, declaration.get("middleware") or ())),
+        RateLimiter.from_config(declaration.get("rate_limit"), path, global_rate_limits),
+        load_validators(declaration.get("schema")),
+        sample_rate(declaration.get("profile")),
+    )
+    # without file watching (production), controllers are resolved and composed once at startup;
+    # in development they are resolved on first hit and re-imported when their files change
+    if not handler_registry.watch:
+        route.resolved_handlers = route.compose(handler_registry.handlers(route.controller_name))
+    return route
+
+
+def compile_routes(declared_paths):
+    """
+    Compiles the declared static paths into an immutable dispatch table keyed by every accepted
+    spelling of each path. Declared paths always win over aliases of other paths.
+    """
+    table = {}
+    aliases = {}
+    for path, declaration in declared_paths.items():
+        if is_pattern(path):
+            continue
+        route = make_route(path, declaration)
+        table[path] = route
+        for alias in path_aliases(path):
+            aliases.setdefault(alias, route)
+
+    for alias, route in aliases.items():
+        table.setdefault(alias, route)
+
+    return MappingProxyType(table)
+
+
+def compile_route_tree(declared_paths):
+    """
+    Compiles the declared pattern paths, e.g. /users/{id:int}/orders/{order_id}, into a prefix tree.
+    """
+    tree = RouteTree()
+    for path, declaration in declared_paths.items():
+        if is_pattern(path):
+            tree.insert(path, make_route(path, declaration))
+    return tree
+
+
+def resolve_route(path):
+    """
+    Returns (route, params) for a request path; static paths are a single lookup, and the
+    route tree is only walked when no static path matches.
+    """
+    route = dispatch_table.get(path)
+    if route is not None:
+        return route, None
+    if route_tree:
+        return route_tree.match(path)
+    return None, None
+
+
+def refresh_handlers():
+    """
+    Re-resolves the handlers held by the routes, after the handler registry reloaded controllers.
+    """
+    if handler_registry.watch:
+        return
+    for route in iter_routes():
+        route.resolved_handlers = route.compose(handler_registry.handlers(route.controller_name))
+
+
+def iter_routes():
+    """
+    Yields every compiled route once, static and pattern ones.
+    """
+    seen = set()
+    for route in dispatch_table.values():
+        if id(route) not in seen:
+            seen.add(id(route))
+            yield route
+    yield from route_tree
+
+
+dispatch_table = compile_routes(paths)
+route_tree = compile_route_tree(paths)
+
+
+def format_route_table(declared_paths):
+    lines = [f"{LOG_COLOR.OK_CYAN}{'Path':<20}{'Controller':<20}{'Allowed Methods'}{LOG_COLOR.ENDC}"]
+    for key, value in declared_paths.items():
+        lines.append(f"{key:<20}{str(value.get('controller_name')):<20}{value.get('allowed_methods')}")
+    return "\n".join(lines)
+
+
+if PRINT_ROUTES:
+    print(format_route_table(paths))
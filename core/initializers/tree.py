@@ -0,0 +1,122 @@
+# tree.py is the prefix tree used for pattern routes such as /users/{id:int}/orders/{order_id}.
+# Each node branches on one path segment: static segments are a dict lookup and parameters are
+# tried after them, so matching costs the depth of the path, not the number of routes.
+
+
+def int_converter(segment):
+    if not segment.isdecimal():
+        raise ValueError(segment)
+    return int(segment)
+
+
+CONVERTERS = {
+    "str": str,
+    "int": int_converter,
+}
+
+
+def is_pattern(path):
+    return "{" in path
+
+
+def split_path(path):
+    """
+    Splits a path into its segments; /x, /x/ and /x/index all give the same segments.
+    """
+    stripped = path.strip("/")
+    segments = stripped.split("/") if stripped else []
+    if segments and segments[-1] == "index":
+        segments.pop()
+    return segments
+
+
+class Node:
+    __slots__ = ("static", "params", "route")
+
+    def __init__(self):
+        self.static = {}
+        # list of (name, converter, node); typed parameters are tried before plain strings
+        self.params = []
+        self.route = None
+
+
+class RouteTree:
+    def __init__(self):
+        self.root = Node()
+        self.size = 0
+
+    def insert(self, path, route):
+        node = self.root
+        for segment in split_path(path):
+            if segment.startswith("{") and segment.endswith("}"):
+                name, _, converter_name = segment[1:-1].partition(":")
+                converter = CONVERTERS.get(converter_name or "str")
+                if converter is None:
+                    raise ValueError(f"Unknown converter '{converter_name}' in path {path}")
+
+                for param_name, param_converter, child in node.params:
+                    if param_name == name and param_converter is converter:
+                        node = child
+                        break
+                else:
+                    child = Node()
+                    node.params.append((name, converter, child))
+                    node.params.sort(key=lambda param: param[1] is str)
+                    node = child
+            else:
+                node = node.static.setdefault(segment, Node())
+
+        if node.route is None:
+            self.size += 1
+        node.route = route
+
+    def match(self, path):
+        """
+        Returns (route, params) for the given path, or (None, None) if no pattern matches it.
+        """
+        params = {}
+        route = self.match_node(self.root, split_path(path), 0, params)
+        if route is None:
+            return None, None
+        return route, params
+
+    def match_node(self, node, segments, index, params):
+        if index == len(segments):
+            return node.route
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            route = self.match_node(child, segments, index + 1, params)
+            if route is not None:
+                return route
+
+        if not segment:
+            return None
+
+        # parameters are only tried when the static branch doesn't match; this backtracks,
+        # so /users/me and /users/{id:int} can live side by side
+        for name, converter, child in node.params:
+            try:
+                value = converter(segment)
+            except ValueError:
+                continue
+            params[name] = value
+            route = self.match_node(child, segments, index + 1, params)
+            if route is not None:
+                return route
+            del params[name]
+
+        return None
+
+    def __iter__(self):
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node.route is not None:
+                yield node.route
+            nodes.extend(node.static.values())
+            nodes.extend(child for _, _, child in node.params)
+
+    def __len__(self):
+        return self.size
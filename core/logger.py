@@ -0,0 +1,278 @@
+# logger.py configures logging for the whole framework, with the LOG_MODE environment variable:
+#
+# - sync [default]: every record is written to server.log and the terminal by the thread that logs it.
+# - queue: request threads only put records on a queue; a background writer drains it in batches
+#   and writes server.log, access.log [per-request logs] and error.log [warnings and errors],
+#   rotating them by size. Access logs are sampled when the queue backs up, and LOG_FORMAT=json
+#   writes structured JSON lines. Forked workers send their records to the parent's writer through a pipe,
+#   so one process writes and rotates the files; processes appending to and rotating the same files lose lines.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+
+from core.constants import (
+    LOG_BACKUP_COUNT,
+    LOG_BATCH_SIZE,
+    LOG_FORMAT,
+    LOG_MAX_BYTES,
+    LOG_MODE,
+    LOG_SAMPLE_RATE,
+    LOG_SAMPLE_THRESHOLD,
+)
+
+# per-request logs go through this logger, so they can be routed and sampled separately
+ACCESS_LOGGER_NAME = "quapi.access"
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class AccessFilter(logging.Filter):
+    def __init__(self, access):
+        super().__init__()
+        self.access = access
+
+    def filter(self, record):
+        return (record.name == ACCESS_LOGGER_NAME) == self.access
+
+
+class SamplingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the log queue. When the queue holds more than `threshold` records,
+    only a `rate` fraction of the access logs is kept; other records are always kept.
+    """
+
+    def __init__(self, log_queue, rate=1.0, threshold=1000):
+        super().__init__(log_queue)
+        self.every = max(int(round(1 / rate)), 1) if rate > 0 else 0
+        self.threshold = threshold
+        self.seen = 0
+
+    def enqueue(self, record):
+        if record.name == ACCESS_LOGGER_NAME and self.queue.qsize() > self.threshold:
+            self.seen += 1
+            if not self.every or self.seen % self.every:
+                return
+        self.queue.put_nowait(record)
+
+    def prepare(self, record):
+        # formats the message in the logging thread, so the record is safe to hand over;
+        # the rest of the formatting happens in the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else record.exc_text
+        record.exc_info = None
+        return record
+
+
+class BatchRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A rotating file handler that writes a whole batch of records with one write and one flush.
+    It's only used from the log writer thread, so rotation never stalls a request thread.
+    """
+
+    def emit_batch(self, records):
+        records = [record for record in records if record.levelno >= self.level and self.filter(record)]
+        if not records:
+            return
+        text = "".join(self.format(record) + self.terminator for record in records)
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() + len(text) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(text)
+            self.stream.flush()
+        except Exception:
+            self.handleError(records[-1])
+
+
+class LogWriter(threading.Thread):
+    """
+    Drains the log queue in batches of up to `batch_size` records and hands each batch to the handlers.
+    """
+    STOP = None
+
+    def __init__(self, log_queue, handlers, batch_size=256):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            stopping = record is self.STOP
+            batch = [] if stopping else [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is self.STOP:
+                    stopping = True
+                    continue
+                batch.append(record)
+
+            if batch:
+                for handler in self.handlers:
+                    handler.emit_batch(batch)
+            if stopping:
+                return
+
+    def stop(self):
+        self.queue.put(self.STOP)
+        self.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+class WorkerRelay:
+    """
+    Carries the records of forked workers to the log queue of the parent, whose writer is the only one
+    writing the files. The workers' writers hand their batches over with `handler()`.
+    """
+
+    def __init__(self, log_queue):
+        self.log_queue = log_queue
+        # created before the workers are forked, so they all share it
+        self.batches = multiprocessing.Queue()
+        self.thread = threading.Thread(target=self.run, name="log-relay", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            for record in self.batches.get():
+                self.log_queue.put(record)
+
+    def drain(self):
+        # the batches of workers that exited, before the parent's writer stops
+        while True:
+            try:
+                batch = self.batches.get(timeout=0.1)
+            except (queue.Empty, OSError, ValueError):
+                return
+            for record in batch:
+                self.log_queue.put(record)
+
+    def handler(self):
+        return RelayHandler(self.batches)
+
+
+class RelayHandler(logging.Handler):
+    """
+    The handler of a worker's writer; it sends every batch to the parent in one piece.
+    """
+
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+
+    def emit_batch(self, records):
+        try:
+            self.batches.put(records)
+        except Exception:
+            self.handleError(records[-1])
+
+    def close(self):
+        # waits until the last batches are in the pipe
+        self.batches.close()
+        self.batches.join_thread()
+        super().close()
+
+
+def log_file_path(log_dir, name):
+    path = os.path.join(log_dir, name)
+    # create file if it doesn't exist
+    if not os.path.exists(path):
+        with open(path, "a", encoding="UTF-8"):
+            pass
+    return path
+
+
+def configure_sync_logging(log_dir):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=TEXT_FORMAT,
+        handlers=[logging.FileHandler(log_file_path(log_dir, "server.log")), logging.StreamHandler()],
+    )
+
+
+def configure_queue_logging(log_dir):
+    formatter = JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+
+    def file_handler(name, level, log_filter=None):
+        handler = BatchRotatingFileHandler(
+            log_file_path(log_dir, name), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="UTF-8"
+        )
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        if log_filter is not None:
+            handler.addFilter(log_filter)
+        return handler
+
+    handlers = [
+        file_handler("server.log", logging.INFO, AccessFilter(access=False)),
+        file_handler("access.log", logging.INFO, AccessFilter(access=True)),
+        file_handler("error.log", logging.WARNING),
+    ]
+
+    log_queue = queue.SimpleQueue()
+    writer = LogWriter(log_queue, handlers, LOG_BATCH_SIZE)
+    writer.start()
+    relay = WorkerRelay(log_queue)
+    parent_pid = os.getpid()
+
+    def stop_writer():
+        if os.getpid() == parent_pid:
+            relay.drain()
+            writer.stop()
+
+    atexit.register(stop_writer)
+
+    queue_handler = SamplingQueueHandler(log_queue, LOG_SAMPLE_RATE, LOG_SAMPLE_THRESHOLD)
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+
+    def restart_writer():
+        # threads don't survive fork; forked workers get their own queue, and a writer sending the batches
+        # to the parent's instead of writing the files
+        for handler in handlers:
+            handler.stream = None
+        child_queue = queue.SimpleQueue()
+        child_writer = LogWriter(child_queue, [relay.handler()], LOG_BATCH_SIZE)
+        queue_handler.queue = child_queue
+        child_writer.start()
+        atexit.register(child_writer.stop)
+
+    os.register_at_fork(after_in_child=restart_writer)
+    return writer
+
+
+def configure_logging(log_dir):
+    if LOG_MODE == "queue":
+        return configure_queue_logging(log_dir)
+    return configure_sync_logging(log_dir)
@@ -0,0 +1,180 @@
+# metrics.py collects per-request metrics and renders them in the Prometheus text format
+# at METRICS_PATH [default: /metrics]; an empty METRICS_PATH turns collection off.
+#
+# Per route it keeps a latency histogram, status code counters and the time spent in each phase
+# of a request: routing, controller and serialization. Recording a request is a few clock reads
+# and integer additions under one lock.
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from core.constants import METRICS_PATH
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = ("routing", "controller", "serialization")
+
+# route label of requests rejected while routing, e.g. with a 404 or a 405
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RouteMetrics:
+    __slots__ = ("buckets", "duration_sum", "count", "phase_sums", "statuses")
+
+    def __init__(self, bucket_count):
+        # one slot per bucket plus +Inf; counts are per bucket and made cumulative when rendered
+        self.buckets = [0] * (bucket_count + 1)
+        self.duration_sum = 0.0
+        self.count = 0
+        self.phase_sums = [0.0, 0.0, 0.0]
+        self.statuses = {}
+
+
+class RequestTimer:
+    """
+    Times the phases of one request; the server marks the end of routing and of the controller,
+    and `finish` records everything.
+    """
+    __slots__ = ("metrics", "route", "started", "routed_at", "called_at")
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.route = UNMATCHED_ROUTE
+        self.started = self.routed_at = self.called_at = perf_counter()
+
+    def routed(self, route):
+        # route is None when routing rejected the request, e.g. with a 404 or a 405
+        if route is not None:
+            self.route = route.path
+        self.routed_at = self.called_at = perf_counter()
+
+    def called(self):
+        self.called_at = perf_counter()
+
+    def finish(self, status):
+        finished = perf_counter()
+        self.metrics.observe(
+            self.route,
+            status,
+            finished - self.started,
+            self.routed_at - self.started,
+            self.called_at - self.routed_at,
+            finished - self.called_at,
+        )
+
+
+class NullTimer:
+    """
+    Used when metrics are turned off; every method is a no-op.
+    """
+    __slots__ = ()
+
+    def routed(self, route):
+        pass
+
+    def called(self):
+        pass
+
+    def finish(self, status):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.bucket_bounds = tuple(buckets)
+        self.routes = {}
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        # callables returning extra lines of Prometheus text, e.g. cache counters
+        self.collectors = []
+
+    def timer(self):
+        """
+        Starts timing a request and counts it as in flight until its timer finishes.
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        with self.lock:
+            self.in_flight += 1
+        return RequestTimer(self)
+
+    def observe(self, route, status, duration, routing, controller, serialization):
+        code = status[:3] if status else "500"
+        with self.lock:
+            self.in_flight -= 1
+            route_metrics = self.routes.get(route)
+            if route_metrics is None:
+                route_metrics = self.routes[route] = RouteMetrics(len(self.bucket_bounds))
+            route_metrics.buckets[bisect_left(self.bucket_bounds, duration)] += 1
+            route_metrics.duration_sum += duration
+            route_metrics.count += 1
+            phase_sums = route_metrics.phase_sums
+            phase_sums[0] += routing
+            phase_sums[1] += controller
+            phase_sums[2] += serialization
+            route_metrics.statuses[code] = route_metrics.statuses.get(code, 0) + 1
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            in_flight = self.in_flight
+            snapshot = [
+                (route, list(m.buckets), m.duration_sum, m.count, list(m.phase_sums), dict(m.statuses))
+                for route, m in self.routes.items()
+            ]
+
+        lines = [
+            "# HELP quapi_requests_in_flight Requests currently being handled.",
+            "# TYPE quapi_requests_in_flight gauge",
+            f"quapi_requests_in_flight {in_flight}",
+            "# HELP quapi_request_duration_seconds Time to handle a request, per route.",
+            "# TYPE quapi_request_duration_seconds histogram",
+        ]
+        for route, buckets, duration_sum, count, _, _ in snapshot:
+            label = escape_label(route)
+            cumulative = 0
+            for bound, bucket in zip(self.bucket_bounds, buckets):
+                cumulative += bucket
+                lines.append(f'quapi_request_duration_seconds_bucket{{route="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'quapi_request_duration_seconds_bucket{{route="{label}",le="+Inf"}} {count}')
+            lines.append(f'quapi_request_duration_seconds_sum{{route="{label}"}} {duration_sum}')
+            lines.append(f'quapi_request_duration_seconds_count{{route="{label}"}} {count}')
+
+        lines.append("# HELP quapi_requests_total Handled requests, per route and status code.")
+        lines.append("# TYPE quapi_requests_total counter")
+        for route, _, _, _, _, statuses in snapshot:
+            label = escape_label(route)
+            for code, total in sorted(statuses.items()):
+                lines.append(f'quapi_requests_total{{route="{label}",status="{code}"}} {total}')
+
+        lines.append("# HELP quapi_request_phase_seconds Time spent in each phase of a request, per route.")
+        lines.append("# TYPE quapi_request_phase_seconds summary")
+        for route, _, _, count, phase_sums, _ in snapshot:
+            label = escape_label(route)
+            for phase, phase_sum in zip(PHASES, phase_sums):
+                lines.append(f'quapi_request_phase_seconds_sum{{route="{label}",phase="{phase}"}} {phase_sum}')
+                lines.append(f'quapi_request_phase_seconds_count{{route="{label}",phase="{phase}"}} {count}')
+
+        for collector in self.collectors:
+            lines.extend(collector())
+        lines.append("")
+        return "\n".join(lines)
+
+
+metrics = Metrics(enabled=bool(METRICS_PATH))
@@ -0,0 +1,102 @@
+# middleware.py composes the middleware of a route with its controller methods, once.
+# Middleware is declared in routes.yaml with dotted paths, globally and per route; global ones run first:
+#
+#   middleware:
+#     - middlewares.timing.around_timing
+#   tweaks:
+#     controller:
+#       admin.users:
+#         path: /admin/users
+#         middleware:
+#           - core.probe.authenticate.require_authorization
+#
+# There are three kinds, marked with the decorators below:
+#
+# - @before: `before(request)` runs ahead of the controller; returning anything but None responds with it
+#   instead, e.g. `return "Unauthorized", "401 Unauthorized"`.
+# - @after: `after(request, result)` gets what the controller returned, and returns what to respond with.
+# - @around [default]: `around(request, call_next)` calls `call_next(request)` itself, or doesn't.
+#
+# Results are what controllers return: data, or a (data, status, content_type, origin) tuple.
+# Before and after middleware may be sync or async; around middleware of async controllers must be async.
+# Routes without middleware keep their controller methods untouched. On routes with a cache or coalescing,
+# the leading before middleware run ahead of both instead; see split_guards in core/initializers/router.py.
+
+import functools
+import importlib
+import inspect
+
+
+def before(middleware):
+    middleware.middleware_kind = "before"
+    return middleware
+
+
+def after(middleware):
+    middleware.middleware_kind = "after"
+    return middleware
+
+
+def around(middleware):
+    middleware.middleware_kind = "around"
+    return middleware
+
+
+def load_middleware(dotted_path):
+    module_name, _, name = dotted_path.rpartition(".")
+    return getattr(importlib.import_module(module_name), name)
+
+
+async def resolve(result):
+    return await result if inspect.isawaitable(result) else result
+
+
+def wrap(middleware, handler):
+    """
+    Returns a callable running `middleware` around `handler`; it's a coroutine function
+    when the handler is one, so the server keeps treating it as an async controller.
+    """
+    kind = getattr(middleware, "middleware_kind", "around")
+
+    if inspect.iscoroutinefunction(handler):
+        if kind == "before":
+            async def call(request):
+                response = await resolve(middleware(request))
+                return await handler(request) if response is None else response
+        elif kind == "after":
+            async def call(request):
+                return await resolve(middleware(request, await handler(request)))
+        else:
+            async def call(request):
+                return await middleware(request, handler)
+    else:
+        if kind == "before":
+            def call(request):
+                response = middleware(request)
+                return handler(request) if response is None else response
+        elif kind == "after":
+            def call(request):
+                return middleware(request, handler(request))
+        else:
+            def call(request):
+                return middleware(request, handler)
+
+    return functools.update_wrapper(call, handler)
+
+
+def compose(handler, middlewares):
+    """
+    Folds the middleware around a controller method into a single callable; the first one is the outermost.
+    """
+    for middleware in reversed(middlewares):
+        handler = wrap(middleware, handler)
+    return handler
+
+
+def compose_handlers(handlers, middlewares):
+    """
+    Returns the controller methods of a controller, e.g. {"GET": get}, each composed with the middleware.
+    """
+    if handlers is None or not middlewares:
+        return handlers
+    return {method: compose(handler, middlewares) for method, handler in handlers.items()}
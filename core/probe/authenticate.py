@@ -1,18 +1,264 @@
+# authenticate.py issues and verifies HS256 JSON Web Tokens, signed with the AUTH_SECRET environment variable.
+# Clients send them as `Authorization: Bearer <token>`, and the authenticated User is `request.user`.
+#
+# Verified tokens are kept in a bounded LRU cache keyed by a hash of the token, until they expire,
+# so repeated requests with the same token skip the signature check and the JSON decoding.
+# Revoked tokens are rejected right away, cached or not; revocations are kept per process.
+
+import base64
+import functools
+import hashlib
+import heapq
+import hmac
+import inspect
+import json
+import logging
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from core.constants import AUTH_CACHE_SIZE, AUTH_SECRET, AUTH_TOKEN_TTL, ENV
 from core.entities.user import User
+from core.essentials import STATUS, RequestException
+from core.middleware import before
+
+HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+class InvalidToken(RequestException):
+    def __init__(self, message="Invalid token."):
+        super().__init__(message, STATUS.UNAUTHORIZED_401)
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+ENCODED_HEADER = b64encode(json.dumps(HEADER, separators=(",", ":")).encode())
+
+
+class VerifiedToken:
+    __slots__ = ("claims", "user", "expires_at")
+
+    def __init__(self, claims, user, expires_at):
+        self.claims = claims
+        self.user = user
+        self.expires_at = expires_at
+
+
+class TokenCache:
+    """
+    An LRU cache of verified tokens bounded by `max_entries`. Expired tokens are evicted first,
+    using a heap ordered by expiry, before the least recently used ones.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.expiries = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time():
+                del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            heapq.heappush(self.expiries, (entry.expires_at, key))
+            if len(self.entries) > self.max_entries:
+                self.evict()
+
+    def evict(self):
+        now = time.time()
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= now:
+            expires_at, key = heapq.heappop(expiries)
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at == expires_at:
+                del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if len(expiries) > 2 * self.max_entries:
+            # drops the heap items of entries that were evicted as least recently used
+            self.expiries = [(entry.expires_at, key) for key, entry in self.entries.items()]
+            heapq.heapify(self.expiries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.expiries.clear()
+
+
+class RevocationList:
+    """
+    The revoked token ids [jti], each kept until the token would have expired anyway.
+    """
+
+    def __init__(self):
+        self.revoked = {}
+        self.lock = threading.Lock()
+
+    def revoke(self, jti, expires_at):
+        with self.lock:
+            now = time.time()
+            self.revoked = {revoked: until for revoked, until in self.revoked.items() if until > now}
+            self.revoked[jti] = expires_at
+
+    def is_revoked(self, jti):
+        return jti in self.revoked
+
+
+class Authenticator:
+    def __init__(self, secret, ttl=3600, cache_size=10000):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.cache = TokenCache(cache_size)
+        self.revocations = RevocationList()
+
+    def sign(self, signing_input):
+        return b64encode(hmac.new(self.secret, signing_input, hashlib.sha256).digest())
+
+    def issue(self, user, ttl=None, **claims):
+        """
+        Returns a signed token for the user; extra keyword arguments become claims.
+        """
+        now = int(time.time())
+        payload = {
+            **user.to_claims(),
+            **claims,
+            "iat": now,
+            "exp": now + (ttl if ttl is not None else self.ttl),
+            "jti": uuid.uuid4().hex,
+        }
+        signing_input = ENCODED_HEADER + b"." + b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        return (signing_input + b"." + self.sign(signing_input)).decode()
+
+    def verify(self, token):
+        """
+        Returns the VerifiedToken of a valid token, or raises InvalidToken.
+        """
+        key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        entry = self.cache.get(key)
+        if entry is not None:
+            if self.revocations.is_revoked(entry.claims.get("jti")):
+                raise InvalidToken("Token has been revoked.")
+            return entry
+
+        entry = self.decode(token)
+        self.cache.set(key, entry)
+        return entry
+
+    def decode(self, token):
+        try:
+            encoded_header, encoded_payload, signature = token.encode().split(b".")
+            header = json.loads(b64decode(encoded_header))
+        except ValueError:
+            raise InvalidToken()
+        # only HS256 is accepted, so tokens can't pick a weaker algorithm, e.g. "none"
+        if not isinstance(header, dict) or header.get("alg") != "HS256":
+            raise InvalidToken()
+        if not hmac.compare_digest(signature, self.sign(encoded_header + b"." + encoded_payload)):
+            raise InvalidToken()
+
+        try:
+            claims = json.loads(b64decode(encoded_payload))
+        except ValueError:
+            raise InvalidToken()
+        if not isinstance(claims, dict):
+            raise InvalidToken()
+        now = time.time()
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)) or expires_at <= now:
+            raise InvalidToken("Token has expired.")
+        not_before = claims.get("nbf")
+        if isinstance(not_before, (int, float)) and not_before > now:
+            raise InvalidToken("Token is not valid yet.")
+        if self.revocations.is_revoked(claims.get("jti")):
+            raise InvalidToken("Token has been revoked.")
+        return VerifiedToken(claims, User.from_claims(claims), expires_at)
+
+    def revoke(self, token):
+        """
+        Revokes a token; requests with it are rejected from now on, even if it's cached.
+        """
+        claims = self.verify(token).claims
+        self.revocations.revoke(claims.get("jti"), claims["exp"])
+
+    def authenticate(self, request):
+        """
+        Returns the User of the request's bearer token, None without one, or raises InvalidToken.
+        """
+        authorization = request.authorization
+        if not authorization:
+            return None
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise InvalidToken("Expected a bearer token.")
+        return self.verify(token.strip()).user
+
+
+def load_secret():
+    if AUTH_SECRET:
+        return AUTH_SECRET
+    if ENV == "production":
+        logging.warning("AUTH_SECRET is not set; tokens are signed with a random secret and won't survive a restart")
+    return secrets.token_bytes(32)
+
+
+authenticator = Authenticator(load_secret(), AUTH_TOKEN_TTL, AUTH_CACHE_SIZE)
 
 
 def authenticate(func):
-    def wrapper(*args, **kw):
-        request = args[0]
-        if request.authorization:
-            return func(*args, **kw)
+    if inspect.iscoroutinefunction(func):
+        # stays a coroutine function, so the ASGI application awaits it on the event loop
+        async def wrapper(*args, **kw):
+            request = args[0]
+            if request.user is not None:
+                return await func(*args, **kw)
+            return "Unauthorized Request", "401 Unauthorized"
+    else:
+        def wrapper(*args, **kw):
+            request = args[0]
+            if request.user is not None:
+                return func(*args, **kw)
+            return "Unauthorized Request", "401 Unauthorized"
+
+    return functools.update_wrapper(wrapper, func)
+
+
+@before
+def require_authorization(request):
+    """
+    The middleware form of `authenticate`, for routes.yaml:
+    `middleware: [core.probe.authenticate.require_authorization]`
+    """
+    if request.user is None:
         return "Unauthorized Request", "401 Unauthorized"
 
-    return wrapper
 
+def make_jwt(user: User, ttl=None, **claims):
+    return authenticator.issue(user, ttl, **claims)
 
-def make_jwt(user: User):
-    username = user.username
-    email = user.email
 
-    return f"{username}:{email}"
+def revoke_jwt(token):
+    authenticator.revoke(token)
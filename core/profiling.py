@@ -0,0 +1,319 @@
+# profiling.py profiles a sample of requests in production and writes their stacks as collapsed stacks,
+# the input of flamegraph tools [flamegraph.pl, speedscope, inferno], one file per route and process in PROFILE_DIR.
+#
+# A request is profiled when one of these picks it:
+# - PROFILE_SAMPLE_RATE, the fraction of every route's requests [default: 0, off]
+# - `profile` of a route in routes.yaml, e.g. `profile: 0.05`, or `profile: true` for every request
+# - an `X-Profile` header signed with PROFILE_SECRET; make one with `python -m core.profiling`
+#
+# Requests slower than PROFILE_SLOW_THRESHOLD seconds are logged with the time spent in each phase
+# [routing, controller, serialization] and, when they were profiled, their slowest stacks.
+# When none of this is configured, the server dispatches requests as if this module didn't exist.
+# Profiles are added up in memory and written every PROFILE_FLUSH_INTERVAL seconds by a background thread,
+# and at exit, so requests never wait on the disk.
+# Stacks are only collected under the WSGI application; the event loop of the ASGI application
+# runs other requests in the same thread, so there only the phases are logged.
+
+import atexit
+import hashlib
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from time import perf_counter, perf_counter_ns
+
+from core.constants import PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_SECRET, PROFILE_SLOW_THRESHOLD
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+# slowest stacks written to the slow request log
+SLOW_LOG_STACKS = 5
+
+# seconds between two writes of the profiles
+PROFILE_FLUSH_INTERVAL = 10.0
+
+profile_logger = logging.getLogger("quapi.profile")
+
+
+def sample_rate(config):
+    """
+    Returns the sample rate of a route's `profile` in routes.yaml, or None when it's not set.
+    """
+    if config is None or config is False:
+        return None
+    if config is True:
+        return 1.0
+    if isinstance(config, dict):
+        return float(config.get("sample_rate", 1.0))
+    return float(config)
+
+
+class StackNode:
+    __slots__ = ("parent", "label", "children", "self_ns")
+
+    def __init__(self, parent, label):
+        self.parent = parent
+        self.label = label
+        self.children = {}
+        self.self_ns = 0
+
+    def child(self, label):
+        node = self.children.get(label)
+        if node is None:
+            node = self.children[label] = StackNode(self, label)
+        return node
+
+
+# labels of Python functions, by code object
+code_labels = {}
+
+
+def code_label(frame):
+    code = frame.f_code
+    label = code_labels.get(code)
+    if label is None:
+        module = frame.f_globals.get("__name__", "?")
+        name = getattr(code, "co_qualname", code.co_name)
+        label = code_labels[code] = f"{module}:{name}:{code.co_firstlineno}"
+    return label
+
+
+def c_label(function):
+    module = getattr(function, "__module__", None) or "builtins"
+    return f"{module}:{getattr(function, '__qualname__', repr(function))}"
+
+
+class StackProfile:
+    """
+    A tracing profiler for one request, installed with sys.setprofile in the request's thread.
+    The time between two events is added to the stack running at the time, so the profile
+    is a tree of stacks with the time spent in each, the profiler's own time left out.
+    """
+
+    __slots__ = ("root", "node", "last")
+
+    def __init__(self):
+        self.root = self.node = StackNode(None, None)
+        self.last = perf_counter_ns()
+
+    def __call__(self, frame, event, arg):
+        node = self.node
+        node.self_ns += perf_counter_ns() - self.last
+        if event == "call":
+            self.node = node.child(code_label(frame))
+        elif event == "c_call":
+            self.node = node.child(c_label(arg))
+        elif node.parent is not None:
+            # return, c_return and c_exception
+            self.node = node.parent
+        self.last = perf_counter_ns()
+
+    def collapsed(self):
+        """
+        Returns {"a;b;c": microseconds} for every stack that spent time on its own.
+        """
+        stacks = {}
+        pending = [(child, child.label) for child in self.root.children.values()]
+        while pending:
+            node, path = pending.pop()
+            if node.self_ns >= 1000:
+                stacks[path] = stacks.get(path, 0) + node.self_ns // 1000
+            pending.extend((child, f"{path};{child.label}") for child in node.children.values())
+        return stacks
+
+
+class PhaseTimer:
+    """
+    Stands in for the request's metrics timer while it's dispatched, recording when each phase ended.
+    With a profiler, the request is profiled from the time it's routed when the profiler samples it.
+    """
+
+    __slots__ = ("timer", "route", "started", "routed_at", "called_at", "profiler", "environ", "profile")
+
+    def __init__(self, timer, profiler=None, environ=None):
+        self.timer = timer
+        self.route = None
+        self.started = self.routed_at = self.called_at = perf_counter()
+        self.profiler = profiler
+        self.environ = environ
+        self.profile = None
+
+    def routed(self, route):
+        self.route = route
+        self.routed_at = self.called_at = perf_counter()
+        self.timer.routed(route)
+        # the route dispatch resolved picks the sample rate
+        if self.profiler is not None and self.profiler.sampled(self.environ, route):
+            self.profile = StackProfile()
+            sys.setprofile(self.profile)
+
+    def called(self):
+        self.called_at = perf_counter()
+        self.timer.called()
+
+    def phases(self, finished):
+        return {
+            "routing": self.routed_at - self.started,
+            "controller": self.called_at - self.routed_at,
+            "serialization": finished - self.called_at,
+        }
+
+
+def sign(secret, expires):
+    return hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+
+
+def make_header(ttl=300, secret=PROFILE_SECRET):
+    """
+    Returns a value of the X-Profile header that's valid for `ttl` seconds.
+    """
+    expires = int(time.time()) + ttl
+    return f"{expires}.{sign(secret, expires)}"
+
+
+class Profiler:
+    def __init__(self, sample_rate=0.0, secret="", slow_threshold=0.0, directory="profiles"):
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.slow_threshold = slow_threshold
+        self.directory = directory
+        self.reset()
+
+    def reset(self):
+        # aggregated collapsed stacks per route, and the routes whose stacks changed since they were written;
+        # forked workers start their own
+        self.stacks = {}
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.flusher = None
+        self.profiled = 0
+
+    def is_enabled(self, routes):
+        return bool(
+            self.sample_rate or self.secret or self.slow_threshold
+            or any(route.profile_rate for route in routes)
+        )
+
+    def has_signed_header(self, environ):
+        value = environ.get(PROFILE_HEADER)
+        if not value or not self.secret:
+            return False
+        expires, _, signature = value.partition(".")
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(signature, sign(self.secret, expires))
+
+    def sampled(self, environ, route):
+        rate = route.profile_rate if route is not None and route.profile_rate is not None else self.sample_rate
+        return (rate and random.random() < rate) or self.has_signed_header(environ)
+
+    def wrap(self, dispatch):
+        """
+        Returns `dispatch` timing the phases of every request and profiling the sampled ones.
+        """
+        def profiled_dispatch(environ, timer):
+            phases = PhaseTimer(timer, self, environ)
+            status = "500 Internal Server Error"
+            try:
+                response = dispatch(environ, phases)
+                status = response[0]
+                return response
+            finally:
+                if phases.profile is not None:
+                    sys.setprofile(None)
+                self.finish(environ, phases, phases.profile, status)
+        return profiled_dispatch
+
+    def wrap_async(self, dispatch_async):
+        """
+        Same as wrap, for the ASGI application; only the phases are timed.
+        """
+        async def profiled_dispatch(environ, timer):
+            phases = PhaseTimer(timer)
+            status = "500 Internal Server Error"
+            try:
+                response = await dispatch_async(environ, phases)
+                status = response[0]
+                return response
+            finally:
+                self.finish(environ, phases, None, status)
+        return profiled_dispatch
+
+    def finish(self, environ, phases, profile, status):
+        finished = perf_counter()
+        duration = finished - phases.started
+        route = phases.route.path if phases.route is not None else None
+        stacks = profile.collapsed() if profile is not None else None
+        if stacks:
+            self.record(route, stacks)
+        if self.slow_threshold and duration >= self.slow_threshold:
+            self.log_slow(environ, status, duration, phases.phases(finished), stacks)
+
+    def record(self, route, stacks):
+        with self.lock:
+            self.profiled += 1
+            totals = self.stacks.setdefault(route, {})
+            for stack, microseconds in stacks.items():
+                totals[stack] = totals.get(stack, 0) + microseconds
+            self.changed.add(route)
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.flush_periodically, name="profile-flush", daemon=True)
+                self.flusher.start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(PROFILE_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the profiles of the routes whose stacks changed since they were last written.
+        """
+        with self.lock:
+            changed = {route: list(self.stacks[route].items()) for route in self.changed}
+            self.changed.clear()
+        for route, totals in changed.items():
+            path = self.profile_path(route)
+            # written aside and renamed, so the file is always complete
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(f"{path}.tmp", "w") as file:
+                    file.writelines(f"{stack} {microseconds}\n" for stack, microseconds in totals)
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                profile_logger.warning(f"Profile {path} can't be written: {e}")
+
+    def profile_path(self, route):
+        name = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") if route else "unmatched"
+        return os.path.join(self.directory, f"{name or 'root'}.{os.getpid()}.folded")
+
+    def log_slow(self, environ, status, duration, phases, stacks):
+        breakdown = ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in phases.items())
+        message = (
+            f"Slow request: {environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')} {status[:3]} "
+            f"{duration * 1000:.1f}ms [{breakdown}]"
+        )
+        if stacks:
+            slowest = sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:SLOW_LOG_STACKS]
+            message += "".join(f"\n    {microseconds}us {stack}" for stack, microseconds in slowest)
+        profile_logger.warning(message)
+
+
+profiler = Profiler(PROFILE_SAMPLE_RATE, PROFILE_SECRET, PROFILE_SLOW_THRESHOLD, PROFILE_DIR)
+
+os.register_at_fork(after_in_child=profiler.reset)
+atexit.register(profiler.flush)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Prints a signed X-Profile header to profile a request.")
+    parser.add_argument("--ttl", type=int, default=300, help="seconds the header stays valid")
+    args = parser.parse_args()
+    if not PROFILE_SECRET:
+        sys.exit("PROFILE_SECRET is not set")
+    print(f"X-Profile: {make_header(args.ttl)}")
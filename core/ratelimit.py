@@ -0,0 +1,253 @@
+# ratelimit.py limits how often clients can call the API, declared in routes.yaml with a `rate_limit` key,
+# globally at the top level and per route:
+#
+#   rate_limit:
+#     rate: 100/minute          # requests per second, minute, hour or day
+#     burst: 20                 # requests allowed at once [default: the count of the rate]
+#     key: ip                   # ip, user, header:X-Api-Key or global
+#     backend: core.ratelimit.SQLiteBackend   # optional, defaults to the in-process store
+#
+# A list of limits is accepted too, e.g. one per second and one per day. Every limit is a GCRA
+# [generic cell rate algorithm]: a token bucket that stores a single timestamp per client key.
+# Requests over a limit are answered with 429 Too Many Requests and a Retry-After header,
+# before the response cache and the controller. `rate_limit: false` exempts a route from the global limits.
+
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from core.cache import import_backend
+from core.constants import RATE_LIMIT_DB
+from core.essentials import STATUS, RequestException
+
+UNITS = {
+    "s": 1, "sec": 1, "second": 1,
+    "m": 60, "min": 60, "minute": 60,
+    "h": 3600, "hour": 3600,
+    "d": 86400, "day": 86400,
+}
+
+
+class RateLimitExceeded(RequestException):
+    def __init__(self, retry_after):
+        super().__init__("Too Many Requests", STATUS.TOO_MANY_REQUESTS_429)
+        # whole seconds until the request would be allowed, for the Retry-After header
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def parse_rate(rate):
+    """
+    Returns (count, period in seconds) for a rate such as "100/minute".
+    """
+    count, _, unit = str(rate).partition("/")
+    unit = unit.strip().lower()
+    if unit.endswith("s") and unit[:-1] in UNITS:
+        unit = unit[:-1]
+    if unit not in UNITS:
+        raise ValueError(f"Unknown rate limit unit in '{rate}', use one of s, minute, hour or day")
+    return int(count), UNITS[unit]
+
+
+class RateLimitBackend:
+    """
+    The interface of rate limit stores. `acquire` is one GCRA step and must be atomic per key:
+    it returns 0 and records the request when it's allowed, or the seconds to wait otherwise.
+    """
+
+    def acquire(self, key, interval, tolerance):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    An in-process store of theoretical arrival times, split into shards with a lock each,
+    so threads limiting different clients rarely wait for one another.
+    Keys whose bucket is full again are swept away as a shard grows.
+    """
+
+    def __init__(self, shards=64):
+        self.shards = [{} for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.sweep_at = [1024] * shards
+
+    def acquire(self, key, interval, tolerance):
+        index = hash(key) % len(self.shards)
+        arrivals = self.shards[index]
+        now = time.monotonic()
+        with self.locks[index]:
+            arrival = arrivals.get(key, now)
+            if arrival < now:
+                arrival = now
+            if arrival - now > tolerance:
+                return arrival - now - tolerance
+            arrivals[key] = arrival + interval
+            if len(arrivals) > self.sweep_at[index]:
+                self.sweep(index, now)
+        return 0.0
+
+    def sweep(self, index, now):
+        arrivals = self.shards[index]
+        for key in [key for key, arrival in arrivals.items() if arrival <= now]:
+            del arrivals[key]
+        # sweeping again only once the shard doubles keeps it amortized O(1) per request
+        self.sweep_at[index] = max(1024, 2 * len(arrivals))
+
+    def clear(self):
+        for arrivals, lock in zip(self.shards, self.locks):
+            with lock:
+                arrivals.clear()
+
+    def __len__(self):
+        return sum(map(len, self.shards))
+
+
+class SQLiteBackend(RateLimitBackend):
+    """
+    A store shared by every process of the host, in the SQLite file at RATE_LIMIT_DB,
+    e.g. for the workers of `python -m core.serve`. Each thread uses its own connection.
+    """
+
+    ACQUIRE = (
+        "INSERT INTO rate_limits (key, arrival) VALUES (:key, :now + :interval) "
+        "ON CONFLICT (key) DO UPDATE SET arrival = max(arrival, :now) + :interval "
+        "WHERE max(arrival, :now) - :now <= :tolerance "
+        "RETURNING arrival"
+    )
+    # expired keys are deleted every this many requests, per process
+    SWEEP_EVERY = 10000
+
+    def __init__(self, path=None):
+        self.path = path or RATE_LIMIT_DB or os.path.join(tempfile.gettempdir(), "quapi-rate-limits.sqlite3")
+        self.local = threading.local()
+        self.requests = 0
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        # connections are never shared with forked workers
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=5, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, arrival REAL NOT NULL) WITHOUT ROWID"
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def acquire(self, key, interval, tolerance):
+        connection = self.connection()
+        now = time.time()
+        parameters = {"key": key, "now": now, "interval": interval, "tolerance": tolerance}
+        if connection.execute(self.ACQUIRE, parameters).fetchone() is not None:
+            self.requests += 1
+            if self.requests % self.SWEEP_EVERY == 0:
+                connection.execute("DELETE FROM rate_limits WHERE arrival < ?", (now,))
+            return 0.0
+        row = connection.execute("SELECT arrival FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        return max(row[0] - now - tolerance, 0.001) if row is not None else 0.001
+
+    def clear(self):
+        self.connection().execute("DELETE FROM rate_limits")
+
+
+# backends are shared by every limit using them; their keys are namespaced per limit
+backends = {}
+backends_lock = threading.Lock()
+
+
+def load_backend(dotted_path):
+    with backends_lock:
+        backend = backends.get(dotted_path)
+        if backend is None:
+            backend = backends[dotted_path] = import_backend(dotted_path)() if dotted_path else MemoryBackend()
+        return backend
+
+
+def client_ip(request):
+    return request.environ.get("REMOTE_ADDR") or "-"
+
+
+def client_user(request):
+    # requests without a bearer token are limited by their IP address
+    user = request.user
+    if user is None:
+        return client_ip(request)
+    return f"user:{user.id or user.username}"
+
+
+def make_key_function(key):
+    if key == "ip":
+        return client_ip
+    if key == "user":
+        return client_user
+    if key == "global":
+        return lambda request: ""
+    if key.startswith("header:"):
+        environ_key = "HTTP_" + key[len("header:"):].strip().upper().replace("-", "_")
+        return lambda request: request.environ.get(environ_key) or client_ip(request)
+    raise ValueError(f"Unknown rate limit key '{key}', use ip, user, header:<name> or global")
+
+
+class RateLimit:
+    """
+    One limit, e.g. 100 requests per minute per IP address, kept under the `scope` namespace.
+    """
+
+    __slots__ = ("rate", "interval", "tolerance", "client_key", "backend", "scope")
+
+    def __init__(self, rate, burst=None, key="ip", backend=None, scope=""):
+        count, period = parse_rate(rate)
+        self.rate = rate
+        # a request is allowed every `interval` seconds, and `burst` of them at once
+        self.interval = period / count
+        self.tolerance = self.interval * ((burst or count) - 1)
+        self.client_key = make_key_function(key)
+        self.backend = load_backend(backend)
+        self.scope = f"{scope}|{rate}|{key}|"
+
+    def acquire(self, request):
+        return self.backend.acquire(self.scope + self.client_key(request), self.interval, self.tolerance)
+
+
+def make_limits(config, scope):
+    if not config:
+        return ()
+    if isinstance(config, dict):
+        config = [config]
+    return tuple(RateLimit(scope=scope, **limit) for limit in config)
+
+
+class RateLimiter:
+    """
+    The rate limits of one route, the global ones first; see the top of this module for its routes.yaml options.
+    """
+
+    def __init__(self, limits):
+        self.limits = tuple(limits)
+        self.limited = 0
+
+    @classmethod
+    def from_config(cls, config, path, global_limits=()):
+        if config is False:
+            return None
+        limits = global_limits + make_limits(config, path)
+        if not limits:
+            return None
+        return cls(limits)
+
+    def check(self, request):
+        """
+        Raises RateLimitExceeded when the request is over any of the limits.
+        """
+        for limit in self.limits:
+            retry_after = limit.acquire(request)
+            if retry_after:
+                self.limited += 1
+                raise RateLimitExceeded(retry_after)
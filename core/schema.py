@@ -0,0 +1,536 @@
+# schema.py validates request bodies against schemas declared per controller method, before the controller runs.
+# A schema is a dataclass, a TypedDict or a JSON Schema dict; it's compiled once into a decoder, a tree of
+# small functions, and the decoded body is `request.data`: an instance of the dataclass, or a dict.
+#
+#   @dataclass
+#   class NewDomain:
+#       name: str
+#       tags: list[str] = dataclasses.field(default_factory=list)
+#
+#   @validate(NewDomain)
+#   def post(request):
+#       return {"name": request.data.name}
+#
+# Schemas can be declared in routes.yaml too, per method, with dotted paths, JSON Schema files or inline:
+#
+#   schema:
+#     POST: controllers.domain.age.NewDomain
+#     PUT: schemas/domain.json
+#
+# Invalid bodies are answered with 400 and the errors, e.g. {"errors": [{"loc": "tags.0", "message": "..."}]}.
+# Form fields are strings, so numbers and booleans are converted from them; JSON bodies are never converted.
+
+import collections.abc
+import dataclasses
+import datetime
+import enum
+import functools
+import importlib
+import inspect
+import json
+import re
+import types
+import typing
+import uuid
+
+from core.essentials import FORM_CONTENT_TYPE, JSON_CONTENT_TYPE, STATUS, RequestException
+
+TRUE_STRINGS = frozenset(("true", "1", "yes", "on"))
+FALSE_STRINGS = frozenset(("false", "0", "no", "off", ""))
+
+# names of the Compiler methods for scalar types
+SCALARS = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+class Invalid(Exception):
+    """
+    Raised by decoders; `errors` is a list of (location, message), the location being a tuple of keys and indexes.
+    """
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+    @classmethod
+    def one(cls, message):
+        return cls([((), message)])
+
+    def prefixed(self, key):
+        return [((key,) + location, message) for location, message in self.errors]
+
+
+class ValidationError(RequestException):
+    def __init__(self, errors):
+        super().__init__({
+            "error": "Invalid request body.",
+            "errors": [
+                {"loc": ".".join(map(str, location)), "message": message} for location, message in errors
+            ],
+        }, STATUS.BAD_REQUEST_400)
+        self.errors = errors
+
+
+def type_name(value):
+    return "null" if value is None else type(value).__name__
+
+
+class Compiler:
+    """
+    Compiles schemas into decoders, functions of a value returning the decoded value or raising Invalid.
+    With `coerce`, strings are converted to the numbers and booleans the schema asks for, as in form fields.
+    """
+
+    def __init__(self, coerce=False):
+        self.coerce = coerce
+
+    def compile(self, schema):
+        if isinstance(schema, dict):
+            return self.json_schema(schema)
+        return self.annotation(schema)
+
+    # type annotations
+
+    def annotation(self, annotation):
+        if annotation is typing.Any or annotation is object:
+            return lambda value: value
+        if annotation is None or annotation is type(None):
+            return self.none()
+        if annotation in SCALARS:
+            return getattr(self, SCALARS[annotation])()
+        if annotation in (datetime.datetime, datetime.date, datetime.time, uuid.UUID):
+            return self.parsed(annotation)
+        if dataclasses.is_dataclass(annotation):
+            return self.dataclass(annotation)
+        if typing.is_typeddict(annotation):
+            return self.typed_dict(annotation)
+        if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+            return self.enum(annotation)
+
+        origin = typing.get_origin(annotation)
+        arguments = typing.get_args(annotation)
+        if origin is typing.Union or origin is types.UnionType:
+            members = [self.annotation(argument) for argument in arguments if argument is not type(None)]
+            return self.union(members, type(None) in arguments)
+        if origin is typing.Literal:
+            return self.literal(arguments)
+        if annotation is list or origin in (list, tuple, collections.abc.Sequence):
+            return self.array(self.annotation(arguments[0]) if arguments else None)
+        if annotation is dict or origin is dict:
+            return self.mapping(self.annotation(arguments[1]) if arguments else None)
+        raise TypeError(f"Unsupported schema type: {annotation!r}")
+
+    def none(self):
+        def decode(value):
+            if value is not None:
+                raise Invalid.one(f"expected null, got {type_name(value)}")
+            return None
+        return decode
+
+    def string(self):
+        def decode(value):
+            if type(value) is not str:
+                raise Invalid.one(f"expected a string, got {type_name(value)}")
+            return value
+        return decode
+
+    def integer(self):
+        coerce = self.coerce
+
+        def decode(value):
+            if type(value) is int:
+                return value
+            if coerce and type(value) is str:
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+            raise Invalid.one(f"expected an integer, got {type_name(value)}")
+        return decode
+
+    def number(self):
+        coerce = self.coerce
+
+        def decode(value):
+            if type(value) is float or type(value) is int:
+                return float(value)
+            if coerce and type(value) is str:
+                try:
+                    return float(value)
+                except ValueError:
+                    pass
+            raise Invalid.one(f"expected a number, got {type_name(value)}")
+        return decode
+
+    def boolean(self):
+        coerce = self.coerce
+
+        def decode(value):
+            if type(value) is bool:
+                return value
+            if coerce and type(value) is str:
+                lowered = value.lower()
+                if lowered in TRUE_STRINGS:
+                    return True
+                if lowered in FALSE_STRINGS:
+                    return False
+            raise Invalid.one(f"expected a boolean, got {type_name(value)}")
+        return decode
+
+    def parsed(self, cls):
+        parse = cls if cls is uuid.UUID else cls.fromisoformat
+
+        def decode(value):
+            if type(value) is str:
+                try:
+                    return parse(value)
+                except ValueError:
+                    pass
+            raise Invalid.one(f"expected {cls.__name__} as a string")
+        return decode
+
+    def enum(self, cls):
+        choices = [member.value for member in cls]
+
+        def decode(value):
+            try:
+                return cls(value)
+            except ValueError:
+                raise Invalid.one(f"expected one of {choices}")
+        return decode
+
+    def literal(self, choices):
+        # a tuple, as JSON Schema enums may hold arrays and objects
+        allowed = tuple(choices)
+
+        def decode(value):
+            if value in allowed:
+                return value
+            raise Invalid.one(f"expected one of {list(choices)}")
+        return decode
+
+    def union(self, decoders, nullable):
+        def decode(value):
+            if value is None and nullable:
+                return None
+            errors = []
+            for member in decoders:
+                try:
+                    return member(value)
+                except Invalid as e:
+                    errors.extend(e.errors)
+            raise Invalid(errors[-1:])
+        return decode
+
+    def array(self, item):
+        def decode(value):
+            if type(value) is not list:
+                raise Invalid.one(f"expected an array, got {type_name(value)}")
+            if item is None:
+                return value
+            items = []
+            errors = None
+            for index, element in enumerate(value):
+                try:
+                    items.append(item(element))
+                except Invalid as e:
+                    errors = (errors or []) + e.prefixed(index)
+            if errors:
+                raise Invalid(errors)
+            return items
+        return decode
+
+    def mapping(self, item):
+        def decode(value):
+            if type(value) is not dict:
+                raise Invalid.one(f"expected an object, got {type_name(value)}")
+            if item is None:
+                return value
+            items = {}
+            errors = None
+            for key, element in value.items():
+                try:
+                    items[key] = item(element)
+                except Invalid as e:
+                    errors = (errors or []) + e.prefixed(key)
+            if errors:
+                raise Invalid(errors)
+            return items
+        return decode
+
+    def fields(self, fields, make):
+        """
+        Returns the decoder of an object with known fields; `fields` are (name, decoder, required, default)
+        and `make` turns the decoded fields into the result. Unknown keys are ignored.
+        """
+        fields = tuple(fields)
+
+        def decode(value):
+            if type(value) is not dict:
+                raise Invalid.one(f"expected an object, got {type_name(value)}")
+            decoded = {}
+            errors = None
+            for name, field_decoder, required, default in fields:
+                try:
+                    element = value[name]
+                except KeyError:
+                    if required:
+                        errors = (errors or []) + [((name,), "field required")]
+                    elif default is not dataclasses.MISSING:
+                        decoded[name] = default
+                    continue
+                try:
+                    decoded[name] = field_decoder(element)
+                except Invalid as e:
+                    errors = (errors or []) + e.prefixed(name)
+            if errors:
+                raise Invalid(errors)
+            return make(decoded)
+        return decode
+
+    def dataclass(self, cls):
+        hints = typing.get_type_hints(cls)
+        fields = []
+        for field in dataclasses.fields(cls):
+            if not field.init:
+                continue
+            required = field.default is dataclasses.MISSING and field.default_factory is dataclasses.MISSING
+            # omitted fields are left to the dataclass, so default factories make fresh values
+            fields.append((field.name, self.annotation(hints[field.name]), required, dataclasses.MISSING))
+        return self.fields(fields, lambda decoded: cls(**decoded))
+
+    def typed_dict(self, cls):
+        hints = typing.get_type_hints(cls)
+        required_keys = cls.__required_keys__
+        fields = [
+            (name, self.annotation(hint), name in required_keys, dataclasses.MISSING) for name, hint in hints.items()
+        ]
+        return self.fields(fields, lambda decoded: decoded)
+
+    # JSON Schema; the subset of keywords that describes request bodies
+
+    def json_schema(self, schema):
+        checks = []
+        expected = schema.get("type")
+        if expected is not None:
+            checks.append(self.json_type(expected if isinstance(expected, list) else [expected]))
+        if "enum" in schema:
+            checks.append(self.literal(schema["enum"]))
+        if "const" in schema:
+            checks.append(self.literal([schema["const"]]))
+        if "anyOf" in schema:
+            checks.append(self.union([self.json_schema(member) for member in schema["anyOf"]], False))
+        checks.extend(self.json_bounds(schema))
+        if "properties" in schema or "required" in schema or "additionalProperties" in schema:
+            checks.append(self.json_object(schema))
+        if "items" in schema:
+            checks.append(self.json_array(schema["items"]))
+
+        if not checks:
+            return lambda value: value
+        if len(checks) == 1:
+            return checks[0]
+
+        def decode(value):
+            for check in checks:
+                value = check(value)
+            return value
+        return decode
+
+    def json_type(self, names):
+        types_ = tuple(JSON_TYPES[name] for name in names if name in JSON_TYPES)
+        integer = "integer" in names
+        number = "number" in names
+        coerce = self.coerce
+        expected = " or ".join(names)
+
+        def decode(value):
+            value_type = type(value)
+            if value_type in types_:
+                return value
+            if value_type is int and (integer or number):
+                return value
+            if value_type is float and (number or (integer and value.is_integer())):
+                return value
+            if coerce and value_type is str:
+                try:
+                    if integer:
+                        return int(value)
+                    if number:
+                        return float(value)
+                except ValueError:
+                    pass
+                if bool in types_ and value.lower() in TRUE_STRINGS | FALSE_STRINGS:
+                    return value.lower() in TRUE_STRINGS
+            raise Invalid.one(f"expected {expected}, got {type_name(value)}")
+        return decode
+
+    def json_bounds(self, schema):
+        for keyword, test, message in (
+            ("minimum", lambda value, bound: value >= bound, "at least"),
+            ("maximum", lambda value, bound: value <= bound, "at most"),
+            ("exclusiveMinimum", lambda value, bound: value > bound, "more than"),
+            ("exclusiveMaximum", lambda value, bound: value < bound, "less than"),
+        ):
+            if keyword in schema:
+                yield self.bound(schema[keyword], test, f"expected a number {message} {schema[keyword]}", (int, float))
+        for keyword, test, message, kinds in (
+            ("minLength", lambda value, bound: len(value) >= bound, "at least", (str,)),
+            ("maxLength", lambda value, bound: len(value) <= bound, "at most", (str,)),
+            ("minItems", lambda value, bound: len(value) >= bound, "at least", (list,)),
+            ("maxItems", lambda value, bound: len(value) <= bound, "at most", (list,)),
+        ):
+            if keyword in schema:
+                noun = "characters" if kinds == (str,) else "items"
+                yield self.bound(schema[keyword], test, f"expected {message} {schema[keyword]} {noun}", kinds)
+        if "pattern" in schema:
+            pattern = re.compile(schema["pattern"])
+
+            def decode(value):
+                if type(value) is str and pattern.search(value) is None:
+                    raise Invalid.one(f"expected a string matching {schema['pattern']!r}")
+                return value
+            yield decode
+
+    def bound(self, bound, test, message, kinds):
+        def decode(value):
+            # as in JSON Schema, bounds only apply to values of their kind
+            if type(value) in kinds and not test(value, bound):
+                raise Invalid.one(message)
+            return value
+        return decode
+
+    def json_object(self, schema):
+        required = frozenset(schema.get("required", ()))
+        properties = schema.get("properties", {})
+        declared = [
+            (name, self.json_schema(prop), name in required, prop.get("default", dataclasses.MISSING))
+            for name, prop in properties.items()
+        ]
+        undeclared = [(name, lambda value: value, True, dataclasses.MISSING) for name in required - properties.keys()]
+        fields = self.fields(declared + undeclared, lambda decoded: decoded)
+        additional = schema.get("additionalProperties", True)
+        if additional is True:
+            extra = None
+        elif additional is False:
+            extra = False
+        else:
+            extra = self.json_schema(additional)
+
+        def decode(value):
+            if type(value) is not dict:
+                return value
+            decoded = fields(value)
+            if extra is None:
+                for key, element in value.items():
+                    decoded.setdefault(key, element)
+                return decoded
+            errors = []
+            for key, element in value.items():
+                if key in properties:
+                    continue
+                if extra is False:
+                    errors.append(((key,), "unexpected field"))
+                    continue
+                try:
+                    decoded[key] = extra(element)
+                except Invalid as e:
+                    errors.extend(e.prefixed(key))
+            if errors:
+                raise Invalid(errors)
+            return decoded
+        return decode
+
+    def json_array(self, items):
+        item = self.json_schema(items)
+        decode_list = self.array(item)
+
+        def decode(value):
+            return decode_list(value) if type(value) is list else value
+        return decode
+
+
+json_compiler = Compiler()
+form_compiler = Compiler(coerce=True)
+
+
+class Validator:
+    """
+    The decoders of one schema, compiled once: one for JSON bodies, and one converting form fields.
+    """
+
+    __slots__ = ("schema", "decode_json", "decode_form")
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.decode_json = json_compiler.compile(schema)
+        self.decode_form = form_compiler.compile(schema)
+
+    def decode(self, value, form=False):
+        """
+        Returns the decoded value, or raises ValidationError.
+        """
+        try:
+            return (self.decode_form if form else self.decode_json)(value)
+        except Invalid as e:
+            raise ValidationError(e.errors) from None
+
+    def decode_request(self, request):
+        content_type = request.content_type
+        if content_type == JSON_CONTENT_TYPE:
+            return self.decode(request.json)
+        if content_type in (FORM_CONTENT_TYPE, ""):
+            return self.decode(request.form, form=True)
+        raise RequestException(f"Expected a JSON or form body, got {content_type}.", STATUS.UNSUPPORTED_MEDIA_TYPE_415)
+
+
+def load_schema(declaration):
+    """
+    Returns the schema of a routes.yaml declaration: an inline JSON Schema, a .json file, or the dotted path of a class.
+    """
+    if isinstance(declaration, dict):
+        return declaration
+    if declaration.endswith(".json"):
+        with open(declaration) as file:
+            return json.load(file)
+    module_name, _, name = declaration.rpartition(".")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def load_validators(declarations):
+    """
+    Returns {method: Validator} for the `schema` of a route in routes.yaml.
+    """
+    if not declarations:
+        return {}
+    return {method.upper(): Validator(load_schema(schema)) for method, schema in declarations.items()}
+
+
+def with_validator(handler, validator):
+    """
+    Returns the controller method decoding the request body into `request.data` before it runs.
+    """
+    if inspect.iscoroutinefunction(handler):
+        async def call(request):
+            request.data = validator.decode_request(request)
+            return await handler(request)
+    else:
+        def call(request):
+            request.data = validator.decode_request(request)
+            return handler(request)
+    return functools.update_wrapper(call, handler)
+
+
+def validate(schema):
+    """
+    Decorates a controller method with the schema of its request body; the schema is compiled right away.
+    """
+    validator = Validator(schema)
+    return lambda handler: with_validator(handler, validator)
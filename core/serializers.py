@@ -0,0 +1,108 @@
+# serializers.py is the JSON serialization engine used by `destruct`.
+# The backend is selected once at startup with the JSON_BACKEND environment variable:
+# "orjson", "msgspec", "stdlib" or "auto" [default], which picks the fastest installed one.
+# Every backend produces UTF-8 bytes directly and supports dataclasses and datetimes,
+# and parses request bodies with `loads`, raising ValueError for invalid JSON.
+
+import dataclasses
+import datetime
+import json
+import logging
+import uuid
+
+from core.constants import JSON_BACKEND
+
+
+def default(obj):
+    """
+    Makes the types orjson and msgspec support natively serializable with the stdlib json module.
+    """
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class StdlibSerializer:
+    name = "stdlib"
+
+    def __init__(self):
+        # one encoder is reused, json.dumps would build a new one for every call with options
+        self.encoder = json.JSONEncoder(separators=(",", ":"), default=default)
+
+    def dumps(self, data):
+        # the stdlib can only produce str, so this is the one backend with an encoding pass;
+        # the output is ASCII only, which is the cheapest string to encode
+        return self.encoder.encode(data).encode("ascii")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+        self.option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, data):
+        return self.orjson.dumps(data, option=self.option)
+
+    def loads(self, data):
+        # orjson.JSONDecodeError is a ValueError
+        return self.orjson.loads(data)
+
+
+class MsgspecSerializer:
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+        self.decode_error = msgspec.DecodeError
+
+    def dumps(self, data):
+        return self.encoder.encode(data)
+
+    def loads(self, data):
+        try:
+            return self.decoder.decode(data)
+        except self.decode_error as e:
+            raise ValueError(str(e)) from e
+
+
+SERIALIZERS = {
+    "orjson": OrjsonSerializer,
+    "msgspec": MsgspecSerializer,
+    "stdlib": StdlibSerializer,
+}
+
+
+def select_serializer(backend):
+    """
+    Returns an instance of the requested backend; "auto" tries orjson, then msgspec.
+    Falls back to the stdlib when the requested backend is not installed.
+    """
+    names = ("orjson", "msgspec") if backend == "auto" else (backend,)
+    for name in names:
+        serializer_class = SERIALIZERS.get(name)
+        if serializer_class is None:
+            logging.warning(f"Unknown JSON backend '{name}', using stdlib")
+            break
+        try:
+            return serializer_class()
+        except ImportError:
+            if backend != "auto":
+                logging.warning(f"JSON backend '{name}' is not installed, using stdlib")
+    return StdlibSerializer()
+
+
+serializer = select_serializer(JSON_BACKEND)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# serve.py is the preforking multi-process server runner:
+#
+#   PYTHONPATH=. python -m core.serve --workers 4 --threads 8 --max-requests 10000
+#
+# The parent loads the route table and every controller once, then forks the workers, so their
+# memory pages are shared copy-on-write. The workers accept connections on one shared listening
+# socket, or with --reuse-port on their own SO_REUSEPORT sockets, where the kernel balances them.
+#
+# Signals to the parent: SIGHUP re-imports the controllers and replaces the workers gracefully,
+# SIGTERM/SIGINT stop the workers gracefully and exit.
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from core.initializers.registry import handler_registry
+from core.initializers.router import iter_routes, refresh_handlers
+from core.server import app
+from core.tasks import task_queue
+
+# how often the parent checks its workers and the workers check for a stop request
+POLL_INTERVAL = 0.5
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # requests are logged by the framework's access logger
+    def log_message(self, format, *args):
+        pass
+
+
+class WorkerServer(WSGIServer):
+    """
+    A WSGI server that accepts on an existing socket, optionally handles requests in a bounded
+    thread pool, and stops after max_requests requests so the parent can replace it.
+    """
+
+    def __init__(self, listener, threads=0, max_requests=0):
+        super().__init__(listener.getsockname()[:2], QuietRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        self.server_name = socket.getfqdn(listener.getsockname()[0])
+        self.server_port = listener.getsockname()[1]
+        self.setup_environ()
+        self.set_app(app)
+        self.timeout = POLL_INTERVAL
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request") if threads else None
+        self.max_requests = max_requests
+        self.handled = 0
+        self.stopping = False
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        if self.max_requests and self.handled >= self.max_requests:
+            self.stopping = True
+        if self.executor is None:
+            return super().process_request(request, client_address)
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def serve_until_stopped(self):
+        while not self.stopping:
+            self.handle_request()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.server_close()
+
+
+def create_listener(host, port, reuse_port=False, backlog=2048):
+    listener = socket.create_server((host, port), backlog=backlog, reuse_port=reuse_port)
+    # every worker is woken up by a new connection, the ones losing the race must not block in accept()
+    listener.setblocking(False)
+    return listener
+
+
+def reserve_port(host, port):
+    """
+    Binds without listening, so the port stays taken across reloads but never gets connections.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    reserved = socket.socket(family, socket.SOCK_STREAM)
+    reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    reserved.bind((host, port))
+    return reserved
+
+
+def run_worker(listener, args):
+    if listener is None:
+        listener = create_listener(args.host_name, args.port_number, reuse_port=True)
+    server = WorkerServer(listener, args.threads, args.max_requests)
+
+    def stop(signum, frame):
+        server.stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    task_queue.start()
+    server.serve_until_stopped()
+    # the tasks deferred by the last requests finish before the worker exits
+    task_queue.drain()
+
+
+class Arbiter:
+    """
+    The parent process; it keeps `workers` worker processes alive and handles the signals.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.reuse_port = args.reuse_port and hasattr(socket, "SO_REUSEPORT")
+        if self.reuse_port:
+            # every worker listens on its own socket
+            self.listener = reserve_port(args.host_name, args.port_number)
+        else:
+            self.listener = create_listener(args.host_name, args.port_number)
+        self.workers = set()
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return pid
+
+        # worker process
+        status = 0
+        try:
+            run_worker(None if self.reuse_port else self.listener, self.args)
+        except Exception:
+            logging.exception("Worker crashed")
+            status = 1
+        finally:
+            sys.exit(status)
+
+    def stop_workers(self, workers):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            self.workers.discard(pid)
+
+    def reload(self):
+        # new workers are forked with the re-imported controllers, then the old ones finish their requests
+        handler_registry.reload()
+        refresh_handlers()
+        old_workers = set(self.workers)
+        for _ in range(self.args.workers):
+            self.spawn()
+        self.stop_workers(old_workers)
+        logging.info("Reloaded %s workers", self.args.workers)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        for _ in range(self.args.workers):
+            self.spawn()
+        logging.info(f"Serving on http://{self.args.host_name}:{self.args.port_number}/ with {self.args.workers} workers")
+
+        while not self.stopping:
+            time.sleep(POLL_INTERVAL)
+            self.reap()
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            # replaces workers that exited, e.g. after max_requests
+            while not self.stopping and len(self.workers) < self.args.workers:
+                self.spawn()
+
+        self.stop_workers(self.workers)
+        while self.workers:
+            self.reap()
+            time.sleep(0.05)
+        self.listener.close()
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.reloading = True
+
+
+def preload():
+    """
+    Imports every controller in the parent, so the workers share them copy-on-write.
+    """
+    handler_registry.preload({route.controller_name for route in iter_routes()})
+    refresh_handlers()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Preforking multi-process server runner")
+    parser.add_argument('--host', dest='host_name',
+                        type=str, help='Host name to run the server.', default='localhost')
+    parser.add_argument('--port', dest='port_number',
+                        type=int, help='Port number to run the server.', default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes [default: number of CPUs].')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Threads per worker; 0 handles one request at a time per worker.')
+    parser.add_argument('--max-requests', dest='max_requests', type=int, default=0,
+                        help='Requests after which a worker is replaced; 0 never replaces it.')
+    parser.add_argument('--reuse-port', dest='reuse_port', action='store_true',
+                        help='Give every worker its own SO_REUSEPORT socket, when available.')
+    return parser.parse_args(argv)
+
+
+def serve(argv=None):
+    args = parse_args(argv)
+    preload()
+    Arbiter(args).run()
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,15 +1,151 @@
 #!/usr/bin/env python3
 
-import importlib
-import json
+import asyncio
+import dataclasses
+import inspect
+import io
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from core.constants import ENV
-from essentials import Request
-from core.initializers.router import paths
+from core.batch import batch
+from core.client import http_client
+from core.compression import compression_stats, variant_cache
+from core.constants import ASGI_THREAD_POOL_SIZE, BATCH_PATH, ENV, GLOBAL_METHODS, METRICS_PATH
+from core.essentials import DEFERRED_TASKS_KEY, STATUS, Request, RequestException, StreamingResponse
+from core.initializers.database import database
+from core.initializers.router import iter_routes, resolve_route
+from core.logger import ACCESS_LOGGER_NAME
+from core.metrics import PROMETHEUS_CONTENT_TYPE, escape_label, metrics
+from core.probe.authenticate import authenticator
+from core.profiling import profiler
+from core.ratelimit import RateLimitExceeded
+from core.serializers import serializer
+from core.tasks import task_queue
 
-GLOBAL_METHODS = ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"]
-RESTRICTED_PATH_NAMES = ["/favicon.ico", "/robots.txt", "/sitemap.xml", "/"]
+# plain (sync) controllers run here when served through asgi_app
+controller_executor = ThreadPoolExecutor(max_workers=ASGI_THREAD_POOL_SIZE, thread_name_prefix="controller")
+
+access_logger = logging.getLogger(ACCESS_LOGGER_NAME)
+
+# size of the blocks read from file objects returned by controllers
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def prepare_request(environ):
+    """
+    Resolves the route and the controller method for a request.
+    :param environ: WSGI environment
+    :return: tuple of (request, route, controller_method)
+
+    It raises RequestException with the message and the status to respond with
+    when the request can't be handed to a controller.
+    """
+    path = environ.get("PATH_INFO", "")
+
+    # the dispatch table is keyed by every accepted spelling of a path (/home, /home/, /home/index),
+    # so resolving a static route is a single lookup; pattern routes fall back to the route tree
+    route, params = resolve_route(path)
+    if route is None:
+        if ENV == "production":
+            raise RequestException("404 Not Found", "404 Not Found")
+        raise RequestException(
+            f"404 Not Found [{path}]. Make sure you have a controller for this path"
+            f" and you have resourced it to routes.yaml", "404 Not Found"
+        )
+
+    if params:
+        environ["wsgiorg.routing_args"] = ((), params)
+    request = Request(environ)
+
+    if type(request.method) is not str:
+        raise RequestException("Request method is not understood.", "400 Bad Request")
+
+    access_logger.info("[%s] Request: %s", request.method, request.path)
+
+    if route.allowed_methods is not None and request.method not in route.allowed_methods:
+        raise RequestException(f"Method is not allowed for path {request.path}", "405 Method Not Allowed")
+
+    if route.handlers is None:
+        logging.error(f"Controller {route.controller_name} not found.")
+        raise RequestException("Not Found.", "404 NOT FOUND")
+
+    controller_method = route.handlers.get(request.method)
+    if controller_method is None:
+        if request.method in GLOBAL_METHODS:
+            logging.error(f"Method {request.method} not found in {route.controller_name}")
+            raise RequestException("Method not allowed.", "405 METHOD NOT ALLOWED")
+        logging.error(f"The method {request.method} does not exist.")
+        raise RequestException(f"The method {request.method} does not exist.", "405 METHOD NOT ALLOWED")
+
+    return request, route, controller_method
+
+
+def call_controller(request, controller_method):
+    """
+    Runs the controller method and returns a tuple of (data, response).
+    """
+    try:
+        data = controller_method(request)
+        if inspect.iscoroutine(data):
+            # async controllers still work under WSGI, they just hold the worker while they run
+            data = asyncio.run(data)
+        request.close_db(commit=True)
+        return data, "200 OK"
+
+    except RequestException as e:
+        # controllers can raise it to respond with an error, e.g. for a malformed body
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        return e.message, e.status
+
+    except KeyError as e:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        error_message = f"400: {str(e)} NOT FOUND"
+        logging.error(error_message)
+        return f"{error_message}", "400 NOT FOUND"
+
+    except BaseException:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        raise
+
+
+async def call_controller_async(request, controller_method):
+    """
+    Same as call_controller, but awaits `async def` controllers on the event loop and offloads
+    plain controllers to the bounded thread pool, so they never block the loop.
+    """
+    try:
+        if inspect.iscoroutinefunction(controller_method):
+            data = await controller_method(request)
+        else:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(controller_executor, controller_method, request)
+            if inspect.iscoroutine(data):
+                # e.g. an `async def` controller under a plain decorator
+                data = await data
+        request.close_db(commit=True)
+        return data, "200 OK"
+
+    except RequestException as e:
+        # controllers can raise it to respond with an error, e.g. for a malformed body
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        return e.message, e.status
+
+    except KeyError as e:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        error_message = f"400: {str(e)} NOT FOUND"
+        logging.error(error_message)
+        return f"{error_message}", "400 NOT FOUND"
+
+    except BaseException:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        raise
 
 
 def render_api(environ):
@@ -27,57 +163,482 @@ def render_api(environ):
     The data can be a string, list, or dict.
     The response can be any valid HTTP response code.
     """
-    request = Request(environ)
-    if len(request.path.split("/")) == 2 and not request.path in RESTRICTED_PATH_NAMES:
-        # if the path is a single slash, then it's a root path,
-        # and we need to return the root controller; for /home it's home/index
-        request.path = f"{request.path}/index"
+    try:
+        request, _, controller_method = prepare_request(environ)
+    except RequestException as e:
+        return e.message, e.status
+
+    return call_controller(request, controller_method)
 
+
+async def render_api_async(environ):
+    """
+    Same as render_api, for the ASGI application.
+    """
     try:
-        # now, we need to get the controller name
-        # the controller name is the name of the controller file; for /home it's home/index.py
-        # it doesn't use .get() because we want to raise an error if the path doesn't exist; aggressive
-        controller_name = paths[request.path]['controller_name']
-    except KeyError:
-        if ENV == "production":
-            return "404 Not Found", "404 Not Found"
-        return f"404 Not Found [{request.path}]. Make sure you have a controller for this path" \
-               f" and you have resourced it to routes.yaml""", "404 Not Found"
+        request, _, controller_method = prepare_request(environ)
+    except RequestException as e:
+        return e.message, e.status
 
-    if type(request.method) is not str:
-        return "Request method is not understood.", "400 Bad Request"
+    return await call_controller_async(request, controller_method)
 
-    logging.info(f"[{request.method}] Request: {request.path}")
 
+def respond(environ):
+    """
+    Returns (status, headers, body) for a request and records its metrics.
+    """
+    path = environ.get("PATH_INFO")
+    if METRICS_PATH and path == METRICS_PATH:
+        return metrics_response()
+    if path == BATCH_PATH and BATCH_PATH:
+        return batch_response(environ)
+
+    timer = metrics.timer()
+    status = STATUS.INTERNAL_SERVER_ERROR_500
     try:
-        if paths[request.path].get("allowed_methods") is not None:
-            if request.method not in paths[request.path]["allowed_methods"]:
-                return f"Method is not allowed for path {request.path}", "405 Method Not Allowed"
-
-        mod = importlib.import_module(f"controllers.{controller_name}")
-        if hasattr(mod, request.method.lower()):
-            controller_method = getattr(mod, request.method.lower())
-            return controller_method(request), "200 OK"
-        elif request.method in GLOBAL_METHODS:
-            logging.error(f"Method {request.method} not found in {controller_name}")
-            return "Method not allowed.", "405 METHOD NOT ALLOWED"
-        else:
-            logging.error(f"The method {request.method} does not exist.")
-            return f"The method {request.method} does not exist.", "405 METHOD NOT ALLOWED"
+        response = handle(environ, timer)
+        status = response[0]
+        return response
+    finally:
+        timer.finish(status)
 
-    except ModuleNotFoundError:
-        logging.error(f"Controller {controller_name} not found.")
-        return "Not Found.", "404 NOT FOUND"
 
-    except KeyError as e:
-        error_message = f"400: {str(e)} NOT FOUND"
-        logging.error(error_message)
-        return f"{error_message}", "400 NOT FOUND"
+def dispatch(environ, timer):
+    """
+    Routes the request and runs its controller, unless it's over a rate limit of the route.
+    GET requests to routes with a `cache` in routes.yaml are answered from the response cache when possible,
+    and concurrent GET requests to routes with `coalesce` share one run of the controller.
+    Responses are compressed for the client unless the route turns it off.
+    """
+    try:
+        request, route, controller_method = prepare_request(environ)
+    except RequestException as e:
+        timer.routed(None)
+        return make_response(e.message, e.status)
+    timer.routed(route)
+
+    if route.rate_limit is not None:
+        response = limit_rate(request, route)
+        if response is not None:
+            return response
+
+    response = run_route(request, route, controller_method, timer)
+    if route.compression is not None:
+        response = route.compression.compress(environ, response, ResponseStream)
+    return response
+
+
+# dispatch, or dispatch under the profiler when profiling is configured, so it costs nothing otherwise
+handle = profiler.wrap(dispatch) if profiler.is_enabled(iter_routes()) else dispatch
+
+
+def limit_rate(request, route):
+    """
+    Returns a 429 response when the request is over one of the route's rate limits, None otherwise.
+    """
+    try:
+        route.rate_limit.check(request)
+    except RateLimitExceeded as e:
+        status, headers, body = make_response(e.message, e.status)
+        return status, headers + [("Retry-After", str(e.retry_after))], body
+    except RequestException as e:
+        # e.g. an invalid bearer token, for limits keyed by user
+        return make_response(e.message, e.status)
+    return None
+
+
+def check_guards(request, route):
+    """
+    Runs the before middleware guarding a route ahead of its cache and coalescing; returns the response
+    of the first one that answers, or None. See split_guards in core/initializers/router.py.
+    """
+    try:
+        for guard in route.guards:
+            result = guard(request)
+            if inspect.iscoroutine(result):
+                result = asyncio.run(result)
+            if result is not None:
+                request.close_db(commit=True)
+                return make_response(result, STATUS.OK_200)
+    except RequestException as e:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        return make_response(e.message, e.status)
+    except BaseException:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        raise
+    return None
+
+
+async def check_guards_async(request, route):
+    """
+    Same as check_guards, for the ASGI application.
+    """
+    try:
+        for guard in route.guards:
+            result = guard(request)
+            if inspect.isawaitable(result):
+                result = await result
+            if result is not None:
+                request.close_db(commit=True)
+                return make_response(result, STATUS.OK_200)
+    except RequestException as e:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        return make_response(e.message, e.status)
+    except BaseException:
+        request.close_db(commit=False)
+        request.cancel_deferred()
+        raise
+    return None
+
+
+def run_route(request, route, controller_method, timer):
+    if route.guards:
+        response = check_guards(request, route)
+        if response is not None:
+            timer.called()
+            return response
+
+    if request.method != "GET" or (route.cache is None and route.coalesce is None):
+        data = call_controller(request, controller_method)
+        timer.called()
+        return make_response(*data)
+
+    cache = route.cache
+    if cache is not None:
+        key = cache.key(request)
+        response = cache.lookup(key, request)
+        if response is not None:
+            timer.called()
+            return response
+
+    if route.coalesce is None:
+        data = call_controller(request, controller_method)
+        timer.called()
+        response = make_response(*data)
+    else:
+        def run_controller():
+            data = call_controller(request, controller_method)
+            # the leader's serialization is timed as such; the others wait for it as their controller time
+            timer.called()
+            return make_response(*data)
+
+        response, leader = route.coalesce.run(route.coalesce.key(request), run_controller)
+        if not leader:
+            timer.called()
+            if not is_shareable(response):
+                # a stream can only be sent once, so the other requests run the controller themselves
+                response = run_controller()
+
+    if cache is not None:
+        response = cache.store(key, request, response)
+    return response
+
+
+async def respond_async(environ):
+    """
+    Same as respond, for the ASGI application.
+    """
+    path = environ.get("PATH_INFO")
+    if METRICS_PATH and path == METRICS_PATH:
+        return metrics_response()
+    if path == BATCH_PATH and BATCH_PATH:
+        return await batch_response_async(environ)
+
+    timer = metrics.timer()
+    status = STATUS.INTERNAL_SERVER_ERROR_500
+    try:
+        response = await handle_async(environ, timer)
+        status = response[0]
+        return response
+    finally:
+        timer.finish(status)
+
+
+async def dispatch_async(environ, timer):
+    """
+    Same as dispatch, for the ASGI application.
+    """
+    try:
+        request, route, controller_method = prepare_request(environ)
+    except RequestException as e:
+        timer.routed(None)
+        return make_response(e.message, e.status)
+    timer.routed(route)
+
+    if route.rate_limit is not None:
+        response = limit_rate(request, route)
+        if response is not None:
+            return response
+
+    response = await run_route_async(request, route, controller_method, timer)
+    if route.compression is not None:
+        response = route.compression.compress(environ, response, ResponseStream)
+    return response
+
+
+handle_async = profiler.wrap_async(dispatch_async) if profiler.is_enabled(iter_routes()) else dispatch_async
+
+
+async def run_route_async(request, route, controller_method, timer):
+    if route.guards:
+        response = await check_guards_async(request, route)
+        if response is not None:
+            timer.called()
+            return response
+
+    if request.method != "GET" or (route.cache is None and route.coalesce is None):
+        data = await call_controller_async(request, controller_method)
+        timer.called()
+        return make_response(*data)
+
+    cache = route.cache
+    if cache is not None:
+        key = cache.key(request)
+        response = cache.lookup(key, request)
+        if response is not None:
+            timer.called()
+            return response
+
+    if route.coalesce is None:
+        data = await call_controller_async(request, controller_method)
+        timer.called()
+        response = make_response(*data)
+    else:
+        async def run_controller():
+            data = await call_controller_async(request, controller_method)
+            # the leader's serialization is timed as such; the others wait for it as their controller time
+            timer.called()
+            return make_response(*data)
+
+        response, leader = await route.coalesce.run_async(route.coalesce.key(request), run_controller)
+        if not leader:
+            timer.called()
+            if not is_shareable(response):
+                # a stream can only be sent once, so the other requests run the controller themselves
+                response = await run_controller()
+
+    if cache is not None:
+        response = cache.store(key, request, response)
+    return response
+
+
+def is_shareable(response):
+    # fully built responses can be sent to several clients; streams can't
+    return type(response[2]) is bytes
+
+
+def metrics_response():
+    body = metrics.render().encode("utf-8")
+    return make_response((body, STATUS.OK_200, PROMETHEUS_CONTENT_TYPE), STATUS.OK_200)
+
+
+def batch_response(environ):
+    """
+    Answers a batch request, running its sub-requests through respond; see core/batch.py.
+    """
+    try:
+        body = batch.run(environ, buffered_response)
+    except RequestException as e:
+        return make_response(e.message, e.status)
+    return make_response((body, STATUS.OK_200, "application/json"), STATUS.OK_200)
+
+
+async def batch_response_async(environ):
+    try:
+        body = await batch.run_async(environ, buffered_response_async)
+    except RequestException as e:
+        return make_response(e.message, e.status)
+    return make_response((body, STATUS.OK_200, "application/json"), STATUS.OK_200)
+
+
+def buffered_response(environ):
+    """
+    Same as respond, with the body of streamed responses read into bytes.
+    """
+    status, headers, body = respond(environ)
+    if type(body) is not bytes:
+        stream = ResponseStream(body.content)
+        try:
+            body = b"".join(stream)
+        finally:
+            stream.close()
+    return status, headers, body
+
+
+async def buffered_response_async(environ):
+    status, headers, body = await respond_async(environ)
+    if type(body) is not bytes:
+        chunks = []
+
+        async def collect(message):
+            chunks.append(message.get("body", b""))
+
+        await asgi_send_stream(collect, body)
+        body = b"".join(chunks)
+    return status, headers, body
+
+
+def cache_metrics():
+    """
+    Renders the counters of the response caches for the metrics endpoint.
+    """
+    lines = []
+    for name in ("hits", "misses", "evictions"):
+        lines.append(f"# HELP quapi_cache_{name}_total Response cache {name}, per route.")
+        lines.append(f"# TYPE quapi_cache_{name}_total counter")
+        for route in iter_routes():
+            if route.cache is not None:
+                value = route.cache.stats().get(name, 0)
+                lines.append(f'quapi_cache_{name}_total{{route="{escape_label(route.path)}"}} {value}')
+    return lines
+
+
+def http_client_metrics():
+    """
+    Renders the connection counters of the outbound HTTP client for the metrics endpoint.
+    """
+    lines = [
+        "# HELP quapi_http_client_connections_total Outbound connections, per host; created or reused.",
+        "# TYPE quapi_http_client_connections_total counter",
+    ]
+    for host, stats in http_client.stats().items():
+        label = escape_label(host)
+        lines.append(f'quapi_http_client_connections_total{{host="{label}",kind="created"}} {stats["created"]}')
+        lines.append(f'quapi_http_client_connections_total{{host="{label}",kind="reused"}} {stats["reused"]}')
+    return lines
+
+
+def database_metrics():
+    """
+    Renders the connection pool statistics of the database for the metrics endpoint.
+    """
+    if database is None:
+        return []
+    stats = database.stats()
+    return [
+        "# HELP quapi_db_pool_connections Database connections, idle or in use.",
+        "# TYPE quapi_db_pool_connections gauge",
+        f'quapi_db_pool_connections{{state="idle"}} {stats["idle"]}',
+        f'quapi_db_pool_connections{{state="in_use"}} {stats["in_use"]}',
+        "# HELP quapi_db_pool_wait_seconds Time spent waiting for a database connection.",
+        "# TYPE quapi_db_pool_wait_seconds summary",
+        f"quapi_db_pool_wait_seconds_sum {stats['wait_seconds']}",
+        f"quapi_db_pool_wait_seconds_count {stats['checkouts']}",
+        "# HELP quapi_db_pool_timeouts_total Requests that found no free database connection in time.",
+        "# TYPE quapi_db_pool_timeouts_total counter",
+        f"quapi_db_pool_timeouts_total {stats['timeouts']}",
+    ]
+
+
+def coalesce_metrics():
+    """
+    Renders the counters of request coalescing for the metrics endpoint.
+    """
+    lines = [
+        "# HELP quapi_coalesced_requests_total Requests that shared another request's controller run, per route.",
+        "# TYPE quapi_coalesced_requests_total counter",
+    ]
+    for route in iter_routes():
+        if route.coalesce is not None:
+            value = route.coalesce.stats()["coalesced"]
+            lines.append(f'quapi_coalesced_requests_total{{route="{escape_label(route.path)}"}} {value}')
+    return lines
+
+
+def compression_metrics():
+    """
+    Renders the totals of response compression, per encoding, for the metrics endpoint.
+    """
+    snapshot = compression_stats.snapshot()
+    lines = []
+    for name, help_text, value in (
+        ("responses_total", "Compressed responses", lambda totals: totals[0]),
+        ("bytes_saved_total", "Bytes saved by compression", lambda totals: totals[1] - totals[2]),
+        ("cpu_seconds_total", "CPU time spent compressing", lambda totals: totals[3]),
+    ):
+        lines.append(f"# HELP quapi_compression_{name} {help_text}, per encoding.")
+        lines.append(f"# TYPE quapi_compression_{name} counter")
+        for encoding, totals in snapshot.items():
+            lines.append(f'quapi_compression_{name}{{encoding="{encoding}"}} {value(totals)}')
+    lines.append("# HELP quapi_compression_variant_hits_total Responses sent with a cached compressed body.")
+    lines.append("# TYPE quapi_compression_variant_hits_total counter")
+    lines.append(f"quapi_compression_variant_hits_total {variant_cache.hits}")
+    return lines
+
+
+def rate_limit_metrics():
+    """
+    Renders the number of requests refused by rate limits, per route, for the metrics endpoint.
+    """
+    lines = [
+        "# HELP quapi_rate_limited_requests_total Requests answered with 429 Too Many Requests, per route.",
+        "# TYPE quapi_rate_limited_requests_total counter",
+    ]
+    for route in iter_routes():
+        if route.rate_limit is not None:
+            label = escape_label(route.path)
+            lines.append(f'quapi_rate_limited_requests_total{{route="{label}"}} {route.rate_limit.limited}')
+    return lines
+
+
+def token_cache_metrics():
+    """
+    Renders the counters of the verified token cache for the metrics endpoint.
+    """
+    cache = authenticator.cache
+    return [
+        "# HELP quapi_token_cache_hits_total Bearer tokens found verified in the token cache.",
+        "# TYPE quapi_token_cache_hits_total counter",
+        f"quapi_token_cache_hits_total {cache.hits}",
+        "# HELP quapi_token_cache_misses_total Bearer tokens whose signature had to be verified.",
+        "# TYPE quapi_token_cache_misses_total counter",
+        f"quapi_token_cache_misses_total {cache.misses}",
+    ]
+
+
+def task_queue_metrics():
+    """
+    Renders the queue depth and the counters of deferred tasks for the metrics endpoint.
+    """
+    stats = task_queue.stats()
+    return [
+        "# HELP quapi_tasks Deferred tasks, queued or running.",
+        "# TYPE quapi_tasks gauge",
+        f'quapi_tasks{{state="queued"}} {stats["queued"]}',
+        f'quapi_tasks{{state="running"}} {stats["running"]}',
+        "# HELP quapi_tasks_finished_total Deferred tasks that ran, completed or failed.",
+        "# TYPE quapi_tasks_finished_total counter",
+        f'quapi_tasks_finished_total{{result="completed"}} {stats["completed"]}',
+        f'quapi_tasks_finished_total{{result="failed"}} {stats["failed"]}',
+        "# HELP quapi_tasks_inline_total Deferred tasks run by the request's thread because the queue was full.",
+        "# TYPE quapi_tasks_inline_total counter",
+        f"quapi_tasks_inline_total {stats['inline']}",
+        "# HELP quapi_tasks_recovered_total Persisted tasks of stopped processes queued again at startup.",
+        "# TYPE quapi_tasks_recovered_total counter",
+        f"quapi_tasks_recovered_total {stats['recovered']}",
+    ]
+
+
+metrics.register(cache_metrics)
+metrics.register(coalesce_metrics)
+metrics.register(compression_metrics)
+metrics.register(http_client_metrics)
+metrics.register(database_metrics)
+metrics.register(token_cache_metrics)
+metrics.register(rate_limit_metrics)
+metrics.register(task_queue_metrics)
+
 
 def destruct(dumped_data, response_status=None, dumped_data_content_type=None, access_control_allow_origin=None):
-    if type(dumped_data) is list or type(dumped_data) is dict:
-        dumped_data = json.dumps(dumped_data)
+    if type(dumped_data) is list or type(dumped_data) is dict or is_dataclass_instance(dumped_data):
+        # the serializer produces the encoded bytes directly
+        dumped_data = serializer.dumps(dumped_data)
         dumped_data_content_type = "application/json" if dumped_data_content_type is None else dumped_data_content_type
+    elif type(dumped_data) is bytes:
+        dumped_data_content_type = "application/octet-stream" if dumped_data_content_type is None else dumped_data_content_type
     else:
         dumped_data = str(dumped_data)
         dumped_data_content_type = "text/plain"
@@ -86,34 +647,277 @@ def destruct(dumped_data, response_status=None, dumped_data_content_type=None, a
     
     if not access_control_allow_origin:
         access_control_allow_origin = "*"
-    logging.info(f'dumped_data_content_type: {dumped_data_content_type}')
+    access_logger.info('dumped_data_content_type: %s', dumped_data_content_type)
 
     return dumped_data, response_status, dumped_data_content_type, access_control_allow_origin, dumped_data_content_length
 
-# main server handler
-def app(environ, start_response):
-    response_tuple, response_status = render_api(environ)
 
+def is_dataclass_instance(data):
+    return dataclasses.is_dataclass(data) and not isinstance(data, type)
+
+
+def is_stream(data):
+    """
+    Streams are StreamingResponse objects, file objects, and iterators such as generators;
+    lists and dicts are data to serialize.
+    """
+    if type(data) in (str, list, dict, bytes):
+        return False
+    return (
+        isinstance(data, StreamingResponse)
+        or hasattr(data, "read")
+        or hasattr(data, "__next__")
+        or hasattr(data, "__anext__")
+    )
+
+
+def file_length(file):
+    """
+    Returns the number of bytes left in a file object, or None if it can't be known up front.
+    """
+    try:
+        return os.fstat(file.fileno()).st_size - file.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def encode_chunk(chunk):
+    return chunk.encode("utf-8") if type(chunk) is str else bytes(chunk)
+
+
+class ResponseStream:
+    """
+    Iterates over the content of a StreamingResponse as bytes chunks; file objects are read
+    in blocks, so memory per request stays constant regardless of the payload size.
+    Closing it closes the underlying content, as WSGI servers do once the response is sent.
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+    def __iter__(self):
+        content = self.content
+        if hasattr(content, "read"):
+            while True:
+                block = content.read(STREAM_BLOCK_SIZE)
+                if not block:
+                    return
+                yield encode_chunk(block)
+        else:
+            for chunk in content:
+                if chunk:
+                    yield encode_chunk(chunk)
+
+    def close(self):
+        close = getattr(self.content, "close", None)
+        if close is not None:
+            close()
+
+
+class DeferringBody:
+    """
+    Wraps the body of a response whose request deferred tasks; they're queued when the server closes it,
+    once the body is sent.
+    """
+
+    __slots__ = ("body", "tasks")
+
+    def __init__(self, body, tasks):
+        self.body = body
+        self.tasks = tasks
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            close = getattr(self.body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            task_queue.submit(self.tasks)
+
+
+def make_stream_response(stream, response_status=None, content_type=None, access_control_allow_origin=None):
+    """
+    Turns a stream returned by a controller into (status, headers, StreamingResponse).
+    Content-Length is only sent when the length is known up front, e.g. for files;
+    otherwise the server uses chunked transfer encoding.
+    """
+    if not isinstance(stream, StreamingResponse):
+        stream = StreamingResponse(stream)
+        if response_status:
+            stream.status = response_status
+        if content_type:
+            stream.content_type = content_type
+
+    if stream.content_length is None and hasattr(stream.content, "read"):
+        stream.content_length = file_length(stream.content)
+
+    headers = [
+        ("Content-Type", stream.content_type),
+        ("Access-Control-Allow-Origin", access_control_allow_origin or "*"),
+    ]
+    if stream.content_length is not None:
+        headers.insert(1, ("Content-Length", str(stream.content_length)))
+    return stream.status, headers, stream
+
+
+def make_response(response_tuple, response_status):
+    """
+    Turns what render_api returned into (status, headers, body) for the WSGI and ASGI applications.
+    The body is either bytes or a StreamingResponse.
+    """
     if type(response_tuple) is not tuple:
         response_tuple = (response_tuple,)
 
+    if is_stream(response_tuple[0]):
+        stream_status, headers, stream = make_stream_response(*response_tuple)
+        return stream_status or response_status, headers, stream
+
     (
-        dumped_data, new_response_status, 
-        dumped_data_content_type, access_control_allow_origin, 
+        dumped_data, new_response_status,
+        dumped_data_content_type, access_control_allow_origin,
         dumped_data_content_length
     ) = destruct(*response_tuple)
 
-
     response_status = new_response_status if new_response_status else response_status
 
-    start_response(
-        response_status, [
-            ("Content-Type", dumped_data_content_type),
-            ("Content-Length", str(dumped_data_content_length)),
-            ("Access-Control-Allow-Origin", access_control_allow_origin)
-        ]
-    )
-    return iter([dumped_data.encode("utf-8")])
+    # Content-Length is the length of the encoded body, not the number of characters
+    body = dumped_data.encode("utf-8") if type(dumped_data) is str else dumped_data
+    headers = [
+        ("Content-Type", dumped_data_content_type),
+        ("Content-Length", str(len(body))),
+        ("Access-Control-Allow-Origin", access_control_allow_origin)
+    ]
+    return response_status, headers, body
+
+
+# main server handler
+def app(environ, start_response):
+    response_status, headers, body = respond(environ)
+    start_response(response_status, headers)
+    tasks = environ.get(DEFERRED_TASKS_KEY)
+    if type(body) is bytes:
+        return iter([body]) if tasks is None else DeferringBody([body], tasks)
+
+    # files are handed to the server's file wrapper, which can use sendfile
+    file_wrapper = environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and hasattr(body.content, "read") and tasks is None:
+        return file_wrapper(body.content, STREAM_BLOCK_SIZE)
+    if tasks is not None:
+        return DeferringBody(ResponseStream(body.content), tasks)
+    return ResponseStream(body.content)
+
+
+def asgi_environ(scope, body):
+    """
+    Builds a WSGI-style environ from an ASGI HTTP scope, so Request and the router work unchanged.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "asgi.scope": scope,
+    }
+    client = scope.get("client")
+    if client:
+        environ["REMOTE_ADDR"] = client[0]
+    for name, value in scope.get("headers", ()):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def asgi_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            task_queue.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await task_queue.drain_async()
+            controller_executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# main ASGI handler; run it with any ASGI server, e.g. uvicorn core.server:asgi_app
+async def asgi_app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await asgi_lifespan(receive, send)
+    if scope["type"] != "http":
+        raise RuntimeError(f"Unsupported ASGI scope type {scope['type']}")
+
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+
+    environ = asgi_environ(scope, b"".join(chunks))
+    response_status, headers, body = await respond_async(environ)
+
+    await send({
+        "type": "http.response.start",
+        "status": int(response_status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    if type(body) is bytes:
+        await send({"type": "http.response.body", "body": body})
+    else:
+        await asgi_send_stream(send, body)
+
+    tasks = environ.get(DEFERRED_TASKS_KEY)
+    if tasks is not None:
+        await task_queue.submit_async(tasks)
+
+
+async def asgi_send_stream(send, stream):
+    """
+    Sends a StreamingResponse chunk by chunk. Sync iterators and files are advanced in the
+    controller thread pool, so reading them never blocks the event loop.
+    """
+    content = stream.content
+    if hasattr(content, "__aiter__"):
+        try:
+            async for chunk in content:
+                if chunk:
+                    await send({"type": "http.response.body", "body": encode_chunk(chunk), "more_body": True})
+        finally:
+            aclose = getattr(content, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    else:
+        response_stream = ResponseStream(content)
+        chunks = iter(response_stream)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(controller_executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            response_stream.close()
+
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
 
 
 if __name__ == "__main__":
@@ -133,4 +937,5 @@ if __name__ == "__main__":
     logging.info(f'Visit http://{args.host_name}:{args.port_number}/')
 
     # Serve until process is killed
+    task_queue.start()
     httpd.serve_forever()
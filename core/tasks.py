@@ -0,0 +1,331 @@
+# tasks.py runs work that controllers defer until their response is sent, e.g. sending an email
+# or updating a search index, so the client doesn't wait for it:
+#
+#   def post(request):
+#       order = create_order(request)
+#       request.defer(send_receipt, order["id"])
+#       return order
+#
+# Under the WSGI application, deferred tasks are queued once the server has sent the body, and run by a pool of
+# TASK_WORKERS threads per process. Under the ASGI application, `async def` tasks run on the event loop and plain
+# ones in the same threads. At most TASK_QUEUE_SIZE tasks wait; when the queue stays full for TASK_QUEUE_TIMEOUT
+# seconds, the request's own thread runs the task, which slows the server down instead of losing work.
+# Like the database session, the tasks of a controller that raises are dropped.
+# On shutdown, the queued tasks get TASK_DRAIN_TIMEOUT seconds to finish.
+#
+# With `persist_tasks: true` in db.yaml, tasks are also written to the `deferred_tasks` table of the database,
+# in the transaction of the request, and deleted once they ran; the ones a stopped process left behind are run
+# when the next one starts. Their function must be module-level and their arguments JSON serializable.
+
+import asyncio
+import atexit
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from core.cache import import_backend
+from core.constants import TASK_DRAIN_TIMEOUT, TASK_QUEUE_SIZE, TASK_QUEUE_TIMEOUT, TASK_WORKERS
+from core.essentials import DEFERRED_TASKS_KEY
+from core.initializers.database import database
+
+task_logger = logging.getLogger("quapi.tasks")
+
+CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS deferred_tasks ("
+    "id INTEGER PRIMARY KEY, function TEXT NOT NULL, arguments TEXT NOT NULL, "
+    "owner INTEGER NOT NULL, created_at REAL NOT NULL)"
+)
+
+
+class DeferredTask:
+    __slots__ = ("function", "args", "kwargs", "row_id")
+
+    def __init__(self, function, args=(), kwargs=None, row_id=None):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+        # id in the deferred_tasks table when tasks are persisted
+        self.row_id = row_id
+
+    @property
+    def name(self):
+        return f"{self.function.__module__}.{self.function.__qualname__}"
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TaskQueue:
+    """
+    The bounded queue of deferred tasks and the threads running them; see the top of this module.
+    """
+
+    def __init__(self, database=None, workers=4, size=1000, timeout=1.0, drain_timeout=30.0):
+        # persists the tasks when set
+        self.database = database
+        self.workers = workers
+        self.size = size
+        self.timeout = timeout
+        self.drain_timeout = drain_timeout
+        self.table_ready = False
+        self.reset()
+
+    def reset(self):
+        # forked workers start their own threads
+        self.queue = queue.Queue(self.size)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.accepting = True
+        self.started_at = time.time()
+        # coroutine tasks running on the event loop, and the semaphore bounding them
+        self.coroutines = set()
+        self.slots = None
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0
+        self.recovered = 0
+
+    def start(self):
+        """
+        Starts the worker threads, and queues the persisted tasks left by stopped processes.
+        """
+        with self.lock:
+            if self.threads or not self.accepting:
+                return
+            self.threads = [
+                threading.Thread(target=self.work, name=f"task-{index}", daemon=True) for index in range(self.workers)
+            ]
+        for thread in self.threads:
+            thread.start()
+        if self.database is not None:
+            self.recover()
+
+    def defer(self, request, function, args, kwargs):
+        task = DeferredTask(function, args, kwargs)
+        if self.database is not None:
+            task.row_id = self.persist(request.db, task)
+        request.environ.setdefault(DEFERRED_TASKS_KEY, []).append(task)
+
+    def submit(self, tasks):
+        """
+        Queues tasks for the worker threads. A task runs in the calling thread instead
+        when the queue stays full for `timeout` seconds, or once the queue is drained.
+        """
+        if not self.threads:
+            self.start()
+        for task in tasks:
+            if self.accepting:
+                try:
+                    self.queue.put(task, timeout=self.timeout)
+                    continue
+                except queue.Full:
+                    pass
+            with self.lock:
+                self.inline += 1
+            self.run(task)
+
+    async def submit_async(self, tasks):
+        """
+        Same as submit, for the ASGI application; `async def` tasks run on the event loop,
+        at most `size` of them at once.
+        """
+        loop = asyncio.get_running_loop()
+        for task in tasks:
+            if not inspect.iscoroutinefunction(task.function):
+                try:
+                    if not self.threads or not self.accepting:
+                        raise queue.Full
+                    self.queue.put_nowait(task)
+                except queue.Full:
+                    # waiting for room would block the event loop
+                    await loop.run_in_executor(None, self.submit, [task])
+                continue
+
+            if self.slots is None:
+                self.slots = asyncio.Semaphore(self.size)
+            try:
+                if not self.accepting:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self.slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                with self.lock:
+                    self.inline += 1
+                await self.run_async(task)
+                continue
+            coroutine = loop.create_task(self.run_async(task))
+            self.coroutines.add(coroutine)
+            coroutine.add_done_callback(self.coroutine_done)
+
+    def coroutine_done(self, coroutine):
+        self.coroutines.discard(coroutine)
+        self.slots.release()
+
+    def work(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            self.run(task)
+
+    def run(self, task):
+        with self.lock:
+            self.running += 1
+        try:
+            result = task.function(*task.args, **task.kwargs)
+            if inspect.iscoroutine(result):
+                asyncio.run(result)
+        except Exception:
+            failed = True
+            task_logger.exception(f"Deferred task {task.name} failed")
+        else:
+            failed = False
+        finally:
+            with self.lock:
+                self.running -= 1
+        self.finish(task, failed)
+
+    async def run_async(self, task):
+        with self.lock:
+            self.running += 1
+        try:
+            await task.function(*task.args, **task.kwargs)
+        except Exception:
+            failed = True
+            task_logger.exception(f"Deferred task {task.name} failed")
+        else:
+            failed = False
+        finally:
+            with self.lock:
+                self.running -= 1
+        if task.row_id is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.finish, task, failed)
+        else:
+            self.finish(task, failed)
+
+    def finish(self, task, failed):
+        with self.lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+        # failed tasks are logged, not retried
+        if task.row_id is not None:
+            with self.database.session() as session:
+                session.execute("DELETE FROM deferred_tasks WHERE id = ?", (task.row_id,))
+
+    def drain(self, timeout=None):
+        """
+        Stops taking tasks and waits up to `timeout` seconds [default: drain_timeout] for the queued ones.
+        """
+        with self.lock:
+            if not self.accepting:
+                return
+            self.accepting = False
+            threads = self.threads
+        deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+        try:
+            for _ in threads:
+                self.queue.put(None, timeout=max(deadline - time.monotonic(), 0))
+            for thread in threads:
+                thread.join(max(deadline - time.monotonic(), 0))
+        except queue.Full:
+            pass
+        left = sum(1 for task in list(self.queue.queue) if task is not None) + self.running
+        if left:
+            later = " they run at the next start" if self.database is not None else " they are lost"
+            task_logger.warning(f"{left} deferred tasks didn't finish before shutdown;{later}")
+
+    async def drain_async(self, timeout=None):
+        """
+        Same as drain, for the ASGI application; it waits for the tasks on the event loop too.
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        if self.coroutines:
+            await asyncio.wait(set(self.coroutines), timeout=timeout)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.drain, max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": self.queue.qsize(),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "inline": self.inline,
+                "recovered": self.recovered,
+            }
+
+    def create_table(self):
+        if not self.table_ready:
+            with self.database.session() as session:
+                session.execute(CREATE_TABLE)
+            self.table_ready = True
+
+    def persist(self, session, task):
+        """
+        Writes the task in the request's transaction, so it's only kept when the controller's changes are.
+        """
+        qualified_name = task.function.__qualname__
+        if "." in qualified_name or "<" in qualified_name:
+            raise TypeError(f"Deferred task {task.name} can't be persisted; it must be a module-level function")
+        arguments = json.dumps([task.args, task.kwargs])
+        self.create_table()
+        return session.execute(
+            "INSERT INTO deferred_tasks (function, arguments, owner, created_at) VALUES (?, ?, ?, ?)",
+            (task.name, arguments, os.getpid(), time.time()),
+        ).lastrowid
+
+    def recover(self):
+        """
+        Queues the persisted tasks of processes that stopped before running them.
+        """
+        self.create_table()
+        pid = os.getpid()
+        claimed = []
+        with self.database.session() as session:
+            for row in session.fetch_all("SELECT * FROM deferred_tasks ORDER BY id"):
+                # a task of this pid written before this process started was left by a previous one
+                owner = row["owner"]
+                if (owner == pid and row["created_at"] >= self.started_at) or (owner != pid and is_alive(owner)):
+                    continue
+                claim = session.execute(
+                    "UPDATE deferred_tasks SET owner = ? WHERE id = ? AND owner = ?", (pid, row["id"], owner)
+                )
+                if claim.rowcount:
+                    claimed.append(row)
+
+        for row in claimed:
+            try:
+                function = import_backend(row["function"])
+                args, kwargs = json.loads(row["arguments"])
+            except (ImportError, AttributeError, ValueError) as e:
+                task_logger.error(f"Deferred task {row['function']} can't be recovered: {e}")
+                self.finish(DeferredTask(None, row_id=row["id"]), failed=True)
+                continue
+            self.recovered += 1
+            self.queue.put(DeferredTask(function, tuple(args), kwargs, row["id"]))
+        if claimed:
+            task_logger.info(f"Recovered {len(claimed)} deferred tasks")
+
+
+task_queue = TaskQueue(
+    database if database is not None and database.persist_tasks else None,
+    TASK_WORKERS, TASK_QUEUE_SIZE, TASK_QUEUE_TIMEOUT, TASK_DRAIN_TIMEOUT,
+)
+
+os.register_at_fork(after_in_child=task_queue.reset)
+atexit.register(task_queue.drain)
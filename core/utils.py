@@ -2,11 +2,11 @@ from __future__ import annotations
 from types import ModuleType
 from typing import Any
 
-import importlib
 import logging
 
-from core.initializers.router import paths
-from core.constants import ENV, RESTRICTED_PATH_NAMES, GLOBAL_METHODS
+from core.initializers.registry import handler_registry
+from core.initializers.router import resolve_route
+from core.constants import ENV, GLOBAL_METHODS
 from core.essentials import Request, RequestException, STATUS
 
 
@@ -20,27 +20,25 @@ def get_controller_name(request: Request) -> tuple:
     request
     :type request: Request
     :return: a tuple containing the controller name for the given request path. If the path does not
-    exist in the `paths` dictionary, it returns a 404 error message and status code. If the environment
+    exist in the dispatch table, it returns a 404 error message and status code. If the environment
     is set to production, it only returns the status code.
     """
-    try:
-        # This code is retrieving the name of the controller file that corresponds to the given
-        # request path from the `paths` dictionary. The `paths` dictionary maps request paths to their
-        # corresponding controller names. If the request path is not found in the `paths` dictionary,
-        # it returns a 404 error message and status code. If the environment is set to production, it
-        # only returns the status code.
-        controller_name = paths[request.path]["controller_name"]
-        return controller_name
-
-    except KeyError:
-        if ENV == "production":
-            return "404 Not Found", "404 Not Found"
-        return (
-            f"404 Not Found [{request.path}]. Make sure you have a controller for this path"
-            f" and you have resourced it to routes.yaml"
-            "",
-            "404 Not Found",
-        )
+    # This code is retrieving the name of the controller file that corresponds to the given
+    # request path from the compiled dispatch table or, for pattern paths, the route tree.
+    # If no route matches the request path, it returns a 404 error message and status code.
+    # If the environment is set to production, it only returns the status code.
+    route, _ = resolve_route(request.path)
+    if route is not None:
+        return route.controller_name
+
+    if ENV == "production":
+        return "404 Not Found", "404 Not Found"
+    return (
+        f"404 Not Found [{request.path}]. Make sure you have a controller for this path"
+        f" and you have resourced it to routes.yaml"
+        "",
+        "404 Not Found",
+    )
 
 
 def get_module(request: Request) -> ModuleType:
@@ -56,16 +54,16 @@ def get_module(request: Request) -> ModuleType:
     module is not found, it raises a RequestException with a message and a 404 status code.
     """
     controller_name = get_controller_name(request)
-    try:
-        module = importlib.import_module(f"controllers.{controller_name}")
-        return module
-    except ModuleNotFoundError as exc:
+    # the registry imports every controller once and caches it; in development it re-imports
+    # controllers whose files changed
+    module = handler_registry.module(controller_name)
+    if module is None:
         logging.error(f"Controller {controller_name} not found.")
-        # return "Not Found.", "404 NOT FOUND"
         raise RequestException(
             f"Controller {controller_name} not found.",
             STATUS.NOT_FOUND_404,
-        ) from exc
+        )
+    return module
 
 
 def execute_module_attr(module: ModuleType, request: Request, attr: str) -> Any:
@@ -145,13 +143,15 @@ def validate_request(request: Request) -> Request:
     if not isinstance(request.method, str):
         raise RequestException("Method not understood", STATUS.METHOD_NOT_ALLOWED_405)
 
-    if paths.get(request.path):
-        if paths[request.path].get("allowed_methods") is not None:
-            if request.method not in paths[request.path]["allowed_methods"]:
-                raise RequestException(
-                    f"Method is not allowed for path {request.path}",
-                    STATUS.METHOD_NOT_ALLOWED_405,
-                )
+    route, params = resolve_route(request.path)
+    if route is not None:
+        if params:
+            request.params = params
+        if route.allowed_methods is not None and request.method not in route.allowed_methods:
+            raise RequestException(
+                f"Method is not allowed for path {request.path}",
+                STATUS.METHOD_NOT_ALLOWED_405,
+            )
     else:
         request.path = format_path(request.path)
 
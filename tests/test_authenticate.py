@@ -0,0 +1,48 @@
+# @authenticate on async controllers, served by the ASGI application.
+
+import asyncio
+import inspect
+import json
+import types
+
+import core.server
+from core.entities.user import User
+from core.initializers.registry import handler_registry
+from core.initializers.router import Route
+from core.probe.authenticate import authenticate, make_jwt
+from core.server import asgi_app
+
+
+@authenticate
+async def get(request):
+    await asyncio.sleep(0)
+    return {"username": request.user.username}
+
+
+def asgi_get(path, headers=()):
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": list(headers)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    body = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    return messages[0]["status"], body
+
+
+def test_authenticate_async_controller(monkeypatch):
+    # awaited on the event loop, not run in the controller thread pool
+    assert inspect.iscoroutinefunction(get)
+    handler_registry.register("secret.index", types.SimpleNamespace(get=get))
+    route = Route("/secret", "secret.index")
+    monkeypatch.setattr(core.server, "resolve_route", lambda path: (route, None))
+
+    assert asgi_get("/secret")[0] == 401
+    token = make_jwt(User("alice"))
+    status, body = asgi_get("/secret", [(b"authorization", f"Bearer {token}".encode())])
+    assert status == 200
+    assert json.loads(body) == {"username": "alice"}
@@ -0,0 +1,96 @@
+# The pooled HTTP client of core/client.py, against a local stand-in server.
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.client import HTTPClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+    def respond(self):
+        server = self.server
+        server.requests.append((self.command, self.path))
+        status = 200
+        if self.path == "/unavailable" and server.unavailable > 0:
+            server.unavailable -= 1
+            status = 503
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == "/close":
+            # closes the connection without telling the client, like a server ending an idle kept-alive one
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.unavailable = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client():
+    client = HTTPClient(max_connections=2, timeout=5, retries=2, backoff=0)
+    yield client
+    client.close()
+
+
+def pool_stats(client):
+    (stats,) = client.stats().values()
+    return stats
+
+
+def test_connections_are_reused(server, client):
+    for _ in range(5):
+        assert client.get(f"{server.url}/ok").json() == {"ok": True}
+    stats = pool_stats(client)
+    assert stats["created"] == 1
+    assert stats["reused"] == 4
+
+
+def test_unavailable_is_retried_for_get(server, client):
+    server.unavailable = 2
+    assert client.get(f"{server.url}/unavailable").status == 200
+    assert server.requests.count(("GET", "/unavailable")) == 3
+
+
+def test_unavailable_is_not_retried_for_post(server, client):
+    server.unavailable = 1
+    assert client.post(f"{server.url}/unavailable", json={}).status == 503
+    assert server.requests.count(("POST", "/unavailable")) == 1
+
+
+def test_closed_connection_is_replaced(server, client):
+    assert client.get(f"{server.url}/close").status == 200
+    # the kept-alive connection was closed by the server; the client replaces it without an error
+    assert client.get(f"{server.url}/ok").status == 200
+    stats = pool_stats(client)
+    # the closed one was handed out first, then replaced
+    assert stats["reused"] == 1
+    assert stats["created"] == 2
+    assert server.requests == [("GET", "/close"), ("GET", "/ok")]
@@ -0,0 +1,95 @@
+# Responses shared between requests, from the response cache or of coalesced requests, still go through
+# the before middleware of their route, e.g. require_authorization.
+
+import io
+import threading
+
+from core.cache import ResponseCache
+from core.coalesce import SingleFlight
+from core.entities.user import User
+from core.essentials import Request
+from core.initializers.router import Route
+from core.metrics import metrics
+from core.probe.authenticate import make_jwt, require_authorization
+from core.server import run_route
+
+
+def make_request(token=None):
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": "/private", "QUERY_STRING": "", "wsgi.input": io.BytesIO()}
+    if token is not None:
+        environ["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return Request(environ)
+
+
+def make_route(get, cache=None, coalesce=None):
+    route = Route("/private", "private.index", cache=cache, coalesce=coalesce, middleware=(require_authorization,))
+    return route, route.compose({"GET": get})["GET"]
+
+
+def call(route, request):
+    route, controller_method = route
+    return run_route(request, route, controller_method, metrics.timer())
+
+
+def test_cached_response_requires_authorization():
+    route = make_route(lambda request: {"owner": request.user.username}, cache=ResponseCache(ttl=60))
+    token = make_jwt(User("alice"))
+
+    assert call(route, make_request())[0].startswith("401")
+    status, _, body = call(route, make_request(token))
+    assert status.startswith("200") and b"alice" in body
+    # alice's response is in the cache now
+    assert call(route, make_request(token))[2] == body
+    assert call(route, make_request())[0].startswith("401")
+    # and it's alice's own
+    status, _, body = call(route, make_request(make_jwt(User("bob"))))
+    assert status.startswith("200") and b"bob" in body and b"alice" not in body
+
+
+def test_coalesced_response_requires_authorization():
+    started = threading.Event()
+    release = threading.Event()
+
+    def get(request):
+        started.set()
+        release.wait(5)
+        return {"owner": request.user.username}
+
+    route = make_route(get, coalesce=SingleFlight())
+    responses = {}
+    leader = threading.Thread(target=lambda: responses.update(alice=call(route, make_request(make_jwt(User("alice"))))))
+    leader.start()
+    assert started.wait(5)
+    try:
+        anonymous = call(route, make_request())
+    finally:
+        release.set()
+        leader.join(5)
+
+    assert anonymous[0].startswith("401")
+    assert b"alice" not in anonymous[2]
+    assert responses["alice"][0].startswith("200")
+
+
+def test_coalesced_response_is_per_user():
+    started = threading.Barrier(2, timeout=5)
+
+    def get(request):
+        # both requests run the controller at the same time, as they don't share a run
+        started.wait()
+        return {"owner": request.user.username}
+
+    route = make_route(get, coalesce=SingleFlight())
+    responses = {}
+
+    def request_as(username):
+        responses[username] = call(route, make_request(make_jwt(User(username))))
+
+    threads = [threading.Thread(target=request_as, args=(username,)) for username in ("alice", "bob")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert b"alice" in responses["alice"][2]
+    assert b"bob" in responses["bob"][2]